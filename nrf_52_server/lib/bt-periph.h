@@ -38,6 +38,8 @@ void bluetooth_advertiser_init();
 
 void sensor_notify(char* buf);
 
+void sensor_notify_len(char* buf, uint16_t len);
+
 void current_time_store(struct bt_cts_current_time *current_time);
 
 int discover_gatt_cts();
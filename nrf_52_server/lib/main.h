@@ -12,6 +12,12 @@
 
 #define SIZE_PAYLOAD 20
 
+/* Uncomment to send packed binary frames instead of the ASCII frame (cf. python_client/binary_frames.py)*/
+// #define BINARY_FRAMES
+/* Binary frame : id (uint8), timestamp (uint32), pressure (uint32), little endian*/
+#define FRAME_SIZE 9
+#define FRAMES_PER_NOTIFICATION (SIZE_PAYLOAD / FRAME_SIZE)
+
 void bluetooth_advertiser_init();
 
 /*!
@@ -355,6 +355,10 @@ void sensor_notify(char *buf) {
                  sizeof(uint8_t) * SIZE_PAYLOAD);
 }
 
+void sensor_notify_len(char *buf, uint16_t len) {
+  bt_gatt_notify(NULL, &my_lbs_svc.attrs[2], buf, len);
+}
+
 int discover_gatt_cts() {
   // printk("update_time_cts()");
   int err = 0;
@@ -9,6 +9,8 @@
 #include "bmp5.h"
 #include "bt-periph.h"
 
+#include <zephyr/sys/byteorder.h>
+
 #define DEVICE_ID 3
 #define SAMPLING_INTERVAL_MS 20
 /* Declare the LED devices*/
@@ -31,18 +33,26 @@ int8_t bmp5_rslt;
 int ret_led;
 
 void new_packet();
+int new_binary_frame();
 
 /* Work queue callback for sample processing*/
 static void sample_work_cb(struct k_work *work) {
   /*Get sensor data from the BMP581*/
   bmp5_rslt = get_sensor_data(&osr_odr_press_cfg, &dev);
 
+#ifdef BINARY_FRAMES
+  /* Append the packed frame, send the notification when it holds FRAMES_PER_NOTIFICATION frames*/
+  if (new_binary_frame()) {
+    sensor_notify_len(frame_payload, FRAMES_PER_NOTIFICATION * FRAME_SIZE);
+  }
+#else
   /* Make a new char array packet*/
   new_packet();
 
   /* Send the packet to the characteristic*/
   // printk("%s\n",frame_payload);
   sensor_notify(frame_payload);
+#endif
 }
 
 K_WORK_DEFINE(sample_work, sample_work_cb);
@@ -73,6 +83,24 @@ void new_packet() {
 
 }
 
+static uint8_t frames_in_payload = 0;
+
+int new_binary_frame() {
+  /* Frame : id (uint8), timestamp (uint32), pressure (uint32), little endian*/
+  uint8_t *frame = (uint8_t *)frame_payload + frames_in_payload * FRAME_SIZE;
+
+  frame[0] = DEVICE_ID;
+  sys_put_le32((uint32_t)current_time_ms, &frame[1]);
+  sys_put_le32((uint32_t)sensor_data.pressure, &frame[5]);
+
+  frames_in_payload++;
+  if (frames_in_payload < FRAMES_PER_NOTIFICATION) {
+    return 0;
+  }
+  frames_in_payload = 0;
+  return 1;
+}
+
 int main(void) {
   /* Initialize and check LED devices*/
   if (!gpio_is_ready_dt(&led_red)) {
@@ -0,0 +1,195 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from ingest_pipeline import ALIGNMENT_TOLERANCE_MS
+from session_store import read_session_frame
+
+
+def triplet_starts(ids, id_sequence=(1, 2, 3)):
+    """
+    This function finds the rows where an id sequence [1, 2, 3] starts.
+
+    The original buffer logic kept the last three rows, released them when their ids were 1, 2, 3 and
+    reset the buffer. For a sequence that cannot overlap itself (no proper prefix equal to a suffix, as
+    [1, 2, 3]), this is the same as keeping every window of three rows whose ids are 1, 2, 3, which can
+    be found over a strided view of the id column. Sequences such as (1, 1, 1) or (1, 2, 1) would give
+    overlapping windows, which the buffer reset never produced, and are rejected.
+
+    Parameters:
+    ids: array of device ids
+    id_sequence: tuple of the ids to look for, in order
+
+    Returns:
+    np.ndarray: positions of the first row of each matching window, ValueError for a self-overlapping sequence
+    """
+    if any(list(id_sequence[:size]) == list(id_sequence[-size:]) for size in range(1, len(id_sequence))):
+        raise ValueError(f"The id sequence {tuple(id_sequence)} overlaps itself, the windows would not be disjoint")
+
+    ids = np.asarray(ids)
+    sequence = np.asarray(id_sequence)
+    if ids.dtype.kind not in 'iuf':
+        # ids read as text (garbage rows in the csv): compare as the csv strings
+        ids = ids.astype(str)
+        sequence = sequence.astype(str)
+
+    if len(ids) < len(sequence):
+        return np.empty(0, dtype=np.intp)
+
+    windows = sliding_window_view(ids, len(sequence))
+    return np.flatnonzero((windows == sequence).all(axis=1))
+
+
+def filter_successive_ids(data_frame, id_sequence=(1, 2, 3)):
+    """
+    This function takes a DataFrame of pressure values as input and only keeps the rows that are part
+    of a successive [1, 2, 3] id sequence, without writing any file.
+
+    Parameters:
+    data_frame (pd.DataFrame): DataFrame containing columns 'id, timestamp, pressure_values'
+
+    Returns:
+    df (pd.DataFrame): DataFrame containing the aligned rows with columns 'id, timestamp, pressure_values'
+    """
+    starts = triplet_starts(data_frame['id'].to_numpy(), id_sequence)
+    rows = (starts[:, None] + np.arange(len(id_sequence))).ravel()
+
+    aligned = data_frame.iloc[rows].reset_index(drop=True)
+
+    # Garbage rows make pandas read the columns as text: restore the numeric types once they are filtered out
+    for column in aligned.columns:
+        if aligned[column].dtype.kind not in 'iufb':
+            try:
+                aligned[column] = pd.to_numeric(aligned[column])
+            except (ValueError, TypeError):
+                pass
+
+    return aligned
+
+
+def estimate_clock_offsets(data_frame, device_ids):
+    """
+    This function estimates the offset of the firmware clock of each device to the first one. The clocks are only
+    set to the time of day by the Current Time Service, so they can differ by more than a sampling period.
+
+    Rows received one after the other were sampled at about the same time: the offset of a device is the median
+    difference between its timestamps and those of the previous and next reading of the reference device in the
+    order of reception.
+
+    Parameters:
+    data_frame (pd.DataFrame): DataFrame containing columns 'id, timestamp' in the order of reception
+    device_ids: sorted ids of the devices, the first one is the reference
+
+    Returns:
+    dict {id: offset in ms}
+    """
+    received = data_frame[['id', 'timestamp']].assign(position=np.arange(len(data_frame)))
+    reference = received[received['id'] == device_ids[0]][['position', 'timestamp']] \
+        .rename(columns={'timestamp': 'reference_timestamp'})
+
+    offsets = {device_ids[0]: 0}
+    for device_id in device_ids[1:]:
+        readings = received[received['id'] == device_id][['position', 'timestamp']]
+        differences = [
+            pd.merge_asof(readings, reference, on='position', direction=direction)
+            .eval('timestamp - reference_timestamp').dropna()
+            for direction in ('backward', 'forward')
+        ]
+        differences = pd.concat(differences)
+        offsets[device_id] = int(round(differences.median())) if len(differences) else 0
+
+    return offsets
+
+
+def align_by_timestamp(data_frame, device_ids=None, tolerance_ms=ALIGNMENT_TOLERANCE_MS, clock_offsets=None):
+    """
+    This function aligns the readings of N devices by firmware timestamp instead of by row order.
+
+    The readings of the first device are the reference; the nearest reading of every other device within
+    tolerance_ms is joined to each of them (merge_asof). A reading is used in one group at most, and the groups
+    missing a device are dropped. The result has the same layout as filter_successive_ids(): one row per device,
+    in device id order, for each group, so calculate_deltas_elevation() works unchanged. The timestamps of the
+    devices are compared after removing the offsets of their clocks.
+
+    Parameters:
+    data_frame (pd.DataFrame): DataFrame containing columns 'id, timestamp, pressure_values', in any order
+    device_ids: ids of the devices to align, all the ids of the DataFrame if None
+    tolerance_ms: maximum difference between the timestamp of a reading and the reference
+    clock_offsets: dict {id: offset in ms} of the device clocks, estimated from the order of reception if None
+
+    Returns:
+    tuple (df (pd.DataFrame) of the aligned rows, dict report of the rows kept)
+    """
+    columns = list(data_frame.columns)
+    # Garbage rows (text in the csv) cannot be aligned
+    data_frame = data_frame.apply(pd.to_numeric, errors='coerce').dropna().astype(np.int64)
+
+    if device_ids is None:
+        device_ids = np.unique(data_frame['id'].to_numpy()).tolist()
+    device_ids = sorted(device_ids)
+    reference_id = device_ids[0]
+    if clock_offsets is None:
+        clock_offsets = estimate_clock_offsets(data_frame, device_ids)
+
+    # 'time' is the timestamp on the clock of the reference device
+    streams = {
+        device_id: data_frame[data_frame['id'] == device_id]
+        .assign(time=lambda readings, offset=clock_offsets.get(device_id, 0): readings['timestamp'] - offset)
+        .sort_values('time', kind='stable')
+        for device_id in device_ids
+    }
+    groups = streams[reference_id][['time', 'timestamp', 'pressure_values']].rename(
+        columns={'timestamp': f'timestamp_{reference_id}', 'pressure_values': f'pressure_values_{reference_id}'})
+
+    for device_id in device_ids[1:]:
+        stream = streams[device_id][['time', 'timestamp', 'pressure_values']].rename(
+            columns={'timestamp': f'timestamp_{device_id}', 'pressure_values': f'pressure_values_{device_id}'})
+        groups = pd.merge_asof(groups, stream, on='time', direction='nearest', tolerance=tolerance_ms)
+
+        # A reading joined to two references (loss on the reference device) only stays in the first group
+        duplicated = groups[f'timestamp_{device_id}'].duplicated() & groups[f'timestamp_{device_id}'].notna()
+        groups.loc[duplicated, f'timestamp_{device_id}'] = np.nan
+
+    groups = groups.dropna()
+
+    # Back to one row per device, groups in timestamp order and devices in id order inside a group
+    aligned = pd.DataFrame({
+        'id': np.tile(np.asarray(device_ids, dtype=np.int64), len(groups)),
+        'timestamp': groups[[f'timestamp_{device_id}' for device_id in device_ids]].to_numpy(np.int64).ravel(),
+        'pressure_values': groups[[f'pressure_values_{device_id}' for device_id in device_ids]].to_numpy(np.int64).ravel(),
+    })[[column for column in columns if column in ('id', 'timestamp', 'pressure_values')]]
+
+    rows_in = int(data_frame['id'].isin(device_ids).sum())
+    report = {
+        'rows_in': rows_in,
+        'rows_out': len(aligned),
+        'groups': len(groups),
+        'kept_fraction': len(aligned) / rows_in if rows_in else None,
+        'clock_offsets_ms': clock_offsets,
+        'kept_per_device': {
+            device_id: len(groups) / len(streams[device_id]) if len(streams[device_id]) else None
+            for device_id in device_ids
+        },
+    }
+    return aligned, report
+
+
+def read_aligned_csv(input_csv, id_sequence=(1, 2, 3), method='sequence', tolerance_ms=ALIGNMENT_TOLERANCE_MS):
+    """
+    This function reads a csv of pressure values (from its .pds file if there is an up to date one) and returns its
+    aligned rows.
+
+    Parameters:
+    input_csv: string containing the path to a csv with columns 'id, timestamp, pressure_values'
+    method: 'sequence' (rows in [1, 2, 3] order, as the labeled data was built) or 'timestamp'
+    tolerance_ms: tolerance of the 'timestamp' alignment
+
+    Returns:
+    df (pd.DataFrame): DataFrame containing the aligned rows
+    """
+    if method == 'timestamp':
+        return align_by_timestamp(read_session_frame(input_csv), id_sequence, tolerance_ms)[0]
+    if method != 'sequence':
+        raise ValueError(f"Unknown alignment method {method}, expected 'sequence' or 'timestamp'")
+
+    return filter_successive_ids(read_session_frame(input_csv), id_sequence)
@@ -0,0 +1,67 @@
+import glob
+import os
+import time
+
+import pandas as pd
+
+from preprocessing import preprocess_df_elevation, calculate_deltas_elevation
+
+'''
+    Benchmark of calculate_deltas_elevation against the former row by row implementation.
+    The files in Measurements/data_labeled only hold the resulting deltas, so the raw sessions
+    (id, timestamp, pressure_values) of Measurements/ are used as input.
+'''
+
+
+def calculate_deltas_elevation_loop(data_frame):
+    # Former implementation: one iloc / nunique / set_index per row
+    results = []
+    for i in range(len(data_frame) - 2):
+        subset = data_frame.iloc[i:i + 3]
+        if subset['id'].nunique() == 3:
+            elevation_value = subset.set_index('id')['elevation_value']
+            delta3_1 = elevation_value[3] - elevation_value[1]
+            delta3_2 = elevation_value[3] - elevation_value[2]
+            delta2_1 = elevation_value[2] - elevation_value[1]
+            results.append([i, delta3_1, delta3_2, delta2_1])
+
+    return pd.DataFrame(results, columns=['index', 'delta3_1', 'delta3_2', 'delta2_1'])
+
+
+def time_call(function, *args, repeat=3):
+    # Best of `repeat` runs, in seconds
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+def bench_deltas(input_folder='./Measurements'):
+    total_loop = 0.0
+    total_vectorized = 0.0
+
+    print(f"{'file':<55} {'rows':>7} {'loop [s]':>9} {'vector [s]':>11} {'speedup':>8}")
+    for file in sorted(glob.glob(os.path.join(input_folder, '*.csv'))):
+        df_elevation = preprocess_df_elevation(file)
+
+        t_loop, expected = time_call(calculate_deltas_elevation_loop, df_elevation, repeat=1)
+        t_vectorized, deltas = time_call(calculate_deltas_elevation, df_elevation)
+
+        if not deltas.equals(expected):
+            raise AssertionError(f"calculate_deltas_elevation differs from the loop on {file}")
+
+        total_loop += t_loop
+        total_vectorized += t_vectorized
+        print(f"{os.path.basename(file):<55} {len(df_elevation):>7} {t_loop:>9.3f} {t_vectorized:>11.5f} "
+              f"{t_loop / t_vectorized:>7.0f}x")
+
+    print(f"{'total':<55} {'':>7} {total_loop:>9.3f} {total_vectorized:>11.5f} {total_loop / total_vectorized:>7.0f}x")
+
+
+if __name__ == "__main__":
+    bench_deltas()
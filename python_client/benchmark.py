@@ -0,0 +1,260 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from alignment import filter_successive_ids
+from build_csv import build_csv
+from ingest_pipeline import process_raw_log
+from nrf_log_parser import parse_app
+from plot_values import preprocess_df
+from preprocessing import preprocess_df_elevation, calculate_deltas_elevation, calculate_mean_variance
+from simulated_ble import SIZE_PAYLOAD, format_frame
+
+'''
+    Benchmark of the ingest and preprocessing hot paths on synthetic sessions.
+
+    For each session length, the synthetic files (raw log, LOG.csv, nRF Connect log) are generated in a
+    temporary folder in the firmware frame format, then every function is timed (best of `repeat` runs) and its
+    peak Python memory is measured with tracemalloc in a separate run. The results are written as json:
+
+        python benchmark.py --rows 10000 100000 1000000 --output bench.json
+        python benchmark.py --rows 10000 100000 --compare bench.json
+
+    --compare reports the functions that are more than --tolerance slower than in a previous result file.
+'''
+
+DEFAULT_ROWS = [10000, 100000, 1000000]
+# Rows written to the synthetic files at once
+GENERATE_CHUNK_ROWS = 1 << 18
+
+
+def synthetic_frames(rows, loss=0.01, seed=0):
+    """
+    This function generates `rows` frames of three devices sampled at 50 Hz, with random notification losses
+    that break some [1, 2, 3] sequences.
+
+    Returns:
+    tuple (ids, timestamps, pressure_values) of np.ndarray
+    """
+    rng = np.random.default_rng(seed)
+    sent = int(rows / (1 - loss)) + 3
+    ids = np.tile(np.array([1, 2, 3]), sent // 3 + 1)[:sent]
+    kept = np.flatnonzero(rng.random(sent) >= loss)[:rows]
+
+    timestamps = 43200000 + (np.arange(sent) // 3) * 20
+    drift = np.cumsum(rng.integers(-1, 2, sent)) // 50
+    pressure = 101200 + drift + rng.integers(-8, 9, sent) + (ids == 3) * 19
+
+    return ids[kept], timestamps[kept], pressure[kept]
+
+
+def write_raw_log(path, frames):
+    # Lines as written by the client before the buffered writer: payload + "\n", i.e. frame then NUL padding
+    padding = '\x00' * (SIZE_PAYLOAD - 18)
+    with open(path, 'w') as outfile:
+        for start in range(0, len(frames[0]), GENERATE_CHUNK_ROWS):
+            chunk = zip(*(column[start:start + GENERATE_CHUNK_ROWS].tolist() for column in frames))
+            outfile.write(''.join(f"{i},{t:08d},{p:06d}\n{padding}\n" for i, t, p in chunk))
+
+
+def write_log_csv(path, frames):
+    pd.DataFrame({'id': frames[0], 'timestamp': frames[1], 'pressure_values': frames[2]}).to_csv(path, index=False)
+
+
+def write_nrf_log(path, frames):
+    # Application lines of nRF Connect, with a few lines of other log levels
+    with open(path, 'w') as outfile:
+        for start in range(0, len(frames[0]), GENERATE_CHUNK_ROWS):
+            chunk = zip(*(column[start:start + GENERATE_CHUNK_ROWS].tolist() for column in frames))
+            lines = []
+            for n, (i, t, p) in enumerate(chunk):
+                if n % 100 == 0:
+                    lines.append("I\t12:00:00.000\tNotification received\n")
+                payload = format_frame(i, t, p).hex('-').upper()
+                lines.append(f"A\t12:00:00.000\tNotification received from 75c276c4, value: (0x) {payload}\n")
+            outfile.write(''.join(lines))
+
+
+def prepare_session(folder, rows):
+    """
+    This function writes the synthetic files of a session and the DataFrames used as input by the functions.
+
+    Returns:
+    dict of the inputs
+    """
+    frames = synthetic_frames(rows)
+    session = {
+        'raw_log': os.path.join(folder, 'RAW_LOG.csv'),
+        'log_csv': os.path.join(folder, f'LOG_{rows}.csv'),
+        'nrf_log': os.path.join(folder, 'Log.txt'),
+    }
+    write_raw_log(session['raw_log'], frames)
+    write_log_csv(session['log_csv'], frames)
+    write_nrf_log(session['nrf_log'], frames)
+
+    session['log_df'] = pd.read_csv(session['log_csv'])
+    session['elevation_df'] = preprocess_df_elevation(session['log_csv'])
+    session['deltas_df'] = calculate_deltas_elevation(session['elevation_df'])
+    return session
+
+
+def benchmarks(folder):
+    """
+    Returns:
+    dict {name: function(session)} of the benchmarked calls
+    """
+    def run_build_csv(session):
+        # build_csv() works on ./RAW_LOG.csv and ./LOG.csv
+        current = os.getcwd()
+        os.chdir(folder)
+        try:
+            build_csv()
+        finally:
+            os.chdir(current)
+
+    return {
+        'build_csv': run_build_csv,
+        'process_raw_log': lambda session: sum(1 for _ in process_raw_log(session['raw_log'])),
+        'filter_successive_ids': lambda session: filter_successive_ids(session['log_df']),
+        'preprocess_df': lambda session: preprocess_df(session['log_csv']),
+        'preprocess_df_elevation': lambda session: preprocess_df_elevation(session['log_csv']),
+        'calculate_deltas_elevation': lambda session: calculate_deltas_elevation(session['elevation_df']),
+        'calculate_mean_variance': lambda session: calculate_mean_variance(session['deltas_df'].copy()),
+        'parse_app': lambda session: parse_app(session['nrf_log'], os.path.join(folder, 'LOG_nrf.csv')),
+    }
+
+
+def measure(function, session, repeat, memory):
+    """
+    Returns:
+    tuple (best time in s, peak memory in bytes or None)
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(session)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if memory:
+        # Separate run: tracemalloc slows down the allocations
+        tracemalloc.start()
+        try:
+            function(session)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return best, peak
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+    }
+
+
+def run_benchmarks(row_counts=DEFAULT_ROWS, functions=None, repeat=3, memory=True):
+    """
+    This function runs the benchmarks on synthetic sessions of each length.
+
+    Parameters:
+    row_counts: list of session lengths (frames)
+    functions: list of benchmark names, all if None
+    repeat: runs per measurement, the best time is kept
+    memory: measure the peak memory
+
+    Returns:
+    dict: environment and list of results (function, rows, time_s, rows_per_s, peak_memory_bytes)
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        calls = benchmarks(folder)
+        for name in functions or []:
+            if name not in calls:
+                raise ValueError(f"Unknown benchmark {name}, expected some of {list(calls)}")
+
+        for rows in row_counts:
+            print(f"generating a session of {rows} rows")
+            session = prepare_session(folder, rows)
+
+            for name, function in calls.items():
+                if functions and name not in functions:
+                    continue
+                elapsed, peak = measure(function, session, repeat, memory)
+                results.append({
+                    'function': name,
+                    'rows': rows,
+                    'time_s': elapsed,
+                    'rows_per_s': rows / elapsed if elapsed > 0 else None,
+                    'peak_memory_bytes': peak,
+                })
+                peak_text = f"{peak / 2 ** 20:9.1f} MiB" if peak is not None else ''
+                print(f"{name:<28} {rows:>10} {elapsed:>10.4f} s {rows / elapsed:>14.0f} rows/s {peak_text}")
+
+    return {'environment': environment(), 'results': results}
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    This function compares results to a previous run.
+
+    Returns:
+    list of dict of the measurements more than `tolerance` slower than the baseline
+    """
+    previous = {(result['function'], result['rows']): result for result in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        reference = previous.get((result['function'], result['rows']))
+        if reference is None:
+            continue
+        ratio = result['time_s'] / reference['time_s']
+        if ratio > 1 + tolerance:
+            regressions.append({'function': result['function'], 'rows': result['rows'], 'ratio': ratio})
+            print(f"regression: {result['function']} with {result['rows']} rows is {ratio:.2f}x slower")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the ingest and preprocessing functions")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="session lengths, e.g. 10000 10000000")
+    parser.add_argument("--functions", nargs="+", help="benchmarks to run, all by default")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory measurement")
+    parser.add_argument("--output", default=f"./benchmark_{datetime.now().strftime('%Y-%m-%d_%H-%M')}.json")
+    parser.add_argument("--compare", help="previous result file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="slowdown reported as a regression")
+    args = parser.parse_args()
+
+    bench = run_benchmarks(args.rows, args.functions, args.repeat, not args.no_memory)
+
+    if args.compare:
+        with open(args.compare, 'r') as infile:
+            bench['regressions'] = compare(bench, json.load(infile), args.tolerance)
+
+    with open(args.output, 'w') as outfile:
+        json.dump(bench, outfile, indent=4)
+    print(f"results saved to {args.output}")
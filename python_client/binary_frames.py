@@ -0,0 +1,101 @@
+import struct
+
+import numpy as np
+
+'''
+    Packed binary notifications of the sensors (firmware built with BINARY_FRAMES, cf. main.c).
+
+    A frame is 9 bytes, little endian: id (uint8), timestamp in ms (uint32), pressure in Pa (uint32). A notification
+    carries one or more frames back to back (2 in the 20 bytes of the default ATT MTU), instead of one 20 bytes
+    ASCII frame "%1d,%08lu,%06lu\\n". The first byte tells the formats apart (bmp581_client.is_binary(), without
+    importing numpy): a device id (< 0x30) for binary frames, an ASCII digit for the legacy ones. A payload starting
+    with a low byte that is not a whole number of frames with valid ids is rejected (decode_binary() returns None),
+    not written as frames.
+
+    The frames are decoded with np.frombuffer, without parsing text, and stored in preallocated arrays until the raw
+    log writer formats them in its thread.
+'''
+
+FRAME_STRUCT = struct.Struct('<BII')
+FRAME_SIZE = FRAME_STRUCT.size
+FRAME_DTYPE = np.dtype([('id', 'u1'), ('timestamp', '<u4'), ('pressure_values', '<u4')])
+
+# Device ids of the firmware, a single digit in the ASCII frames
+MIN_DEVICE_ID = 1
+MAX_DEVICE_ID = 9
+
+
+def decode_binary(data):
+    """
+    This function decodes the frames of a binary notification.
+
+    Parameters:
+    data: bytes-like payload of the notification
+
+    Returns:
+    np.ndarray of FRAME_DTYPE records, None if the payload is not a whole number of frames with valid device ids
+    """
+    if not data or len(data) % FRAME_SIZE:
+        return None
+    records = np.frombuffer(data, dtype=FRAME_DTYPE)
+    ids = records['id']
+    if ids.min() < MIN_DEVICE_ID or ids.max() > MAX_DEVICE_ID:
+        return None
+    return records
+
+
+def encode_binary(frames):
+    """
+    Parameters:
+    frames: iterable of (id, timestamp, pressure_values) tuples
+
+    Returns:
+    bytes of the packed frames, as sent by the firmware
+    """
+    return b''.join(FRAME_STRUCT.pack(*frame) for frame in frames)
+
+
+class FrameArrays:
+    """
+    Preallocated columns of decoded frames, grown by doubling when full.
+
+    Parameters:
+    capacity: initial number of frames
+    """
+
+    def __init__(self, capacity=4096):
+        self._records = np.empty(capacity, dtype=FRAME_DTYPE)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, records):
+        """
+        Copy decoded records at the end of the arrays.
+
+        Returns:
+        int: position of the first appended frame
+        """
+        start = self.size
+        end = start + len(records)
+        if end > len(self._records):
+            grown = np.empty(max(end, 2 * len(self._records)), dtype=FRAME_DTYPE)
+            grown[:start] = self._records[:start]
+            self._records = grown
+        self._records[start:end] = records
+        self.size = end
+        return start
+
+    def records(self, start=0, stop=None):
+        return self._records[start:self.size if stop is None else stop]
+
+    def lines(self, start=0, stop=None):
+        """
+        Returns:
+        string of the frames in the layout of the ASCII frames of the raw log, one per line
+        """
+        return '\n'.join('%d,%08d,%06d' % frame for frame in self.records(start, stop).tolist())
+
+    def clear(self):
+        self.size = 0
@@ -1,213 +1,234 @@
+import argparse
 import asyncio
-import contextlib
+import functools
 import logging
-import csv
-import pandas as pd
-
-from bleak import BleakClient, BleakScanner
-from bleak.backends.characteristic import BleakGATTCharacteristic
-
-from build_csv import *
-
-def filter_successive_ids(input_csv):
-    with open(input_csv, mode='r') as infile, open('./LOG_CROPPED.csv', mode='w', newline='') as outfile:
-        reader = csv.DictReader(infile)
-        fieldnames = reader.fieldnames
-        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-        writer.writeheader()
-
-        print(reader)
-        buffer = []
-
-        for row in reader:
-            buffer.append(row)
-            # Only keep the last three rows in the buffer
-            if len(buffer) > 3:
-                buffer.pop(0)
-
-            # Check if the buffer contains the sequence [1, 2, 3]
-            if len(buffer) == 3:
-                if [r['id'] for r in buffer] == ['1', '2', '3']:
-                    for b_row in buffer:
-                        writer.writerow(b_row)
-                    buffer = []
-
-
-def preprocess_df(in_csv, out_csv):
-    filter_successive_ids(in_csv)
-    data = pd.read_csv(out_csv)
-
-    # Preprocessing the data before plotting
-    data.astype(int)
-
-    # Remove 33 from the reading of device 3. Measurement correction done after calibration.
-    data.loc[data['id'] == 3, 'pressure_values'] -= 19
-    data.loc[data['id'] == 2, 'pressure_values'] -= 0
-    data.loc[data['id'] == 1, 'pressure_values'] -= 0
-
-    # display(data)
-
-    return data
-
-
-def build_csv():
-    # Build a csv from the file of raw data
-
-    with open("./RAW_LOG.csv", "r") as source_file, open("./LOG.csv", "w") as destination_file:
-
-        # write csv header
-        destination_file.writelines("id,timestamp,pressure_values\n")
-
-        lines = source_file.readlines()
-
-        # Write 1 line, skip 2 (garbage values in these lines)
-        index = 0
-        while index < len(lines):
-            destination_file.write(lines[index])
-            index += 2
-
-        destination_file.close()
-        source_file.close()
-
-    print(f"LOG saved to: ./LOG.csv")
-
-
-def write_to_file(str_value=None):
-    file = open("./RAW_LOG.csv", "a")
-    file.writelines(str_value)
-    file.writelines("\n")
-    file.close()
-
-
-def save_csv(tag: str, df):
-    # Save df to csv file
+import os
+import sys
+import time
+from datetime import datetime
+
+from buffered_writer import BufferedWriter
+from calibration import CALIBRATION_FILE, CALIBRATION_TAG, CalibrationRegistry, compute_offsets
+from ingest_pipeline import TimestampAligner, frames_to_dataframe, process_raw_log, write_frames_csv
+from metrics import SessionMetrics
+from session_manager import SessionManager
+
+'''
+    Logging client of the BMP581 sensors.
+
+        python bmp581_client.py --duration 600 --tag laystandsitstand
+        python bmp581_client.py --duration 60 --tag CALIBRATE
+        python bmp581_client.py --duration 3600 --tag walk --model activity_classifier_MV.pkl --live-plot
+
+    Only the modules needed to scan and log are imported at start; numpy, pandas and matplotlib are imported by the
+    classifier, the live plot and the post-processing when they are used. The exit code is 0 on success, 1 if no
+    frame was received.
+'''
+
+# cf. bt-periph.h mysensor char uuid
+CHAR_PRES_UUID = "75c276c4-8f97-20bc-a143-b354244886d4"
+DEVICE_IDS = ["DEV001", "DEV002", "DEV003"]
+RAW_LOG_FILE = "./RAW_LOG.csv"
+OUTPUT_FOLDER = "./csv"
+TRAINING_CSV = "./Classifiers/combined_training_data_01.csv"
+
+# Metrics snapshot of the session (.json, or Prometheus text with a .prom extension)
+METRICS_FILE = "./metrics.json"
+METRICS_INTERVAL_S = 5.0
+
+# First byte of an ASCII frame is the id digit, '1' = 0x31
+ASCII_ZERO = 0x30
+
+
+def save_csv(tag: str, frames, output_folder=OUTPUT_FOLDER):
+    # Save the aligned frames to csv file
     now = datetime.now().strftime("%Y-%m-%d_%H-%M")  # Timestamp for the file name
-    filepath = f'./csv/LOG_{now}_{tag}.csv'
-    df.to_csv(filepath, index=False)
-    print(f"Values of LOG saved to ./csv/LOG_{now}_{tag}.csv")
+    os.makedirs(output_folder, exist_ok=True)
+    filepath = os.path.join(output_folder, f'LOG_{now}_{tag}.csv')
+    rows = write_frames_csv(frames, filepath)
+    print(f"{rows} values of LOG saved to {filepath}")
 
     return filepath
 
 
-async def notification_handler(characteristic: BleakGATTCharacteristic, data: bytearray):
-    """Simple notification handler which prints the data received."""
-    try:
-        sensor_value: str = data.decode('ascii')
-    except UnicodeDecodeError:
-        return
-    else:
-        write_to_file(str(sensor_value))
-        return
+def is_binary(data):
+    # Checked on every notification, without importing binary_frames (and numpy) for the ASCII frames
+    return len(data) > 0 and data[0] < ASCII_ZERO
 
 
-async def connect_to_device(lock: asyncio.Lock, name_or_address: str,
-                            notify_uuid: str, log_duration: int):
-    """
-    Scan and connect to a device then print notifications for a duration
-    log_duration before disconnecting.
-
-    Args:
-        lock:
-            The same lock must be passed to all calls to this function.
-        name_or_address:
-            The Bluetooth address/UUID of the device to connect to.
-        notify_uuid:
-            The UUID of a characteristic that supports notifications.
-        log_duration:
-            Duration of the logging session
-    """
-    logging.info("starting %s task", name_or_address)
-
-    try:
-        async with contextlib.AsyncExitStack() as stack:
+async def notification_handler(characteristic, data: bytearray, writer: BufferedWriter, classifier=None,
+                               dashboard=None, metrics: SessionMetrics = None):
+    """Notification handler which queues the data received to the raw log writer, and classifies / plots it in live mode."""
+    received_at = time.perf_counter()
 
-            # Trying to establish a connection to two devices at the same time
-            # can cause errors, so use a lock to avoid this.
-            async with lock:
-                print(f"scanning for {name_or_address}")
+    if is_binary(data):
+        # Packed binary frames (firmware built with BINARY_FRAMES): the first byte is an id, not an ASCII digit
+        from binary_frames import decode_binary
 
-                device = await BleakScanner.find_device_by_name(name_or_address)
-
-                print(f"stopped scanning for {name_or_address}")
-
-                if device is None:
-                    logging.error("%s not found", name_or_address)
-                    return
-
-                client = BleakClient(device)
-
-                print(f"connecting to {name_or_address}")
-
-                await stack.enter_async_context(client)
-
-                print(f"connected to {name_or_address}", name_or_address)
-
-                # This will be called immediately before client.__aexit__ when
-                # the stack context manager exits.
-                stack.callback(logging.info, "disconnecting from %s", name_or_address)
-
-            await client.start_notify(notify_uuid, notification_handler)
-            await asyncio.sleep(log_duration)
-            await client.stop_notify(notify_uuid)
-
-            # The lock is released here. The device is still connected and the
-            # Bluetooth adapter is now free to scan and connect another device
-            # without disconnecting this one.
-
-        # The stack context manager exits here, triggering disconnection.
-
-        print(f"disconnected from {name_or_address}")
-
-    except Exception:
-        logging.exception("error with %s", name_or_address)
-
-
-async def bmp581_client():
-    valid_input = False
-    log_duration = 0
-
-    while not valid_input:
+        records = decode_binary(data)
+        if records is None:
+            if metrics is not None:
+                metrics.decode_failure()
+            return
+        writer.write_frames(records)
+        sensor_value = records.tolist()
+    else:
         try:
-            log_duration = int(input("Enter the desired log duration in seconds:"))
-            valid_input = True
-        except ValueError:
-            print("Invalid input. Please enter a valid log duration. 0 to take the data from Log.csv\n")
-            valid_input = False
-    tag = input("Enter the desired logging tag:")
-
-    if log_duration == 0:
-        return -1
-
+            sensor_value: str = data.decode('ascii')
+        except UnicodeDecodeError:
+            if metrics is not None:
+                metrics.decode_failure()
+            return
+        writer.write(sensor_value)
+
+    if metrics is not None:
+        metrics.observe_frames(sensor_value)
+    if dashboard is not None:
+        dashboard.push(sensor_value)
+    if classifier is not None:
+        print_predictions(await classifier.push_async(sensor_value, received_at))
+
+
+def print_predictions(predictions):
+    for prediction in predictions:
+        if prediction.changed:
+            print(f"{prediction.timestamp}: {prediction.label} (latency {prediction.latency_s * 1000:.1f} ms)")
+
+
+async def bmp581_client(log_duration: int, tag: str, device_ids=DEVICE_IDS, output_folder=OUTPUT_FOLDER,
+                        model_path=None, live_plot=False, metrics_file=METRICS_FILE, raw_log=RAW_LOG_FILE,
+                        calibration_file=CALIBRATION_FILE):
+    """
+    This function logs the sensors for log_duration seconds, then writes the aligned, calibrated session csv.
+
+    Parameters:
+    log_duration: duration of the session in seconds
+    tag: logging tag of the session, CALIBRATE for a calibration session
+    device_ids: names of the BLE peripherals
+    output_folder: folder of the session csv 'LOG_<date>_<time>_<tag>.csv'
+    model_path: classifier model for live mode, None to skip
+    live_plot: show a live plot of the elevation
+    metrics_file: metrics snapshot of the session, None to skip
+
+    Returns:
+    int: 0 if the session was saved, 1 if no frame was received
+    """
     print(f"log_duration={log_duration} seconds with tag {tag}.")
-
-    # cf. bt-periph.h mysensor char uuid
-    char_pres_uuid = "75c276c4-8f97-20bc-a143-b354244886d4"
-
-    open("./RAW_LOG.csv", "w")
     print("Looking for devices...")
 
-    device_ids = ["DEV001", "DEV002", "DEV003"]
-
-    lock = asyncio.Lock()
-
-    await asyncio.gather(
-        *(
-            connect_to_device(lock, address, char_pres_uuid, log_duration)
-            for address in device_ids
-        )
-    )
+    # Measurement correction per device id (Pa), none for a calibration session
+    registry = CalibrationRegistry.load(calibration_file)
+    calibrating = CALIBRATION_TAG in tag.upper()
+    offsets = None if calibrating else registry.offsets()
+
+    classifier = None
+    if model_path:
+        from live_classifier import LiveClassifier, load_label_classes
+
+        label_classes = load_label_classes(TRAINING_CSV) if os.path.exists(TRAINING_CSV) else None
+        classifier = LiveClassifier(model_path, label_classes, offsets, aligner=TimestampAligner())
+
+    dashboard = None
+    if live_plot:
+        from live_plot import LiveDashboard
+
+        dashboard = LiveDashboard(offsets=offsets)
+    metrics = SessionMetrics(TimestampAligner())
+
+    async with BufferedWriter(raw_log, metrics=metrics) as writer:
+        handler = functools.partial(notification_handler, writer=writer, classifier=classifier, dashboard=dashboard,
+                                    metrics=metrics)
+
+        session = SessionManager(device_ids, CHAR_PRES_UUID, handler, metrics=metrics)
+        session_done = asyncio.Event()
+
+        async def run_session():
+            try:
+                await session.run(log_duration)
+            finally:
+                session_done.set()
+
+        # Summary line every 5 s and metrics snapshot while logging
+        tasks = [run_session(), metrics.report(session_done, METRICS_INTERVAL_S, metrics_file)]
+        if dashboard is not None:
+            tasks.append(dashboard.run(session_done))
+        if classifier is not None:
+            # Bounds the prediction delay when the notifications stall
+            tasks.append(classifier.run(session_done, print_predictions))
+        await asyncio.gather(*tasks)
+
+    if metrics_file is not None:
+        metrics.write_snapshot(metrics_file)
+
+    for device in session.summary():
+        print(f"{device['name']}: connected after {device['connected_at_s']} s, "
+              f"{device['notifications']} notifications, {device['reconnections']} reconnections, "
+              f"{device['gap_total_s']:.1f} s without data")
+
+    stats = writer.stats()
+    print(f"{raw_log} saved: {stats['written_frames']} frames written, "
+          f"{stats['dropped_frames']} dropped, peak queue depth {stats['peak_queue_depth']}.")
+
+    if classifier is not None:
+        classifier.close()
+        stats = classifier.stats()
+        print(f"Live classification: {stats['predicted_rows']} rows, "
+              f"latency p50 {stats['latency_p50_s'] * 1000:.1f} ms / p99 {stats['latency_p99_s'] * 1000:.1f} ms, "
+              f"{stats['throughput_rows_per_s']:.0f} rows/s "
+              f"(model capacity {stats['model_capacity_rows_per_s']:.0f} rows/s).")
+
+    if writer.stats()['written_frames'] == 0:
+        print("No frame received, no session saved.")
+        return 1
+
+    # Single pass RAW_LOG -> aligned, calibrated csv, without the intermediate LOG.csv / LOG_CROPPED.csv.
+    # Frames are grouped by firmware timestamp, whatever the order in which the BLE links delivered them.
+    aligner = TimestampAligner()
+    frames = process_raw_log(raw_log, offsets, aligner)
+
+    if calibrating:
+        frames = list(frames)
+
+    # The session is saved first, whatever comes out of the calibration
+    filepath = save_csv(tag, frames, output_folder)
+    clock_offsets = {device_id: round(offset) for device_id, offset in (aligner.clock_offsets or {}).items()}
+    print(f"{filepath} saved, {aligner.frames_out} of {aligner.frames_in} frames aligned "
+          f"(clock offsets {clock_offsets} ms, {aligner.resyncs} resyncs).")
+
+    if calibrating:
+        calibration = compute_offsets(frames_to_dataframe(frames))
+        if calibration:
+            registry.set(datetime.now().date(), calibration)
+            registry.save(calibration_file)
+            print(f"Calibration offsets saved: {registry.offsets()}")
+        else:
+            print("No calibration offsets computed, the registry is unchanged.")
 
-    print(f"LOG_RAW.csv saved.")
-    build_csv()
-
-    df = preprocess_df('./LOG.csv', './LOG_CROPPED.csv')
+    return 0
 
-    filepath = save_csv(tag, df)
-    print(f"{filepath} saved.")
 
-    return 0
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Log the BMP581 sensors over BLE")
+    parser.add_argument("--duration", type=int, required=True, help="log duration in seconds")
+    parser.add_argument("--tag", default="", help="logging tag of the session, CALIBRATE for a calibration session")
+    parser.add_argument("--devices", nargs="+", default=DEVICE_IDS, help="names of the BLE peripherals")
+    parser.add_argument("--output", default=OUTPUT_FOLDER, help="folder of the session csv")
+    parser.add_argument("--raw-log", default=RAW_LOG_FILE)
+    parser.add_argument("--model", help="classifier model for live mode")
+    parser.add_argument("--live-plot", action="store_true", help="show a live plot of the elevation")
+    parser.add_argument("--metrics-file", default=METRICS_FILE, help="metrics snapshot (.json or .prom)")
+    parser.add_argument("--calibration", default=CALIBRATION_FILE, help="calibration registry")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    if args.duration <= 0:
+        parser.error("--duration must be positive")
+    return args
 
 
 if __name__ == "__main__":
-    result: int = asyncio.run(bmp581_client())
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
 
+    result: int = asyncio.run(bmp581_client(args.duration, args.tag, args.devices, args.output, args.model,
+                                            args.live_plot, args.metrics_file, args.raw_log, args.calibration))
+    sys.exit(result)
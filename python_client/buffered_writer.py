@@ -0,0 +1,191 @@
+import asyncio
+import time
+
+
+class BufferedWriter:
+    """
+    Buffered sink for the raw notification log.
+
+    Decoded frames are queued in memory by the BLE notification handlers and written
+    to disk in batches by a background task. The file I/O itself runs in the default
+    executor so the event loop is never blocked by open/write/close syscalls.
+
+    A batch is flushed as soon as `batch_size` frames are queued, or `flush_interval`
+    seconds after the previous flush, whichever comes first. Remaining frames are
+    flushed when the writer is closed at the end of the session.
+
+    If more than `max_queue` frames are waiting (disk stalled), new frames are dropped
+    and counted in `dropped_frames` instead of growing memory without bound.
+
+    The write queue latency (oldest frame of each batch, from queueing to written) is reported
+    to `metrics` if given (SessionMetrics).
+
+    Binary notifications are queued as decoded records (write_frames()) in preallocated arrays, and
+    formatted to the lines of the raw log in the writer thread, so the raw log has one layout.
+    """
+
+    def __init__(self, file_path="./RAW_LOG.csv", batch_size=256, flush_interval=1.0, max_queue=100000, metrics=None):
+        self.file_path = file_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.metrics = metrics
+
+        self.written_frames = 0
+        self.dropped_frames = 0
+        self.peak_queue_depth = 0
+        self.flush_count = 0
+        self.max_queue_latency = 0.0
+
+        self._queue = []
+        self._queued_frames = 0
+        self._frames = None
+        self._spare_frames = None
+        self._queued_at = None
+        self._file = None
+        self._flush_event = None
+        self._flush_task = None
+        self._closing = False
+
+    async def start(self):
+        """
+        Open the log file and start the background flush task.
+        The file is truncated, as the client used to do with open("./RAW_LOG.csv", "w").
+        """
+        loop = asyncio.get_running_loop()
+        self._file = await loop.run_in_executor(None, open, self.file_path, "w")
+        self._flush_event = asyncio.Event()
+        self._closing = False
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    def write(self, str_value):
+        """
+        Queue one decoded frame. Never blocks, safe to call from a notification handler.
+
+        Parameters:
+        str_value: string of the decoded notification payload
+
+        Returns:
+        bool: False if the frame was dropped because the queue is full
+        """
+        if self._queued_frames >= self.max_queue:
+            self.dropped_frames += 1
+            return False
+
+        self._enqueue(str_value, 1)
+        return True
+
+    def write_frames(self, records):
+        """
+        Queue the frames of a binary notification. Never blocks, safe to call from a notification handler.
+
+        Parameters:
+        records: np.ndarray of binary_frames.FRAME_DTYPE records, as returned by decode_binary()
+
+        Returns:
+        bool: False if the frames were dropped because the queue is full
+        """
+        if self._queued_frames >= self.max_queue:
+            self.dropped_frames += len(records)
+            return False
+
+        if self._frames is None:
+            from binary_frames import FrameArrays
+
+            # Two buffers: one filled by the handlers while the other one is written
+            self._frames, self._spare_frames = FrameArrays(), FrameArrays()
+        start = self._frames.append(records)
+        self._enqueue(slice(start, start + len(records)), len(records))
+        return True
+
+    def _enqueue(self, item, frames):
+        if not self._queue:
+            self._queued_at = time.monotonic()
+        self._queue.append(item)
+        self._queued_frames += frames
+
+        if self._queued_frames > self.peak_queue_depth:
+            self.peak_queue_depth = self._queued_frames
+
+        if self._queued_frames >= self.batch_size and self._flush_event is not None:
+            self._flush_event.set()
+
+    async def close(self):
+        """
+        Flush all queued frames, stop the flush task and close the file.
+        """
+        if self._flush_task is None:
+            return
+
+        self._closing = True
+        self._flush_event.set()
+        await self._flush_task
+        self._flush_task = None
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._file.close)
+        self._file = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def stats(self):
+        """
+        Returns:
+        dict: counters of the session, to check that no notification was lost
+        """
+        return {
+            'written_frames': self.written_frames,
+            'dropped_frames': self.dropped_frames,
+            'peak_queue_depth': self.peak_queue_depth,
+            'queued_frames': self._queued_frames,
+            'flush_count': self.flush_count,
+            'max_queue_latency_s': self.max_queue_latency,
+        }
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        last_flush = time.monotonic()
+
+        while True:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+
+            # Swap the queue so that handlers keep appending to a fresh list during the write
+            batch, self._queue = self._queue, []
+            batch_frames, self._queued_frames = self._queued_frames, 0
+            frames = self._frames
+            if frames is not None:
+                self._frames, self._spare_frames = self._spare_frames, frames
+            queued_at = self._queued_at
+            if batch:
+                await loop.run_in_executor(None, self._write_batch, batch, frames)
+                self.written_frames += batch_frames
+                self.flush_count += 1
+
+                latency = time.monotonic() - queued_at
+                self.max_queue_latency = max(self.max_queue_latency, latency)
+                if self.metrics is not None:
+                    self.metrics.observe_write_latency(latency)
+            if frames is not None:
+                frames.clear()
+            last_flush = time.monotonic()
+
+            if self._closing and not self._queue:
+                return
+
+    def _write_batch(self, batch, frames=None):
+        # Same line layout as the former write_to_file(): payload followed by a newline
+        if frames is not None:
+            batch = [frames.lines(item.start, item.stop) if isinstance(item, slice) else item for item in batch]
+        self._file.write("\n".join(batch))
+        self._file.write("\n")
+        self._file.flush()
@@ -0,0 +1,217 @@
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from calibration import load_offsets
+from feature_cache import DEFAULT_MAX_BYTES, FeatureCache
+from preprocessing import preprocess_df_elevation, calculate_deltas_elevation, label_based_on_timestamp, \
+    calculate_mean_variance
+from session_store import read_session_frame
+
+'''
+    Batch build of the training set from a folder of logging sessions.
+
+    Every session goes through the same steps as preprocessing.ipynb (triplet filter, calibration, elevation,
+    deltas, labels, rolling mean/std) in a process pool, and the results are concatenated in one csv.
+    The labeled deltas and the features of each session are stored in a FeatureCache, keyed by the content of the
+    session, its labels, calibration and window size: a rebuild only processes the new or modified sessions, and a
+    build with another window size only recomputes the rolling features.
+
+    Labels manifest (json), ranges over the 'index' column of the deltas, bounds included:
+        {"LOG_2024-07-25_14-09_laystandsitstand.csv": [[0, 148, "sit_lay"], [149, 1185, "lay"], ...]}
+    Sessions that are already labeled deltas ('index, delta3_1, delta3_2, delta2_1, label') keep their labels
+    unless the manifest has an entry for them.
+'''
+
+# Increase when a change of the preprocessing modifies the results, to invalidate the cache
+PIPELINE_VERSION = 2
+
+RAW_HEADER = 'id,timestamp,pressure_values'
+LABELED_HEADER = 'index,delta3_1,delta3_2,delta2_1,label'
+
+
+def session_params(csv_path, time_ranges):
+    """
+    Returns:
+    dict: parameters of the labeled deltas of a session, the cache key of the deltas
+    """
+    return {'stage': 'deltas', 'version': PIPELINE_VERSION, 'labels': time_ranges,
+            'calibration': sorted(load_offsets(csv_path).items())}
+
+
+def feature_params(csv_path, time_ranges, window_size):
+    return dict(session_params(csv_path, time_ranges), stage='features', window_size=window_size)
+
+
+def read_header(path):
+    with open(path, 'r') as infile:
+        return infile.readline().strip()
+
+
+def session_deltas(csv_path, time_ranges=None):
+    """
+    This function takes one session csv and returns its labeled deltas.
+
+    Parameters:
+    csv_path: string containing the path to a raw session csv or to labeled deltas
+    time_ranges: list of (start, end, label) over the 'index' column, None to keep the labels of the file
+
+    Returns:
+    df (pd.DataFrame): DataFrame containing columns 'index, delta3_1, delta3_2, delta2_1, label'
+    """
+    header = read_header(csv_path)
+
+    if header == RAW_HEADER:
+        deltas_df = calculate_deltas_elevation(preprocess_df_elevation(csv_path))
+        return label_based_on_timestamp(deltas_df, time_ranges or [])
+    if header == LABELED_HEADER:
+        deltas_df = read_session_frame(csv_path)
+        if time_ranges is not None:
+            deltas_df = label_based_on_timestamp(deltas_df, time_ranges)
+        return deltas_df
+    raise ValueError(f"{csv_path}: unknown header '{header}'")
+
+
+def preprocess_session(csv_path, time_ranges=None, window_size=10):
+    """
+    This function takes one session csv and returns its labeled deltas with the rolling mean/std.
+
+    Returns:
+    df (pd.DataFrame): DataFrame containing columns 'index, delta3_1, delta3_2, delta2_1, label, delta3_1_mean, ...'
+    """
+    # Rolling features per session, the windows do not span two recordings
+    return calculate_mean_variance(session_deltas(csv_path, time_ranges), window_size)
+
+
+def session_features(csv_path, window_size=10, time_ranges=None, cache=None):
+    """
+    This function returns the features of one session from the cache, computing only what is missing: the
+    rolling mean/std if the deltas are cached, everything otherwise. For the notebooks and window size sweeps.
+
+    Parameters:
+    cache: FeatureCache, the default one if None
+
+    Returns:
+    df (pd.DataFrame): as preprocess_session()
+    """
+    cache = cache or FeatureCache()
+
+    def compute():
+        deltas_df = cache.get_or_compute(csv_path, session_params(csv_path, time_ranges),
+                                         lambda: session_deltas(csv_path, time_ranges))
+        return calculate_mean_variance(deltas_df, window_size)
+
+    return cache.get_or_compute(csv_path, feature_params(csv_path, time_ranges, window_size), compute)
+
+
+def _process_session(csv_path, time_ranges, window_size):
+    # Worker of the process pool, the parent stores the results in the cache
+    deltas_df = session_deltas(csv_path, time_ranges)
+    return deltas_df, calculate_mean_variance(deltas_df.copy(), window_size)
+
+
+def load_manifest(manifest_path):
+    if manifest_path is None:
+        return {}
+    with open(manifest_path, 'r') as infile:
+        return json.load(infile)
+
+
+def build_training_data(input_folder, output_csv, manifest_path=None, window_size=10,
+                        cache_folder='./.feature_cache', workers=None, max_cache_bytes=DEFAULT_MAX_BYTES):
+    """
+    This function preprocesses all the sessions 'LOG_*.csv' of a folder and writes the combined training set.
+
+    Parameters:
+    input_folder: string containing the folder of the sessions, e.g. './Measurements/data_labeled'
+    output_csv: string containing the path of the combined training set
+    manifest_path: string containing the path of the labels manifest (json)
+    window_size: rolling window of the mean/std features
+    cache_folder: folder of the FeatureCache
+    workers: number of processes, os.cpu_count() if None
+    max_cache_bytes: size of the cache above which the least recently used entries are removed
+
+    Returns:
+    dict: number of sessions, sessions taken from the cache, sessions with cached deltas, rows written
+    """
+    start = time.perf_counter()
+    manifest = load_manifest(manifest_path)
+    cache = FeatureCache(cache_folder, max_cache_bytes)
+
+    sessions = []
+    for csv_path in sorted(glob.glob(os.path.join(input_folder, 'LOG_*.csv'))):
+        name = os.path.basename(csv_path)
+        time_ranges = manifest.get(name)
+        if time_ranges is None and read_header(csv_path) == RAW_HEADER:
+            print(f"{name}: no labels in the manifest, skipped")
+            continue
+        sessions.append((csv_path, time_ranges))
+
+    features = {}
+    to_process = []
+    deltas_cached = 0
+    for csv_path, time_ranges in sessions:
+        params = feature_params(csv_path, time_ranges, window_size)
+        features[csv_path] = cache.get(cache.key(csv_path, params))
+        if features[csv_path] is not None:
+            continue
+        # Same session with another window size: only the rolling features are computed
+        deltas_df = cache.get(cache.key(csv_path, session_params(csv_path, time_ranges)))
+        if deltas_df is not None:
+            deltas_cached += 1
+            features[csv_path] = calculate_mean_variance(deltas_df, window_size)
+            cache.put(cache.key(csv_path, params), features[csv_path], csv_path, params)
+        else:
+            to_process.append((csv_path, time_ranges))
+
+    cached = len(sessions) - len(to_process) - deltas_cached
+    if to_process:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                csv_path: executor.submit(_process_session, csv_path, time_ranges, window_size)
+                for csv_path, time_ranges in to_process
+            }
+            for csv_path, time_ranges in to_process:
+                deltas_df, features[csv_path] = futures[csv_path].result()
+                for params, df in ((session_params(csv_path, time_ranges), deltas_df),
+                                   (feature_params(csv_path, time_ranges, window_size), features[csv_path])):
+                    cache.put(cache.key(csv_path, params), df, csv_path, params)
+                print(f"{os.path.basename(csv_path)}: {len(features[csv_path])} rows")
+
+    # Access times of the cache hits, written once
+    cache.save()
+
+    combined = pd.concat([features[csv_path] for csv_path, _ in sessions], ignore_index=True) \
+        if sessions else pd.DataFrame()
+    combined.to_csv(output_csv, index=False)
+
+    result = {
+        'sessions': len(sessions),
+        'cached': cached,
+        'deltas_cached': deltas_cached,
+        'rows': len(combined),
+        'duration_s': time.perf_counter() - start,
+    }
+    print(f"{result['rows']} rows from {result['sessions']} sessions ({result['cached']} from the cache, "
+          f"{result['deltas_cached']} with cached deltas) written to {output_csv} in {result['duration_s']:.2f} s")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the combined training set from a folder of sessions")
+    parser.add_argument("input_folder", help="folder of the LOG_*.csv sessions")
+    parser.add_argument("--labels", help="labels manifest (json)")
+    parser.add_argument("--output", default="./combined_training_data.csv")
+    parser.add_argument("--window", type=int, default=10, help="rolling window of the mean/std features")
+    parser.add_argument("--cache", default="./.feature_cache")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES >> 20, help="size of the cache in MiB")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    build_training_data(args.input_folder, args.output, args.labels, args.window, args.cache, args.workers,
+                        args.cache_size << 20)
@@ -0,0 +1,94 @@
+import numpy as np
+
+# Constants of the barometric formula
+P0 = 1013.25  # sea level standard atmospheric pressure in hPa
+L = 0.0065    # temperature lapse rate in K/m
+T0 = 288.15   # sea level standard temperature in K
+g = 9.80665   # acceleration due to gravity in m/s^2
+M = 0.0289644 # molar mass of Earth's air in kg/mol
+R = 8.31432   # universal gas constant in N·m/(mol·K)
+
+# Computed once instead of on every sample
+EXPONENT = (R * L) / (g * M)
+
+# Pressure range of the BMP581 in Pa
+SENSOR_MIN_PA = 30000
+SENSOR_MAX_PA = 125000
+
+
+def pressure_to_elevation_m(pressure_Pa):
+    """
+    This function takes a pressure_values and converts it to an elevation value using the atmospheric formula.
+
+    Parameters:
+    pressure_Pa: integer of a pressure value.
+
+    Returns:
+    h_cm: integer of an elevation value in cm
+    """
+    pressure_hPa = pressure_Pa / 100
+
+    # Calculate the height in meters
+    h_m = (T0 / L) * (1 - (pressure_hPa / P0) ** EXPONENT)
+
+    # Convert the height to centimeters
+    h_cm = h_m * 100
+
+    return int(h_cm)
+
+
+def pressure_to_elevation_cm(pressure_Pa, dtype=np.int64):
+    """
+    Array version of pressure_to_elevation_m(), computed on a whole column at once.
+
+    Parameters:
+    pressure_Pa: array or pd.Series of pressure values in Pa
+    dtype: output type. Integer types truncate toward zero like int(), float types keep the fraction.
+
+    Returns:
+    np.ndarray: elevation values in cm
+    """
+    pressure_hPa = np.asarray(pressure_Pa, dtype=np.float64) / 100
+    h_cm = (T0 / L) * (1 - (pressure_hPa / P0) ** EXPONENT) * 100
+
+    if np.dtype(dtype).kind in 'iu':
+        h_cm = np.trunc(h_cm)
+
+    return h_cm.astype(dtype)
+
+
+class ElevationLookupTable:
+    """
+    Precomputed elevation of every integer pressure value of the sensor range, so that the conversion
+    of a live sample or a column is a single indexing operation.
+    Values outside of the range fall back to pressure_to_elevation_cm().
+    """
+
+    def __init__(self, min_Pa=SENSOR_MIN_PA, max_Pa=SENSOR_MAX_PA, dtype=np.int32):
+        self.min_Pa = min_Pa
+        self.max_Pa = max_Pa
+        self.dtype = dtype
+        self.table = pressure_to_elevation_cm(np.arange(min_Pa, max_Pa + 1), dtype)
+
+    def __call__(self, pressure_Pa):
+        """
+        Parameters:
+        pressure_Pa: integer, array or pd.Series of integer pressure values in Pa
+
+        Returns:
+        elevation value(s) in cm, same shape as the input
+        """
+        if np.ndim(pressure_Pa) == 0:
+            if self.min_Pa <= pressure_Pa <= self.max_Pa:
+                return self.table[int(pressure_Pa) - self.min_Pa]
+            return pressure_to_elevation_cm(pressure_Pa, self.dtype)[()]
+
+        pressure_Pa = np.asarray(pressure_Pa, dtype=np.int64)
+        in_range = (pressure_Pa >= self.min_Pa) & (pressure_Pa <= self.max_Pa)
+        if in_range.all():
+            return self.table[pressure_Pa - self.min_Pa]
+
+        h_cm = np.empty(pressure_Pa.shape, dtype=self.dtype)
+        h_cm[in_range] = self.table[pressure_Pa[in_range] - self.min_Pa]
+        h_cm[~in_range] = pressure_to_elevation_cm(pressure_Pa[~in_range], self.dtype)
+        return h_cm
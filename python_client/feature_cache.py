@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+'''
+    On-disk cache of the DataFrames derived from a session (deltas, rolling features, ...).
+
+    An entry is keyed by the content hash of the source file and by the parameters of the computation (calibration,
+    labels, window size, ...), so the same session computed with other parameters gets its own entry and a modified
+    file never hits an old one. The source hashes are kept with the size and mtime of the file: as long as they are
+    unchanged the file is not hashed again, which makes the validity check a stat() call.
+
+    The cache is bounded in size: when it is over max_bytes, the least recently used entries are removed.
+
+        cache = FeatureCache('./.feature_cache')
+        df = cache.get_or_compute(csv_path, {'window_size': 20}, lambda: compute(csv_path, 20))
+
+    The index is written by the process using the cache: with a process pool, compute in the workers and get/put
+    in the parent. It is written by put(), evictions and clear(); the access times of the hits are kept in memory
+    until then, or until save().
+'''
+
+INDEX_FILE = 'index.json'
+DEFAULT_MAX_BYTES = 1 << 30
+
+
+def file_hash(path, chunk_size=1 << 20):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class FeatureCache:
+    """
+    Size-bounded LRU cache of DataFrames on disk.
+
+    Parameters:
+    folder: folder of the entries and of the index
+    max_bytes: size of the entries above which the least recently used ones are removed
+    """
+
+    def __init__(self, folder='./.feature_cache', max_bytes=DEFAULT_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(folder, exist_ok=True)
+
+        index_path = os.path.join(folder, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as infile:
+                index = json.load(infile)
+        else:
+            index = {}
+        self.sources = index.get('sources', {})
+        self.entries = index.get('entries', {})
+        self._dirty = False
+
+    def _save_index(self):
+        # Atomic replace, an interrupted build keeps the previous index
+        index_path = os.path.join(self.folder, INDEX_FILE)
+        with open(index_path + '.tmp', 'w') as outfile:
+            json.dump({'sources': self.sources, 'entries': self.entries}, outfile, indent=1)
+        os.replace(index_path + '.tmp', index_path)
+        self._dirty = False
+
+    def save(self):
+        """
+        Write the index if it changed since it was last written (access times of the hits, new source hashes).
+        """
+        if self._dirty:
+            self._save_index()
+
+    def _stat_unchanged(self, path):
+        source = self.sources.get(os.path.abspath(path))
+        if source is None:
+            return False
+        stat = os.stat(path)
+        return source['size'] == stat.st_size and source['mtime_ns'] == stat.st_mtime_ns
+
+    def source_hash(self, path):
+        """
+        Returns:
+        string: sha256 of the file content, only recomputed when the size or mtime of the file changed
+        """
+        if self._stat_unchanged(path):
+            return self.sources[os.path.abspath(path)]['sha256']
+
+        stat = os.stat(path)
+        sha256 = file_hash(path)
+        self.sources[os.path.abspath(path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+        self._dirty = True
+        return sha256
+
+    def key(self, path, params):
+        """
+        Parameters:
+        path: string containing the path of the source file
+        params: json serializable dict of the parameters of the computation
+
+        Returns:
+        string: key of the entry
+        """
+        text = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(f"{self.source_hash(path)}:{text}".encode('utf-8')).hexdigest()
+
+    def is_valid(self, path, params):
+        """
+        Cheap check, without hashing the file: the file has the size and mtime it had when hashed and an entry
+        exists for these parameters. False does not mean that get() misses: the file may have been touched only.
+        """
+        if not self._stat_unchanged(path):
+            return False
+        entry = self.entries.get(self.key(path, params))
+        return entry is not None and os.path.exists(os.path.join(self.folder, entry['file']))
+
+    def get(self, key):
+        """
+        Returns:
+        pd.DataFrame of the entry, None if not cached
+        """
+        entry = self.entries.get(key)
+        entry_path = os.path.join(self.folder, entry['file']) if entry is not None else None
+        if entry is None or not os.path.exists(entry_path):
+            if self.entries.pop(key, None) is not None:
+                self._dirty = True
+            self.misses += 1
+            return None
+
+        # The access time is written with the index by the next put() or save()
+        self.hits += 1
+        entry['last_access'] = time.time()
+        self._dirty = True
+        return pd.read_pickle(entry_path)
+
+    def put(self, key, df, path=None, params=None):
+        """
+        Store a DataFrame, then evict the least recently used entries if the cache is over max_bytes.
+
+        Parameters:
+        path, params: source file and parameters, kept in the index for inspection
+        """
+        file_name = key + '.pkl'
+        entry_path = os.path.join(self.folder, file_name)
+        df.to_pickle(entry_path + '.tmp')
+        os.replace(entry_path + '.tmp', entry_path)
+
+        self.entries[key] = {
+            'file': file_name,
+            'bytes': os.path.getsize(entry_path),
+            'last_access': time.time(),
+            'source': os.path.basename(path) if path else None,
+            'params': json.loads(json.dumps(params, default=str)) if params is not None else None,
+        }
+        self.evict(keep=key)
+        self._save_index()
+
+    def get_or_compute(self, path, params, compute):
+        """
+        Parameters:
+        path: string containing the path of the source file
+        params: json serializable dict of the parameters of the computation
+        compute: function without argument returning the DataFrame
+
+        Returns:
+        pd.DataFrame, from the cache or computed and stored
+        """
+        key = self.key(path, params)
+        df = self.get(key)
+        if df is None:
+            df = compute()
+            self.put(key, df, path, params)
+        return df
+
+    def size(self):
+        return sum(entry['bytes'] for entry in self.entries.values())
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache is under max_bytes (the entry `keep` stays).
+
+        Returns:
+        int: number of removed entries
+        """
+        removed = 0
+        total = self.size()
+        for key in sorted(self.entries, key=lambda name: self.entries[name]['last_access']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self.entries.pop(key)
+            total -= entry['bytes']
+            removed += 1
+            try:
+                os.remove(os.path.join(self.folder, entry['file']))
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def clear(self):
+        for entry in self.entries.values():
+            try:
+                os.remove(os.path.join(self.folder, entry['file']))
+            except FileNotFoundError:
+                pass
+        self.entries = {}
+        self._save_index()
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.size(), 'hits': self.hits, 'misses': self.misses}
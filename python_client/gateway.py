@@ -0,0 +1,378 @@
+import argparse
+import asyncio
+import functools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bmp581_client import CHAR_PRES_UUID, METRICS_INTERVAL_S, notification_handler, save_csv
+from buffered_writer import BufferedWriter
+from calibration import CALIBRATION_FILE, CALIBRATION_TAG, CalibrationRegistry, compute_offsets
+from ingest_pipeline import TimestampAligner, frames_to_dataframe, process_raw_log
+from metrics import Histogram, SessionMetrics
+from session_manager import BleakBackend, SessionManager
+
+'''
+    Gateway mode: one host logging the sensor triplets of several wearers at once.
+
+    Roster (json), the devices of each wearer in the order of their ids 1, 2, 3:
+        {"alice": ["DEV001", "DEV002", "DEV003"],
+         "bob": {"devices": ["DEV004", "DEV005", "DEV006"], "calibration": "./calibration_bob.json"}}
+
+    Each wearer has its own session manager, raw log writer, metrics and output folder <output>/<wearer>/ (RAW_LOG.csv,
+    LOG_<date>_<time>_<tag>.csv, metrics.json), so a slow or missing triplet does not affect the others. All the
+    connections run on one event loop, after one shared scan. The lag of the event loop is measured: when it grows,
+    the loop is saturated and the wearers can be sharded over worker processes with --workers.
+
+        python gateway.py roster.json --duration 600 --tag office
+        python gateway.py roster.json --duration 60 --workers 2 --simulate 10
+'''
+
+OUTPUT_FOLDER = "./gateway"
+# Loop lag above which the loop does not keep up with the notifications
+SATURATION_LAG_S = 0.05
+# SATURATION_LAG_S is a bound, the share of the wake ups over it is exact
+LAG_BUCKETS_S = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+# Share of the wake ups over SATURATION_LAG_S of a saturated loop
+SATURATION_SHARE = 0.01
+
+
+def load_roster(path):
+    """
+    This function reads a roster and checks that no device is assigned to two wearers.
+
+    Returns:
+    dict {wearer: {'devices': [names], 'calibration': path or None}}
+    """
+    with open(path, 'r') as infile:
+        entries = json.load(infile)
+
+    roster = {}
+    owners = {}
+    for wearer, entry in entries.items():
+        entry = {'devices': entry} if isinstance(entry, list) else dict(entry)
+        entry.setdefault('calibration', None)
+        for device in entry['devices']:
+            if device in owners:
+                raise ValueError(f"{device} is assigned to {owners[device]} and {wearer}")
+            owners[device] = wearer
+        roster[wearer] = entry
+
+    return roster
+
+
+class SharedScanBackend:
+    """
+    Backend wrapper for the session managers of all the wearers: the first scan of every device is served by one
+    scan for all the roster devices, the rescans of missing devices are serialized (one scanner at a time).
+    """
+
+    def __init__(self, backend, names):
+        self.backend = backend
+        self.names = list(names)
+        self._pending = set(self.names)
+        self._found = None
+        self._lock = asyncio.Lock()
+
+    async def scan(self, names, timeout):
+        async with self._lock:
+            if self._found is None:
+                self._found = await self.backend.scan(self.names, timeout)
+            if all(name in self._pending for name in names):
+                self._pending.difference_update(names)
+                return {name: self._found[name] for name in names if name in self._found}
+            return await self.backend.scan(names, timeout)
+
+    def create_client(self, device, disconnected_callback):
+        return self.backend.create_client(device, disconnected_callback)
+
+
+class LoopMonitor:
+    """
+    Lag of the event loop: delay of a periodic wake up over its due time. A loop that keeps up has a lag of about
+    1 ms; a saturated loop delays every handler, writer flush and reconnection by its lag.
+    """
+
+    def __init__(self, interval_s=0.02):
+        # One wake up per sampling period of the sensors, enough samples for the p99 of a short session
+        self.interval_s = interval_s
+        self.lag = Histogram('loop_lag_seconds', 'Delay of the event loop', LAG_BUCKETS_S)
+
+    async def run(self, stop_event):
+        while not stop_event.is_set():
+            due = time.monotonic() + self.interval_s
+            try:
+                await asyncio.wait_for(stop_event.wait(), self.interval_s)
+            except asyncio.TimeoutError:
+                self.lag.observe(max(0.0, time.monotonic() - due))
+
+    def summary(self):
+        """
+        Returns:
+        dict: p50 and p99 (bucket upper bounds), exact mean and max of the lag, share of the wake ups over
+        SATURATION_LAG_S and whether it is over SATURATION_SHARE
+        """
+        series = self.lag.values.get(())
+        if not series:
+            return {'p50_s': None, 'p99_s': None, 'mean_s': None, 'max_s': None, 'over_share': None,
+                    'saturated': False}
+
+        over = sum(series['counts'][self.lag.buckets.index(SATURATION_LAG_S) + 1:])
+        return {
+            'p50_s': self.lag.quantile(0.5),
+            'p99_s': self.lag.quantile(0.99),
+            'mean_s': series['sum'] / series['count'],
+            'max_s': series['max'],
+            'over_share': over / series['count'],
+            'saturated': over / series['count'] > SATURATION_SHARE,
+        }
+
+
+def lag_text(lag):
+    if lag['p99_s'] is None:
+        return "-"
+    return (f"p99 {lag['p99_s'] * 1000:.0f} ms, mean {lag['mean_s'] * 1000:.1f} ms, "
+            f"max {lag['max_s'] * 1000:.0f} ms")
+
+
+class WearerPipeline:
+    """
+    Isolated logging pipeline of one wearer: session manager, raw log writer, metrics and output folder.
+    """
+
+    def __init__(self, wearer, devices, output_folder, tag, calibration_file=None):
+        self.wearer = wearer
+        self.devices = list(devices)
+        self.tag = tag
+        self.folder = os.path.join(output_folder, wearer)
+        self.raw_log = os.path.join(self.folder, 'RAW_LOG.csv')
+        self.calibration_file = calibration_file or CALIBRATION_FILE
+
+        self.calibrating = CALIBRATION_TAG in tag.upper()
+        self.registry = CalibrationRegistry.load(self.calibration_file)
+        self.offsets = None if self.calibrating else self.registry.offsets()
+
+        self.metrics = SessionMetrics(TimestampAligner())
+        self.writer = None
+        self.session = None
+        self.duration_s = None
+        self.error = None
+
+    async def run(self, log_duration, backend):
+        os.makedirs(self.folder, exist_ok=True)
+        start = time.monotonic()
+        async with BufferedWriter(self.raw_log, metrics=self.metrics) as writer:
+            self.writer = writer
+            handler = functools.partial(notification_handler, writer=writer, metrics=self.metrics)
+            self.session = SessionManager(self.devices, CHAR_PRES_UUID, handler, backend, metrics=self.metrics)
+            await self.session.run(log_duration)
+        self.duration_s = time.monotonic() - start
+
+    def status_line(self):
+        stats = self.writer.stats() if self.writer is not None else {}
+        return (f"{self.wearer}: {self.metrics.summary_line()} | queue {stats.get('queued_frames', 0)} "
+                f"dropped {stats.get('dropped_frames', 0)}")
+
+    def finish(self):
+        """
+        Write the metrics snapshot and the aligned, calibrated session csv of the wearer.
+
+        Returns:
+        dict: per wearer throughput and backpressure of the session, see summary()
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        self.metrics.write_snapshot(os.path.join(self.folder, 'metrics.json'))
+
+        filepath = None
+        if self.writer is not None and self.writer.stats()['written_frames']:
+            aligner = TimestampAligner()
+            frames = list(process_raw_log(self.raw_log, self.offsets, aligner))
+            filepath = save_csv(self.tag, frames, self.folder)
+            if self.calibrating:
+                calibration = compute_offsets(frames_to_dataframe(frames))
+                if calibration:
+                    self.registry.set(time.strftime('%Y-%m-%d'), calibration)
+                    self.registry.save(self.calibration_file)
+                    print(f"{self.wearer}: calibration offsets saved to {self.calibration_file}")
+                else:
+                    print(f"{self.wearer}: no calibration offsets computed")
+
+        return self.summary(filepath)
+
+    def summary(self, filepath=None):
+        """
+        Returns:
+        dict: per wearer throughput and backpressure of the session, 'error' if the pipeline failed
+        """
+        stats = self.writer.stats() if self.writer is not None else {}
+        received = self.metrics.notifications.total()
+
+        return {
+            'wearer': self.wearer,
+            'devices': self.devices,
+            'output': filepath,
+            'error': self.error,
+            'received': received,
+            'received_per_s': received / self.duration_s if self.duration_s else None,
+            'written_frames': stats.get('written_frames', 0),
+            'dropped_frames': stats.get('dropped_frames', 0),
+            'peak_queue_depth': stats.get('peak_queue_depth', 0),
+            'max_queue_latency_s': stats.get('max_queue_latency_s', 0.0),
+            'write_latency_p99_s': self.metrics.write_latency.quantile(0.99),
+            'decode_failures': self.metrics.decode_failures.total(),
+            'alignment_yield': self.metrics.alignment_yield(),
+            'reconnections': self.metrics.reconnections.total(),
+        }
+
+
+def finish_pipeline(pipeline):
+    # The output of a wearer never prevents the others from being saved
+    try:
+        return pipeline.finish()
+    except Exception as error:
+        pipeline.error = pipeline.error or repr(error)
+        print(f"{pipeline.wearer}: session not saved: {error!r}")
+        return pipeline.summary()
+
+
+async def run_gateway(roster, log_duration, tag, output_folder=OUTPUT_FOLDER, backend=None,
+                      report_interval_s=METRICS_INTERVAL_S):
+    """
+    This function logs all the wearers of a roster on the current event loop.
+
+    Parameters:
+    roster: dict as returned by load_roster()
+    log_duration: duration of the session in seconds
+    tag: logging tag of the session
+    output_folder: folder of the per wearer folders
+    backend: BLE backend, BleakBackend() if None
+
+    Returns:
+    dict: per wearer summaries and the event loop lag
+    """
+    if CALIBRATION_TAG in tag.upper():
+        shared = [wearer for wearer, entry in roster.items() if not entry['calibration']]
+        if len(roster) > 1 and shared:
+            raise ValueError(f"A calibration session needs a calibration file per wearer, missing for {shared}")
+
+    names = [device for entry in roster.values() for device in entry['devices']]
+    backend = SharedScanBackend(backend or BleakBackend(), names)
+    pipelines = [WearerPipeline(wearer, entry['devices'], output_folder, tag, entry['calibration'])
+                 for wearer, entry in roster.items()]
+    monitor = LoopMonitor()
+    done = asyncio.Event()
+
+    async def run_all():
+        try:
+            # A failing wearer (folder, writer, BLE backend) does not stop the others
+            results = await asyncio.gather(*(pipeline.run(log_duration, backend) for pipeline in pipelines),
+                                           return_exceptions=True)
+            for pipeline, result in zip(pipelines, results):
+                if isinstance(result, BaseException):
+                    pipeline.error = repr(result)
+                    print(f"{pipeline.wearer}: session failed: {result!r}")
+        finally:
+            done.set()
+
+    async def report():
+        while not done.is_set():
+            try:
+                await asyncio.wait_for(done.wait(), report_interval_s)
+            except asyncio.TimeoutError:
+                pass
+            for pipeline in pipelines:
+                print(pipeline.status_line())
+            lag = monitor.summary()
+            if lag['p99_s'] is not None:
+                print(f"event loop lag {lag_text(lag)}{', saturated' if lag['saturated'] else ''}")
+
+    await asyncio.gather(run_all(), monitor.run(done), report())
+
+    return {
+        'wearers': [finish_pipeline(pipeline) for pipeline in pipelines],
+        'loop_lag': monitor.summary(),
+        'pid': os.getpid(),
+    }
+
+
+def simulated_backend(roster, speedup=1.0):
+    """
+    Returns:
+    SimulatedBackend serving the devices of the roster, with the ids 1, 2, 3 in the order of each wearer
+    """
+    from simulated_ble import SimulatedBackend, SimulatedPeripheral
+
+    names = [(position % 3 + 1, name) for entry in roster.values() for position, name in enumerate(entry['devices'])]
+    peripherals = [SimulatedPeripheral(name, device_id, seed=seed) for seed, (device_id, name) in enumerate(names)]
+    return SimulatedBackend(peripherals, speedup)
+
+
+def _run_shard(roster, log_duration, tag, output_folder, simulate_speedup):
+    # Worker process: its own event loop and backend for its share of the wearers
+    backend = simulated_backend(roster, simulate_speedup) if simulate_speedup else None
+    return asyncio.run(run_gateway(roster, log_duration, tag, output_folder, backend))
+
+
+def run_sharded(roster, workers, log_duration, tag, output_folder=OUTPUT_FOLDER, simulate_speedup=None):
+    """
+    This function splits the wearers over worker processes, each one with its own event loop.
+
+    Parameters:
+    workers: number of processes, 1 to run on the current process
+    simulate_speedup: speedup of simulated sensors, None for the real sensors
+
+    Returns:
+    list of the results of run_gateway(), one per shard
+    """
+    wearers = list(roster)
+    shards = [{wearer: roster[wearer] for wearer in wearers[n::workers]} for n in range(workers)]
+    shards = [shard for shard in shards if shard]
+
+    if len(shards) == 1:
+        return [_run_shard(shards[0], log_duration, tag, output_folder, simulate_speedup)]
+
+    with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [executor.submit(_run_shard, shard, log_duration, tag, output_folder, simulate_speedup)
+                   for shard in shards]
+        return [future.result() for future in futures]
+
+
+def print_results(results):
+    for shard in results:
+        lag = shard['loop_lag']
+        print(f"process {shard['pid']}: event loop lag {lag_text(lag)}{' (saturated)' if lag['saturated'] else ''}")
+        for wearer in shard['wearers']:
+            alignment_yield = wearer['alignment_yield']
+            latency = wearer['write_latency_p99_s']
+            print(f"  {wearer['wearer']}: {wearer['received_per_s'] or 0:.0f} notifications/s, "
+                  f"{wearer['written_frames']} written, {wearer['dropped_frames']} dropped, "
+                  f"peak queue {wearer['peak_queue_depth']}, "
+                  f"write p99 {latency * 1000 if latency is not None else float('nan'):.0f} ms, "
+                  f"yield {alignment_yield * 100 if alignment_yield is not None else float('nan'):.1f}%, "
+                  f"{wearer['reconnections']} reconnections -> {wearer['output']}")
+            if wearer.get('error'):
+                print(f"    error: {wearer['error']}")
+
+    if any(shard['loop_lag']['saturated'] for shard in results):
+        print(f"The event loop lag is over {SATURATION_LAG_S * 1000:.0f} ms for more than {SATURATION_SHARE:.0%} of "
+              f"the wake ups: shard the wearers with --workers.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Log the sensor triplets of several wearers at once")
+    parser.add_argument("roster", help="roster json {wearer: [devices]}")
+    parser.add_argument("--duration", type=int, required=True, help="log duration in seconds")
+    parser.add_argument("--tag", default="")
+    parser.add_argument("--output", default=OUTPUT_FOLDER, help="folder of the per wearer folders")
+    parser.add_argument("--workers", type=int, default=1, help="processes to shard the wearers over")
+    parser.add_argument("--simulate", type=float, metavar="SPEEDUP", help="simulated sensors, x times real time")
+    parser.add_argument("--results", help="json file of the per wearer results")
+    args = parser.parse_args()
+
+    results = run_sharded(load_roster(args.roster), max(1, args.workers), args.duration, args.tag, args.output,
+                          args.simulate)
+    print_results(results)
+    if args.results:
+        with open(args.results, 'w') as outfile:
+            json.dump(results, outfile, indent=4)
@@ -0,0 +1,285 @@
+import argparse
+import json
+import time
+import warnings
+
+import numpy as np
+
+from live_classifier import DELTA_COLUMNS, FEATURE_COLUMNS, percentile
+
+'''
+    Inference with the classifiers of the Classifiers/ notebooks, outside of the notebooks.
+
+    A model bundle is a joblib file holding the model and what is needed to use it:
+        {'kind': 'sklearn' or 'torch', 'model': estimator or state_dict of SimpleNN, 'architecture': SimpleNN sizes,
+         'scaler': fitted StandardScaler or None, 'label_classes': label_encoder.classes_,
+         'feature_columns': [...], 'window_size': rolling window of the features}
+
+    At the end of a notebook:
+        from inference import save_bundle
+        save_bundle('activity_classifier_NN_MV.pkl', model, FEATURE_COLUMNS, label_encoder.classes_, scaler, 20)
+
+    The models saved by the RandomForest notebooks (joblib.dump(clf, ...)) can be loaded as well, without scaler.
+
+    Benchmark of the cost per batch size:
+        python inference.py activity_classifier_MV.pkl --data ./Classifiers/combined_training_data_01.csv
+'''
+
+BATCH_SIZES = (1, 8, 32, 128, 1024)
+
+_simple_nn = None
+
+
+def simple_nn_class():
+    """
+    Returns:
+    the SimpleNN class of the PyTorch notebooks (torch is only imported when needed)
+    """
+    global _simple_nn
+    if _simple_nn is None:
+        from torch import nn
+
+        class SimpleNN(nn.Module):
+            def __init__(self, NN_input_dim, NN_hidden_dim, NN_output_dim):
+                super(SimpleNN, self).__init__()
+                self.fc1 = nn.Linear(NN_input_dim, NN_hidden_dim)
+                self.relu = nn.ReLU()
+                self.fc2 = nn.Linear(NN_hidden_dim, NN_output_dim)
+
+            def forward(self, x):
+                return self.fc2(self.relu(self.fc1(x)))
+
+        _simple_nn = SimpleNN
+
+    return _simple_nn
+
+
+def save_bundle(path, model, feature_columns, label_classes, scaler=None, window_size=None):
+    """
+    This function saves a trained model with its scaler and label classes.
+
+    Parameters:
+    path: string containing the path of the bundle
+    model: fitted sklearn estimator or SimpleNN
+    feature_columns: list of the feature columns, in the order of the training
+    label_classes: classes of the label encoder (label_encoder.classes_)
+    scaler: fitted StandardScaler applied to the features before the model, if any
+    window_size: rolling window of the mean/std features, if any
+    """
+    import joblib
+
+    bundle = {
+        'feature_columns': list(feature_columns),
+        'label_classes': np.asarray(label_classes),
+        'scaler': scaler,
+        'window_size': window_size,
+    }
+    if hasattr(model, 'state_dict'):
+        bundle.update({
+            'kind': 'torch',
+            'model': {name: tensor.detach().cpu() for name, tensor in model.state_dict().items()},
+            'architecture': {
+                'NN_input_dim': model.fc1.in_features,
+                'NN_hidden_dim': model.fc1.out_features,
+                'NN_output_dim': model.fc2.out_features,
+            },
+        })
+    else:
+        bundle.update({'kind': 'sklearn', 'model': model})
+
+    joblib.dump(bundle, path)
+
+
+class InferenceModel:
+    """
+    Batched CPU inference of a model bundle.
+
+    Parameters:
+    bundle: dict as saved by save_bundle()
+    optimize: for torch models, 'none', 'trace' (TorchScript) or 'quantize' (dynamic int8 quantization of the
+              linear layers)
+    threads: number of torch threads, unchanged if None (1 is usually fastest for micro-batches)
+    """
+
+    def __init__(self, bundle, optimize='none', threads=None):
+        self.kind = bundle['kind']
+        self.feature_columns = bundle['feature_columns']
+        self.label_classes = bundle.get('label_classes')
+        self.window_size = bundle.get('window_size')
+        self.optimize = optimize
+
+        # The scaler is applied as (x - mean) / scale, without the overhead of sklearn per batch
+        scaler = bundle.get('scaler')
+        self._mean = np.asarray(scaler.mean_, dtype=np.float64) if scaler is not None else None
+        self._scale = np.asarray(scaler.scale_, dtype=np.float64) if scaler is not None else None
+
+        if self.kind == 'torch':
+            import torch
+            from torch import nn
+
+            if threads is not None:
+                torch.set_num_threads(threads)
+
+            model = simple_nn_class()(**bundle['architecture'])
+            model.load_state_dict(bundle['model'])
+            model.eval()
+
+            if optimize == 'quantize':
+                model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+            elif optimize == 'trace':
+                example = torch.zeros(1, len(self.feature_columns), dtype=torch.float32)
+                with torch.inference_mode():
+                    model = torch.jit.freeze(torch.jit.trace(model, example))
+            elif optimize != 'none':
+                raise ValueError(f"Unknown optimization {optimize}, expected 'none', 'trace' or 'quantize'")
+            self._torch = torch
+        elif optimize != 'none':
+            raise ValueError("Only the torch models can be traced or quantized")
+
+        self.model = bundle['model'] if self.kind == 'sklearn' else model
+
+    @property
+    def name(self):
+        return f"{type(self.model).__name__} ({self.kind}, {self.optimize})"
+
+    def predict(self, rows):
+        """
+        Parameters:
+        rows: array-like (n, len(feature_columns)) of feature rows
+
+        Returns:
+        np.ndarray of the class ids
+        """
+        features = np.asarray(rows, dtype=np.float64)
+        if self._mean is not None:
+            features = (features - self._mean) / self._scale
+
+        if self.kind == 'torch':
+            with self._torch.inference_mode():
+                outputs = self.model(self._torch.from_numpy(features.astype(np.float32)))
+            return outputs.argmax(dim=1).numpy()
+
+        with warnings.catch_warnings():
+            # The model was fitted on a DataFrame, the feature order is the same
+            warnings.filterwarnings('ignore', message='X does not have valid feature names')
+            return self.model.predict(features)
+
+    def predict_labels(self, rows):
+        predicted = self.predict(rows)
+        return self.label_classes[predicted] if self.label_classes is not None else predicted
+
+
+def load_bundle(path, label_classes=None, optimize='none', threads=None):
+    """
+    This function loads a model bundle, or a bare estimator saved with joblib.dump(clf, ...).
+
+    Parameters:
+    path: string containing the path of the joblib file
+    label_classes: classes of the label encoder, for a bare estimator
+
+    Returns:
+    InferenceModel
+    """
+    import joblib
+
+    bundle = joblib.load(path)
+    if not (isinstance(bundle, dict) and 'kind' in bundle):
+        # Model of the RandomForest notebooks: 9 features with mean/std, 3 with the raw deltas
+        n_features = getattr(bundle, 'n_features_in_', len(FEATURE_COLUMNS))
+        bundle = {
+            'kind': 'sklearn',
+            'model': bundle,
+            'feature_columns': FEATURE_COLUMNS if n_features == len(FEATURE_COLUMNS) else DELTA_COLUMNS,
+            'label_classes': np.asarray(label_classes) if label_classes is not None else None,
+            'scaler': None,
+            'window_size': 20 if n_features == len(FEATURE_COLUMNS) else None,
+        }
+
+    return InferenceModel(bundle, optimize, threads)
+
+
+def benchmark_batch_sizes(model, rows, batch_sizes=BATCH_SIZES, min_rows=20000, max_batches=2000):
+    """
+    This function measures the cost of the model per batch size.
+
+    Parameters:
+    model: InferenceModel
+    rows: np.ndarray of feature rows, reused cyclically
+    batch_sizes: list of batch sizes
+    min_rows: rows predicted per batch size (at least), bounded by max_batches
+
+    Returns:
+    list of dict: batch size, rows per second, p50 / p99 latency of a batch in s
+    """
+    rows = np.asarray(rows, dtype=np.float64)
+    results = []
+    for batch_size in batch_sizes:
+        batches = max(1, min(max_batches, -(-min_rows // batch_size)))
+        latencies = []
+        model.predict(rows[:batch_size])  # warm up
+
+        start_all = time.perf_counter()
+        for n in range(batches):
+            first = (n * batch_size) % max(1, len(rows) - batch_size)
+            batch = rows[first:first + batch_size]
+            start = time.perf_counter()
+            model.predict(batch)
+            latencies.append(time.perf_counter() - start)
+        elapsed = time.perf_counter() - start_all
+
+        results.append({
+            'batch_size': batch_size,
+            'rows_per_s': batches * batch_size / elapsed,
+            'latency_p50_s': percentile(latencies, 50),
+            'latency_p99_s': percentile(latencies, 99),
+        })
+
+    return results
+
+
+def load_feature_rows(data_csv, feature_columns, window_size):
+    """
+    This function reads deltas and computes the feature columns of the model.
+
+    Returns:
+    np.ndarray of the feature rows without NaN
+    """
+    import pandas as pd
+
+    from rolling_features import RollingFeatureEngine
+
+    df = pd.read_csv(data_csv)
+    if window_size:
+        df = RollingFeatureEngine(DELTA_COLUMNS, window_size).transform(df)
+    return df[feature_columns].dropna().to_numpy(dtype=np.float64)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inference cost of the classifiers per batch size")
+    parser.add_argument("models", nargs="+", help="model bundles or joblib models")
+    parser.add_argument("--data", default="./Classifiers/combined_training_data_01.csv", help="csv of deltas")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=list(BATCH_SIZES))
+    parser.add_argument("--optimize", nargs="+", default=["none"], help="none, trace, quantize (torch models)")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--output", help="json file of the results")
+    args = parser.parse_args()
+
+    report = []
+    for model_path in args.models:
+        for optimize in args.optimize:
+            try:
+                model = load_bundle(model_path, optimize=optimize, threads=args.threads)
+            except ValueError as error:
+                print(f"{model_path} ({optimize}): {error}")
+                continue
+
+            rows = load_feature_rows(args.data, model.feature_columns, model.window_size)
+            print(f"{model_path}: {model.name}")
+            for result in benchmark_batch_sizes(model, rows, args.batch_sizes):
+                print(f"  batch {result['batch_size']:>5}: {result['rows_per_s']:>10.0f} rows/s, "
+                      f"p50 {result['latency_p50_s'] * 1000:8.3f} ms, p99 {result['latency_p99_s'] * 1000:8.3f} ms")
+                report.append(dict(result, model=model_path, optimize=optimize))
+
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(report, outfile, indent=4)
@@ -0,0 +1,365 @@
+from collections import deque
+
+FIELDNAMES = ['id', 'timestamp', 'pressure_values']
+
+# Maximum difference between the firmware timestamps of the frames of one group (half of the 20 ms period)
+ALIGNMENT_TOLERANCE_MS = 10
+
+
+def iter_raw_lines(raw_csv="./RAW_LOG.csv"):
+    """
+    This function lazily yields the lines of a raw notification log, one at a time.
+
+    Parameters:
+    raw_csv: string containing the path to the raw log written by the client
+
+    Returns:
+    generator of strings
+    """
+    with open(raw_csv, mode='r', newline='') as infile:
+        for line in infile:
+            yield line
+
+
+def parse_frame(line):
+    """
+    This function parses one firmware frame 'ID,XXXXXXXX,XXXXXX' (cf. new_packet() in main.c).
+
+    Parameters:
+    line: string of a decoded notification or a line of the raw log
+
+    Returns:
+    tuple (id, timestamp, pressure_values) of integers, or None for garbage lines
+    """
+    # The firmware sends a fixed size payload: the frame, '\n' and NUL padding
+    fields = line.split('\n', 1)[0].strip('\x00\r ').split(',')
+    if len(fields) != 3 or not all(field.isdigit() for field in fields):
+        return None
+
+    return int(fields[0]), int(fields[1]), int(fields[2])
+
+
+def parse_frames(lines):
+    """
+    This function replaces build_csv(): it turns raw log lines into frames and skips the garbage lines
+    (NUL padding of the notifications) that build_csv() dropped by keeping every other line.
+
+    Parameters:
+    lines: iterable of strings
+
+    Returns:
+    generator of (id, timestamp, pressure_values) tuples
+    """
+    for line in lines:
+        frame = parse_frame(line)
+        if frame is not None:
+            yield frame
+
+
+class TripletAligner:
+    """
+    Incremental version of filter_successive_ids(): keeps the last three frames and releases them
+    only when their ids are exactly 1, 2, 3. The buffer is reset after each released triplet.
+    """
+
+    def __init__(self, id_sequence=(1, 2, 3)):
+        self.id_sequence = tuple(id_sequence)
+        self._buffer = deque(maxlen=len(self.id_sequence))
+        self.frames_in = 0
+        self.frames_out = 0
+
+    def push(self, frame):
+        """
+        Parameters:
+        frame: tuple (id, timestamp, pressure_values)
+
+        Returns:
+        list of the aligned frames of a complete triplet, or an empty list
+        """
+        self.frames_in += 1
+        self._buffer.append(frame)
+
+        if len(self._buffer) == self._buffer.maxlen and \
+                tuple(b_frame[0] for b_frame in self._buffer) == self.id_sequence:
+            triplet = list(self._buffer)
+            self._buffer.clear()
+            self.frames_out += len(triplet)
+            return triplet
+
+        return []
+
+
+class TimestampAligner:
+    """
+    Alignment by firmware timestamp, for any number of devices: the frames are queued per device and a group of
+    one frame per device is released (in device id order) as soon as the oldest queued frames of all the devices are
+    within `tolerance_ms` of each other. Otherwise the oldest of these frames cannot be part of a group and is
+    dropped. Unlike TripletAligner, the order in which the BLE links deliver the frames does not matter, only the
+    order of the frames of each device.
+
+    The device clocks are only set to the time of day by the Current Time Service and can differ by more than a
+    sampling period. If clock_offsets is None, the offset of each device to the first one is estimated from the
+    first `warmup` frames, as in alignment.estimate_clock_offsets(): frames received one after the other were
+    sampled at about the same time.
+
+    The offsets then follow the clocks: each device runs on its own crystal and drifts, and the firmware sets its
+    clock again through CTS when it reconnects. The residual of every released group moves the offsets by a fraction
+    `tracking` (exponential moving average), which follows the drift. After a reconnection, seen as a step of more than
+    `resync_gap_ms` (forward or backward) between two frames of a device, or after `resync_after` frames dropped in a row,
+    the queued frames are discarded and the offsets are estimated again from the next `warmup` frames. A jump of the
+    clock cannot be told from the timestamps alone: shifted by whole sampling periods, the groups would still be
+    within the tolerance, with the wrong readings.
+
+    Parameters:
+    device_ids: ids of the devices, e.g. (1, 2, 3)
+    tolerance_ms: maximum spread of the timestamps of a group, after removing the clock offsets
+    clock_offsets: dict {id: offset in ms} of the device clocks to the first device, starting values
+    max_pending: frames queued per device, the oldest are dropped when a device stops sending
+    tracking: weight of the residual of a group in the offsets, 0 to keep the offsets fixed
+    resync_after: frames dropped in a row before the offsets are estimated again, None to never
+    resync_gap_ms: step between two frames of a device after which the offsets are estimated again, None to never
+    """
+
+    def __init__(self, device_ids=(1, 2, 3), tolerance_ms=ALIGNMENT_TOLERANCE_MS, clock_offsets=None, warmup=50,
+                 max_pending=1000, tracking=0.05, resync_after=50, resync_gap_ms=1000):
+        self.device_ids = tuple(sorted(device_ids))
+        self.tolerance_ms = tolerance_ms
+        self.clock_offsets = dict(clock_offsets) if clock_offsets is not None else None
+        self.warmup = warmup
+        self.tracking = tracking
+        self.resync_after = resync_after
+        self.resync_gap_ms = resync_gap_ms
+        self._previous_frame = {}
+        self._queues = {device_id: deque(maxlen=max_pending) for device_id in self.device_ids}
+        self._offset_samples = {device_id: [] for device_id in self.device_ids[1:]}
+        self._last_timestamp = {}
+        self._dropped_in_row = 0
+        self.frames_in = 0
+        self.frames_out = 0
+        self.resyncs = 0
+
+    def resync(self):
+        """
+        Discard the queued frames and estimate the clock offsets again, e.g. after a reconnection.
+        """
+        for queue in self._queues.values():
+            queue.clear()
+        self._offset_samples = {device_id: [] for device_id in self.device_ids[1:]}
+        self._last_timestamp = {}
+        self._dropped_in_row = 0
+        self.clock_offsets = None
+        self.resyncs += 1
+
+    def _estimate_offsets(self, device_id, timestamp):
+        # Difference to the previous / next frame of the reference device in the order of reception
+        reference_id = self.device_ids[0]
+        if device_id == reference_id:
+            for other_id, samples in self._offset_samples.items():
+                if other_id in self._last_timestamp:
+                    samples.append(self._last_timestamp[other_id] - timestamp)
+        elif reference_id in self._last_timestamp:
+            self._offset_samples[device_id].append(timestamp - self._last_timestamp[reference_id])
+        self._last_timestamp[device_id] = timestamp
+
+        if all(len(samples) >= self.warmup for samples in self._offset_samples.values()):
+            self.clock_offsets = {reference_id: 0}
+            for other_id, samples in self._offset_samples.items():
+                samples = sorted(samples)
+                self.clock_offsets[other_id] = samples[len(samples) // 2]
+
+    def push(self, frame):
+        """
+        Parameters:
+        frame: tuple (id, timestamp, pressure_values)
+
+        Returns:
+        list of the aligned frames of the released groups, or an empty list
+        """
+        self.frames_in += 1
+        queue = self._queues.get(frame[0])
+        if queue is None:
+            return []
+
+        previous = self._previous_frame.get(frame[0])
+        self._previous_frame[frame[0]] = frame[1]
+        if self.resync_gap_ms is not None and previous is not None and abs(frame[1] - previous) > self.resync_gap_ms:
+            # Reconnection of the device: its clock may have been set again by CTS
+            self.resync()
+        queue.append(frame)
+
+        if self.clock_offsets is None:
+            self._estimate_offsets(frame[0], frame[1])
+            if self.clock_offsets is None:
+                return []
+
+        aligned = []
+        queues = [self._queues[device_id] for device_id in self.device_ids]
+        offsets = [self.clock_offsets.get(device_id, 0) for device_id in self.device_ids]
+        while all(queues):
+            times = [queue[0][1] - offset for queue, offset in zip(queues, offsets)]
+            oldest = times.index(min(times))
+            if max(times) - times[oldest] <= self.tolerance_ms:
+                aligned.extend(queue.popleft() for queue in queues)
+                self._dropped_in_row = 0
+                if self.tracking:
+                    # Residual of each device to the reference device, the offsets follow the clock drift
+                    for position in range(1, len(offsets)):
+                        offsets[position] += self.tracking * (times[position] - times[0])
+                        self.clock_offsets[self.device_ids[position]] = offsets[position]
+            else:
+                queues[oldest].popleft()
+                self._dropped_in_row += 1
+                if self.resync_after is not None and self._dropped_in_row >= self.resync_after:
+                    # The clocks jumped (CTS after a reconnection): the offsets no longer hold
+                    self.frames_out += len(aligned)
+                    self.resync()
+                    return aligned
+
+        self.frames_out += len(aligned)
+        return aligned
+
+
+def align_frames(frames, aligner):
+    """
+    This function filters a stream of frames through an aligner (TripletAligner, TimestampAligner).
+
+    Returns:
+    generator of (id, timestamp, pressure_values) tuples
+    """
+    for frame in frames:
+        yield from aligner.push(frame)
+
+
+def filter_successive_ids_stream(frames, id_sequence=(1, 2, 3)):
+    """
+    This function filters a stream of frames and only yields the ones that belong to a [1, 2, 3] id sequence.
+
+    Parameters:
+    frames: iterable of (id, timestamp, pressure_values) tuples
+
+    Returns:
+    generator of (id, timestamp, pressure_values) tuples
+    """
+    return align_frames(frames, TripletAligner(id_sequence))
+
+
+def calibrate_frames(frames, offsets):
+    """
+    This function subtracts the per device calibration offset from the pressure values.
+
+    Parameters:
+    frames: iterable of (id, timestamp, pressure_values) tuples
+    offsets: dict {id: offset in Pa}
+
+    Returns:
+    generator of (id, timestamp, pressure_values) tuples
+    """
+    for device_id, timestamp, pressure in frames:
+        yield device_id, timestamp, pressure - offsets.get(device_id, 0)
+
+
+def process_raw_log(raw_csv="./RAW_LOG.csv", offsets=None, aligner=None):
+    """
+    Single pass pipeline RAW_LOG -> aligned and calibrated frames, without intermediate files.
+
+    Parameters:
+    raw_csv: string containing the path to the raw log
+    offsets: dict {id: offset in Pa}, no correction if None
+    aligner: TripletAligner() (strict [1, 2, 3] order) if None, or TimestampAligner()
+
+    Returns:
+    generator of (id, timestamp, pressure_values) tuples
+    """
+    frames = align_frames(parse_frames(iter_raw_lines(raw_csv)), aligner or TripletAligner())
+    if offsets:
+        frames = calibrate_frames(frames, offsets)
+    return frames
+
+
+def write_frames_csv(frames, out_csv, chunk_size=4096):
+    """
+    This function writes frames to a csv with header 'id,timestamp,pressure_values', in chunks.
+
+    Parameters:
+    frames: iterable of (id, timestamp, pressure_values) tuples
+    out_csv: string containing the path of the csv to write
+
+    Returns:
+    int: number of rows written
+    """
+    rows = 0
+    with open(out_csv, mode='w', newline='') as outfile:
+        outfile.write(','.join(FIELDNAMES) + '\n')
+        chunk = []
+        for frame in frames:
+            chunk.append('%d,%d,%d\n' % frame)
+            if len(chunk) >= chunk_size:
+                outfile.writelines(chunk)
+                rows += len(chunk)
+                chunk = []
+        outfile.writelines(chunk)
+        rows += len(chunk)
+
+    return rows
+
+
+def frames_to_dataframe(frames):
+    """
+    This function collects frames into a DataFrame with columns 'id, timestamp, pressure_values'.
+
+    Parameters:
+    frames: iterable of (id, timestamp, pressure_values) tuples
+
+    Returns:
+    df (pd.DataFrame)
+    """
+    import numpy as np
+    import pandas as pd
+
+    data = np.fromiter(frames, dtype=np.dtype((np.int64, 3)))
+    return pd.DataFrame(data.reshape(-1, 3), columns=FIELDNAMES)
+
+
+class IngestPipeline:
+    """
+    Incremental form of process_raw_log() for data that is still arriving:
+    feed decoded notifications and get the aligned, calibrated frames back.
+    """
+
+    def __init__(self, offsets=None, aligner=None):
+        self.offsets = offsets or {}
+        self.aligner = aligner or TripletAligner()
+        self.garbage_lines = 0
+
+    def push(self, sensor_value):
+        """
+        Parameters:
+        sensor_value: string of a decoded notification (one or more frames), or list of the
+                      (id, timestamp, pressure_values) frames of a binary notification
+
+        Returns:
+        list of aligned and calibrated (id, timestamp, pressure_values) tuples
+        """
+        if not isinstance(sensor_value, str):
+            return self.push_frames(sensor_value)
+
+        frames = []
+        for line in sensor_value.splitlines():
+            # NUL padding of the fixed size payload is not counted as garbage
+            if not line.strip('\x00\r '):
+                continue
+            frame = parse_frame(line)
+            if frame is None:
+                self.garbage_lines += 1
+                continue
+            frames.append(frame)
+
+        return self.push_frames(frames)
+
+    def push_frames(self, frames):
+        aligned = []
+        for frame in frames:
+            for device_id, timestamp, pressure in self.aligner.push(frame):
+                aligned.append((device_id, timestamp, pressure - self.offsets.get(device_id, 0)))
+
+        return aligned
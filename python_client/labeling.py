@@ -0,0 +1,142 @@
+import heapq
+
+import numpy as np
+
+'''
+    Labeling of the rows of a session from annotated ranges (start, end, label), bounds included.
+
+    The ranges are sorted once and resolved into disjoint segments, then every row is labeled with one searchsorted
+    over the segment starts: O((rows + ranges) log ranges) instead of one pass over the rows per range.
+    Where ranges overlap the last one in the list wins, as with the per-range .loc assignments of
+    preprocessing.ipynb. Rows outside of all the ranges get the default label.
+'''
+
+DEFAULT_LABEL = 'undefined'
+
+
+class IntervalLabeler:
+    """
+    Ranges resolved into disjoint half-open segments [start, end), each with the label of the last range covering it.
+
+    Parameters:
+    time_ranges: list of (start, end, label), bounds included
+
+    Attributes:
+    overlaps: list of the pairs of overlapping ranges ((start, end, label), (start, end, label))
+    gaps: list of the (start, end) intervals between the ranges that no range covers, bounds excluded
+    """
+
+    def __init__(self, time_ranges):
+        self.time_ranges = [(start, end, label) for start, end, label in time_ranges]
+        self.labels = sorted({label for _, _, label in self.time_ranges})
+        self.overlaps = []
+        self.gaps = []
+
+        if not self.time_ranges:
+            self.starts = np.empty(0)
+            self.ends = np.empty(0)
+            self.codes = np.empty(0, dtype=np.int64)
+            return
+
+        starts = np.array([start for start, _, _ in self.time_ranges], dtype=np.float64)
+        # Bounds included: the segment of a range ends right after its end value
+        ends = np.nextafter(np.array([end for _, end, _ in self.time_ranges], dtype=np.float64), np.inf)
+        codes = np.searchsorted(self.labels, [label for _, _, label in self.time_ranges])
+
+        self._find_overlaps_and_gaps(starts, ends)
+        self.starts, self.ends, self.codes = self._resolve(starts, ends, codes)
+
+    def _find_overlaps_and_gaps(self, starts, ends):
+        # With integer bounds (row index, timestamps in ms), [0, 148] and [149, 300] leave no gap
+        step = 1 if all(float(start).is_integer() and float(end).is_integer()
+                        for start, end, _ in self.time_ranges) else 0
+        order = np.argsort(starts, kind='stable')
+        reach = order[0]
+        for position in order[1:]:
+            if starts[position] < ends[reach]:
+                self.overlaps.append((self.time_ranges[reach], self.time_ranges[position]))
+            elif starts[position] > self.time_ranges[reach][1] + step:
+                self.gaps.append((self.time_ranges[reach][1], self.time_ranges[position][0]))
+            if ends[position] > ends[reach]:
+                reach = position
+
+    @staticmethod
+    def _resolve(starts, ends, codes):
+        # Sweep over the boundaries, the active range with the highest position in the list labels the segment
+        boundaries = np.unique(np.concatenate([starts, ends]))
+        opening = np.argsort(starts, kind='stable')
+        active = []
+        segment_starts, segment_ends, segment_codes = [], [], []
+        next_range = 0
+
+        for left, right in zip(boundaries[:-1], boundaries[1:]):
+            while next_range < len(opening) and starts[opening[next_range]] <= left:
+                heapq.heappush(active, -opening[next_range])
+                next_range += 1
+            # Ranges ended below the top of the heap are removed when they reach it
+            while active and ends[-active[0]] <= left:
+                heapq.heappop(active)
+            if not active:
+                continue
+
+            code = codes[-active[0]]
+            if segment_codes and segment_codes[-1] == code and segment_ends[-1] == left:
+                segment_ends[-1] = right
+            else:
+                segment_starts.append(left)
+                segment_ends.append(right)
+                segment_codes.append(code)
+
+        return np.array(segment_starts), np.array(segment_ends), np.array(segment_codes, dtype=np.int64)
+
+    def codes_of(self, values):
+        """
+        Returns:
+        np.ndarray of the label code of each value (index in self.labels), -1 outside of the ranges
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if not len(self.starts):
+            return np.full(len(values), -1, dtype=np.int64)
+
+        segment = np.maximum(np.searchsorted(self.starts, values, side='right') - 1, 0)
+        inside = (values >= self.starts[segment]) & (values < self.ends[segment])
+        return np.where(inside, self.codes[segment], -1)
+
+    def label(self, values, default=DEFAULT_LABEL):
+        """
+        Parameters:
+        values: array-like of the values the ranges refer to (e.g. the 'index' column)
+        default: label of the values outside of the ranges
+
+        Returns:
+        tuple (labels (np.ndarray of str), report dict: counts per label, uncovered_rows, overlaps, gaps)
+        """
+        codes = self.codes_of(values)
+        names = np.array(self.labels + [default], dtype=object)
+        labels = names[codes]  # -1 is the default label
+
+        counts = np.bincount(codes + 1, minlength=len(self.labels) + 1)
+        report = {
+            'counts': {label: int(count) for label, count in zip(self.labels, counts[1:]) if count},
+            'uncovered_rows': int(counts[0]),
+            'overlaps': self.overlaps,
+            'gaps': self.gaps,
+        }
+        return labels, report
+
+
+def label_rows(df, time_ranges, column='index', default=DEFAULT_LABEL):
+    """
+    This function labels the rows of a DataFrame from the ranges of values of a column.
+
+    Parameters:
+    df (pd.DataFrame): DataFrame containing the column
+    time_ranges: list of (start, end, label), bounds included
+    column: column the ranges refer to
+
+    Returns:
+    tuple (df with the added column 'label', report dict: counts per label, uncovered_rows, overlaps, gaps)
+    """
+    labels, report = IntervalLabeler(time_ranges).label(df[column].to_numpy(), default)
+    df['label'] = labels
+    return df, report
@@ -0,0 +1,254 @@
+import asyncio
+import time
+import warnings
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from elevation import ElevationLookupTable
+from ingest_pipeline import IngestPipeline
+from rolling_features import RollingFeatureEngine
+
+DELTA_COLUMNS = ['delta3_1', 'delta3_2', 'delta2_1']
+# Feature order of extract_mv() in Classifiers/RandomForestClassifier_MeanVariance.ipynb
+FEATURE_COLUMNS = DELTA_COLUMNS + RollingFeatureEngine(DELTA_COLUMNS).feature_names
+
+Prediction = namedtuple('Prediction', ['timestamp', 'label', 'latency_s', 'changed'])
+
+
+def load_label_classes(training_csv):
+    """
+    This function returns the classes of the LabelEncoder fitted in the classifier notebooks.
+
+    Parameters:
+    training_csv: string containing the path to the training data with a 'label' column
+
+    Returns:
+    np.ndarray: sorted unique labels
+    """
+    import pandas as pd
+
+    return np.unique(pd.read_csv(training_csv, usecols=['label'])['label'].to_numpy())
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    return float(np.percentile(list(values), q))
+
+
+class LiveClassifier:
+    """
+    Posture classification of a live stream of notifications with the model saved by
+    RandomForestClassifier_MeanVariance.ipynb (activity_classifier_MV.pkl).
+
+    Notifications go through the ingest pipeline (parsing, [1, 2, 3] alignment, calibration). Each aligned
+    frame that completes a window of three different ids gives one row of deltas, as calculate_deltas_elevation()
+    does on the aligned csv. The rolling mean/std of the deltas are kept in O(1) state and the feature rows
+    are predicted in micro-batches of `batch_size` rows, or as soon as the oldest pending row is `max_delay_s` old:
+    checked on each push(), and by run() when no notification arrives.
+
+    Parameters:
+    model: path to a model bundle or joblib model (see inference.py), or a fitted estimator
+    label_classes: classes of the label encoder used for training (sorted labels), class ids are returned if None
+    offsets: dict {id: calibration offset in Pa}
+    window_size: rolling window of the mean/std features (20 in the notebooks), the window of the bundle if it has one
+    aligner: aligner of the ingest pipeline, strict [1, 2, 3] order (TripletAligner) if None
+    """
+
+    def __init__(self, model, label_classes=None, offsets=None, window_size=20, batch_size=8, max_delay_s=0.1,
+                 aligner=None):
+        if isinstance(model, str):
+            from inference import load_bundle
+
+            # Model bundle (model, scaler, label classes) or bare joblib estimator
+            model = load_bundle(model, label_classes)
+            if label_classes is None:
+                label_classes = model.label_classes
+
+        self.model = model
+        self.label_classes = np.asarray(label_classes) if label_classes is not None else None
+        self.batch_size = batch_size
+        self.max_delay_s = max_delay_s
+
+        self.pipeline = IngestPipeline(offsets, aligner)
+        self.elevation = ElevationLookupTable()
+        self.feature_columns, self.features = self._feature_layout(model, window_size)
+        computed = DELTA_COLUMNS + (self.features.feature_names if self.features is not None else [])
+        # Position of each feature column of the model in the computed row (deltas then rolling features)
+        self._row_index = [computed.index(column) for column in self.feature_columns]
+
+        self._window = deque(maxlen=3)
+        self._pending_rows = []
+        self._pending_meta = []
+        self._rows_queued = None
+
+        # Single worker so that pushes from concurrent notification handlers stay ordered
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self.latencies = deque(maxlen=100000)
+        self.predicted_rows = 0
+        self.predict_time_s = 0.0
+        self._first_push = None
+        self._last_prediction = None
+        self.current_label = None
+
+    @staticmethod
+    def _feature_layout(model, window_size):
+        # Feature columns of the model, in its training order, and the rolling engine they need (None for raw deltas)
+        feature_columns = getattr(model, 'feature_columns', None)
+        if feature_columns is None:
+            # Bare estimator of the RandomForest notebooks: 9 features with mean/std, 3 with the raw deltas
+            n_features = getattr(model, 'n_features_in_', len(FEATURE_COLUMNS))
+            feature_columns = FEATURE_COLUMNS if n_features == len(FEATURE_COLUMNS) else DELTA_COLUMNS
+        feature_columns = list(feature_columns)
+
+        rolling = [column for column in feature_columns if column not in DELTA_COLUMNS]
+        if not rolling:
+            return feature_columns, None
+
+        features = [feature for feature in RollingFeatureEngine.FEATURES
+                    if any(column.endswith(f'_{feature}') for column in rolling)]
+        engine = RollingFeatureEngine(DELTA_COLUMNS, getattr(model, 'window_size', None) or window_size, features)
+        unknown = [column for column in rolling if column not in engine.feature_names]
+        if unknown:
+            raise ValueError(f"Unknown feature columns {unknown} of the model")
+        return feature_columns, engine
+
+    def push(self, sensor_value, received_at=None):
+        """
+        Parameters:
+        sensor_value: string of a decoded notification, or list of (id, timestamp, pressure_values) frames
+        received_at: time.perf_counter() when the notification was received
+
+        Returns:
+        list of Prediction(timestamp, label, latency_s, changed)
+        """
+        if received_at is None:
+            received_at = time.perf_counter()
+        if self._first_push is None:
+            self._first_push = received_at
+
+        for device_id, timestamp, pressure in self.pipeline.push(sensor_value):
+            self._window.append((device_id, timestamp, int(self.elevation(pressure))))
+            if len(self._window) < 3 or len({frame[0] for frame in self._window}) < 3:
+                continue
+
+            elevation_value = {frame[0]: frame[2] for frame in self._window}
+            deltas = (elevation_value[3] - elevation_value[1],
+                      elevation_value[3] - elevation_value[2],
+                      elevation_value[2] - elevation_value[1])
+
+            computed = list(deltas)
+            if self.features is not None:
+                rolling_features = self.features.update(deltas)
+                if rolling_features is None:
+                    continue
+                computed += rolling_features
+
+            self._pending_rows.append([computed[position] for position in self._row_index])
+            self._pending_meta.append((timestamp, received_at))
+
+        if len(self._pending_rows) >= self.batch_size or \
+                (self._pending_meta and time.perf_counter() - self._pending_meta[0][1] >= self.max_delay_s):
+            return self.flush()
+
+        return []
+
+    async def push_async(self, sensor_value, received_at=None):
+        """
+        Same as push(), run in the classifier thread so the event loop is not blocked by the model.
+        """
+        if received_at is None:
+            received_at = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        predictions = await loop.run_in_executor(self._executor, self.push, sensor_value, received_at)
+        if self._pending_meta and self._rows_queued is not None:
+            self._rows_queued.set()
+        return predictions
+
+    async def run(self, stop_event, callback=None):
+        """
+        Predict the pending rows once the oldest one is `max_delay_s` old, also when no notification comes to push()
+        them (stalled or ended stream), until stop_event is set; then predict the remaining rows.
+
+        Parameters:
+        stop_event: asyncio.Event set at the end of the session
+        callback: function called with the list of Prediction of each flush
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            stopping = stop_event.is_set()
+            # The lists are swapped by flush() in the classifier thread, read a reference once
+            pending = self._pending_meta
+            due = pending[0][1] + self.max_delay_s - time.perf_counter() if pending else self.max_delay_s
+            if stopping or (pending and due <= 0):
+                predictions = await loop.run_in_executor(self._executor, self.flush)
+                if predictions and callback is not None:
+                    callback(predictions)
+                if stopping:
+                    return
+                continue
+
+            # Woken up by push_async() when rows are queued, otherwise checks stop_event every max_delay_s
+            self._rows_queued = self._rows_queued or asyncio.Event()
+            try:
+                await asyncio.wait_for((stop_event if pending else self._rows_queued).wait(), due)
+            except asyncio.TimeoutError:
+                pass
+            self._rows_queued.clear()
+
+    def flush(self):
+        """
+        Predict the pending feature rows.
+
+        Returns:
+        list of Prediction(timestamp, label, latency_s, changed)
+        """
+        if not self._pending_rows:
+            return []
+
+        rows, self._pending_rows = self._pending_rows, []
+        meta, self._pending_meta = self._pending_meta, []
+
+        start = time.perf_counter()
+        with warnings.catch_warnings():
+            # The model was fitted on a DataFrame, the feature order is the same
+            warnings.filterwarnings('ignore', message='X does not have valid feature names')
+            predicted = self.model.predict(np.asarray(rows, dtype=np.float64))
+        done = time.perf_counter()
+
+        self.predict_time_s += done - start
+        self.predicted_rows += len(rows)
+        self._last_prediction = done
+
+        if self.label_classes is not None:
+            predicted = self.label_classes[predicted]
+
+        predictions = []
+        for (timestamp, received_at), label in zip(meta, predicted):
+            latency = done - received_at
+            self.latencies.append(latency)
+            predictions.append(Prediction(timestamp, label, latency, label != self.current_label))
+            self.current_label = label
+
+        return predictions
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        """
+        Returns:
+        dict: latency from notification to label (s) and prediction throughput (rows/s)
+        """
+        wall_time = (self._last_prediction - self._first_push) if self._last_prediction else 0.0
+        return {
+            'predicted_rows': self.predicted_rows,
+            'latency_p50_s': percentile(self.latencies, 50),
+            'latency_p99_s': percentile(self.latencies, 99),
+            'latency_max_s': max(self.latencies) if self.latencies else float('nan'),
+            'throughput_rows_per_s': self.predicted_rows / wall_time if wall_time > 0 else float('nan'),
+            'model_capacity_rows_per_s': self.predicted_rows / self.predict_time_s if self.predict_time_s > 0 else float('nan'),
+        }
@@ -0,0 +1,221 @@
+import asyncio
+import os
+import time
+
+import numpy as np
+
+from elevation import ElevationLookupTable
+from ingest_pipeline import parse_frame
+
+'''
+    Live view of a logging session, fed by the notifications as they arrive.
+
+    Each device has a ring buffer of its last readings. The figure is refreshed at a fixed frame rate and each line
+    is decimated to at most `max_points` points (min and max of each bucket), so long sessions draw quickly and the
+    peaks stay visible. With an output folder, the frames are rendered headless (Agg) to png files.
+'''
+
+
+class RingBuffer:
+    """
+    Last `capacity` (timestamp, value) pairs of one device.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._timestamps = np.zeros(capacity, dtype=np.float64)
+        self._values = np.zeros(capacity, dtype=np.float64)
+        self._position = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, value):
+        self._timestamps[self._position] = timestamp
+        self._values[self._position] = value
+        self._position = (self._position + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def arrays(self):
+        """
+        Returns:
+        tuple (timestamps, values) of np.ndarray, oldest first
+        """
+        if self._count < self.capacity:
+            return self._timestamps[:self._count], self._values[:self._count]
+        order = np.roll(np.arange(self.capacity), -self._position)
+        return self._timestamps[order], self._values[order]
+
+
+def minmax_decimate(x, y, max_points):
+    """
+    This function reduces a line to at most max_points points: the values are split in max_points / 2 buckets
+    and the minimum and maximum of each bucket are kept, in their original order.
+
+    Returns:
+    tuple (x, y) of np.ndarray
+    """
+    buckets = max_points // 2
+    if len(y) <= max_points or buckets == 0:
+        return x, y
+
+    size = -(-len(y) // buckets)
+    full = len(y) // size * size
+    windows = y[:full].reshape(-1, size)
+    starts = np.arange(0, full, size)
+
+    indices = [np.minimum(windows.argmin(axis=1), windows.argmax(axis=1)) + starts,
+               np.maximum(windows.argmin(axis=1), windows.argmax(axis=1)) + starts]
+    if full < len(y):
+        tail = y[full:]
+        indices[0] = np.append(indices[0], full + min(tail.argmin(), tail.argmax()))
+        indices[1] = np.append(indices[1], full + max(tail.argmin(), tail.argmax()))
+
+    index = np.column_stack(indices).ravel()
+    return x[index], y[index]
+
+
+class LiveDashboard:
+    """
+    Live plot of the elevation (or pressure) of each device.
+
+    Parameters:
+    capacity: readings kept per device (50 Hz: 180000 = 1 hour)
+    fps: refresh rate of the figure
+    max_points: points drawn per device after decimation
+    offsets: dict {id: calibration offset in Pa}
+    elevation: plot the elevation in cm instead of the pressure in Pa
+    output_folder: write the frames to png files instead of showing a window
+    """
+
+    def __init__(self, capacity=180000, fps=5.0, max_points=2000, offsets=None, elevation=True, output_folder=None):
+        self.capacity = capacity
+        self.fps = fps
+        self.max_points = max_points
+        self.offsets = offsets or {}
+        self.output_folder = output_folder
+        self.to_elevation = ElevationLookupTable() if elevation else None
+
+        self.buffers = {}
+        self.frames_rendered = 0
+        self.render_time_s = 0.0
+
+        self._figure = None
+        self._axes = None
+        self._lines = {}
+
+    def push(self, sensor_value):
+        """
+        Parameters:
+        sensor_value: string of a decoded notification, or list of (id, timestamp, pressure_values) frames
+        """
+        if not isinstance(sensor_value, str):
+            for frame in sensor_value:
+                self.push_frame(*frame)
+            return
+
+        for line in sensor_value.splitlines():
+            frame = parse_frame(line)
+            if frame is not None:
+                self.push_frame(*frame)
+
+    def push_frame(self, device_id, timestamp, pressure):
+        buffer = self.buffers.get(device_id)
+        if buffer is None:
+            buffer = self.buffers[device_id] = RingBuffer(self.capacity)
+
+        pressure -= self.offsets.get(device_id, 0)
+        buffer.append(timestamp, self.to_elevation(pressure) if self.to_elevation else pressure)
+
+    def _setup(self):
+        if self.output_folder is not None:
+            # Headless rendering, independent of the pyplot backend
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            from matplotlib.figure import Figure
+
+            os.makedirs(self.output_folder, exist_ok=True)
+            self._figure = Figure(figsize=(10, 6))
+            FigureCanvasAgg(self._figure)
+            self._axes = self._figure.add_subplot()
+        else:
+            import matplotlib.pyplot as plt
+
+            plt.ion()
+            self._figure, self._axes = plt.subplots(figsize=(10, 6))
+            plt.show(block=False)
+
+        self._axes.set_title('Measurements of Elevation' if self.to_elevation else 'Measurements of Pressure')
+        self._axes.set_ylabel('Elevation Value' if self.to_elevation else 'Pressure Value')
+        self._axes.set_xlabel('Time in ms')
+
+    def snapshot(self):
+        """
+        Returns:
+        dict {id: (timestamps, values)} of the decimated buffers
+        """
+        return {device_id: minmax_decimate(*self.buffers[device_id].arrays(), self.max_points)
+                for device_id in sorted(self.buffers)}
+
+    def draw(self, lines):
+        """
+        Draw one frame of a snapshot(). Only touches the figure, so a headless figure can be drawn in a thread.
+        """
+        start = time.perf_counter()
+        if self._figure is None:
+            self._setup()
+
+        for device_id, (x, y) in lines.items():
+            line = self._lines.get(device_id)
+            if line is None:
+                line, = self._axes.plot(x, y, label=f'DEV{device_id}')
+                self._lines[device_id] = line
+                self._axes.legend(loc='upper left')
+            else:
+                line.set_data(x, y)
+
+        self._axes.relim()
+        self._axes.autoscale_view()
+
+        if self.output_folder is not None:
+            self._figure.savefig(os.path.join(self.output_folder, f'frame_{self.frames_rendered:05d}.png'))
+        else:
+            self._figure.canvas.draw_idle()
+            self._figure.canvas.flush_events()
+
+        self.frames_rendered += 1
+        self.render_time_s += time.perf_counter() - start
+
+    def render(self):
+        """
+        Draw the current content of the buffers: one frame.
+        """
+        self.draw(self.snapshot())
+
+    async def run(self, stop_event):
+        """
+        Refresh the figure at the fixed frame rate until stop_event is set, then draw the last frame.
+        """
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.fps
+        while not stop_event.is_set():
+            next_frame = time.monotonic() + period
+            if self.output_folder is not None:
+                # The buffers are read on the event loop, the png is drawn in a thread to keep receiving
+                await loop.run_in_executor(None, self.draw, self.snapshot())
+            else:
+                # GUI backends have to draw from the main thread
+                self.render()
+            try:
+                await asyncio.wait_for(stop_event.wait(), max(0.0, next_frame - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+        self.render()
+
+    def stats(self):
+        return {
+            'frames_rendered': self.frames_rendered,
+            'mean_render_time_s': self.render_time_s / self.frames_rendered if self.frames_rendered else float('nan'),
+            'points_per_device': {device_id: len(buffer) for device_id, buffer in self.buffers.items()},
+        }
@@ -0,0 +1,293 @@
+import asyncio
+import bisect
+import json
+import os
+import time
+
+from ingest_pipeline import TripletAligner, parse_frame
+
+'''
+    Metrics of a live logging session, to tell where data is lost: radio (notifications per device, firmware
+    timestamp gaps), host (decode failures, write queue latency) or pipeline ([1, 2, 3] alignment yield).
+
+    The metrics are counters and histograms with labels. They are printed as a summary line every few seconds and
+    written as a json or Prometheus text snapshot file.
+'''
+
+# Gap between two successive firmware timestamps of a device, in ms (20 ms at 50 Hz)
+GAP_BUCKETS_MS = (15, 20, 25, 30, 40, 60, 100, 200, 500, 1000, 5000)
+# Time between queueing a frame and its write to the raw log, in s
+LATENCY_BUCKETS_S = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+PROMETHEUS_PREFIX = 'posture_'
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def total(self):
+        return sum(self.values.values())
+
+
+class Histogram:
+    """
+    Histogram with fixed upper bounds, as the Prometheus histograms. The quantiles are estimated from the buckets.
+    """
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0, 'max': value}
+        series['counts'][bisect.bisect_left(self.buckets, value)] += 1
+        series['sum'] += value
+        series['count'] += 1
+        if value > series['max']:
+            series['max'] = value
+
+    def quantile(self, q, **labels):
+        """
+        Returns:
+        upper bound of the bucket holding the q quantile (at most the maximum value), the maximum for the last bucket,
+        None without values
+        """
+        series = self.values.get(_label_key(labels))
+        if series is None:
+            return None
+        rank = q * series['count']
+        cumulative = 0
+        for bound, count in zip(self.buckets, series['counts']):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, series['max'])
+        return series['max']
+
+
+class SessionMetrics:
+    """
+    Metrics of a logging session.
+
+    - notifications per device (name) and per second, from the session manager
+    - decode failures (non-ASCII notifications) and garbage frames
+    - gap between successive firmware timestamps per device id
+    - alignment yield, with the same kind of aligner as the ingest pipeline (TripletAligner if None)
+    - write queue latency of the raw log writer
+    - reconnections per device
+    """
+
+    def __init__(self, aligner=None):
+        self.start_time = time.monotonic()
+        self.notifications = Counter('notifications_total', 'Notifications received per device')
+        self.decode_failures = Counter('decode_failures_total', 'Notifications that are neither ASCII nor binary')
+        self.garbage_frames = Counter('garbage_frames_total', 'Decoded notifications that are not a frame')
+        self.frames = Counter('frames_total', 'Frames per device id')
+        self.aligned_frames = Counter('aligned_frames_total', 'Frames kept by the alignment')
+        self.reconnections = Counter('reconnections_total', 'Reconnections per device')
+        self.timestamp_gaps = Histogram('timestamp_gap_ms', 'Gap between successive firmware timestamps',
+                                        GAP_BUCKETS_MS)
+        self.write_latency = Histogram('write_queue_latency_seconds', 'Time from queueing to writing a frame',
+                                       LATENCY_BUCKETS_S)
+
+        self._aligner = aligner or TripletAligner()
+        self._last_timestamp = {}
+        self._last_report = (self.start_time, {})
+
+    def notification(self, device_name):
+        self.notifications.inc(device=device_name)
+
+    def decode_failure(self):
+        self.decode_failures.inc()
+
+    def reconnection(self, device_name):
+        self.reconnections.inc(device=device_name)
+
+    def observe_write_latency(self, latency_s):
+        self.write_latency.observe(latency_s)
+
+    def observe_frames(self, sensor_value):
+        """
+        Parameters:
+        sensor_value: string of a decoded notification, or list of the (id, timestamp, pressure_values) frames of
+                      a binary notification
+        """
+        if not isinstance(sensor_value, str):
+            for frame in sensor_value:
+                self._observe_frame(frame)
+            return
+
+        for line in sensor_value.splitlines():
+            if not line.strip('\x00\r '):
+                continue
+            frame = parse_frame(line)
+            if frame is None:
+                self.garbage_frames.inc()
+                continue
+            self._observe_frame(frame)
+
+    def _observe_frame(self, frame):
+        device_id, timestamp, _ = frame
+        self.frames.inc(device_id=device_id)
+        last_timestamp = self._last_timestamp.get(device_id)
+        if last_timestamp is not None:
+            self.timestamp_gaps.observe(timestamp - last_timestamp, device_id=device_id)
+        self._last_timestamp[device_id] = timestamp
+
+        aligned = self._aligner.push(frame)
+        if aligned:
+            self.aligned_frames.inc(len(aligned))
+
+    def alignment_yield(self):
+        frames = self.frames.total()
+        return self.aligned_frames.total() / frames if frames else None
+
+    def snapshot(self):
+        """
+        Returns:
+        dict of all the metrics, json serializable
+        """
+        elapsed = time.monotonic() - self.start_time
+        return {
+            'elapsed_s': elapsed,
+            'notifications': {dict(key)['device']: value for key, value in self.notifications.values.items()},
+            'notifications_per_s': {dict(key)['device']: value / elapsed if elapsed > 0 else None
+                                    for key, value in self.notifications.values.items()},
+            'reconnections': {dict(key)['device']: value for key, value in self.reconnections.values.items()},
+            'decode_failures': self.decode_failures.total(),
+            'garbage_frames': self.garbage_frames.total(),
+            'frames': {dict(key)['device_id']: value for key, value in self.frames.values.items()},
+            'aligned_frames': self.aligned_frames.total(),
+            'alignment_yield': self.alignment_yield(),
+            'timestamp_gap_ms': {
+                dict(key)['device_id']: {
+                    'count': series['count'],
+                    'mean': series['sum'] / series['count'],
+                    'p50': self.timestamp_gaps.quantile(0.5, **dict(key)),
+                    'p99': self.timestamp_gaps.quantile(0.99, **dict(key)),
+                    'max': series['max'],
+                }
+                for key, series in self.timestamp_gaps.values.items()
+            },
+            'write_queue_latency_s': {
+                'p50': self.write_latency.quantile(0.5),
+                'p99': self.write_latency.quantile(0.99),
+                'max': self.write_latency.values[()]['max'] if () in self.write_latency.values else None,
+            },
+        }
+
+    def summary_line(self):
+        """
+        Returns:
+        string: rates since the previous summary line, gaps, alignment yield and write latency
+        """
+        now = time.monotonic()
+        previous_time, previous_counts = self._last_report
+        counts = {dict(key)['device']: value for key, value in self.notifications.values.items()}
+        self._last_report = (now, counts)
+
+        interval = now - previous_time
+        rates = ' '.join(f"{device} {(count - previous_counts.get(device, 0)) / interval:.1f}/s"
+                         for device, count in sorted(counts.items())) if interval > 0 else ''
+        gaps = ' '.join(f"{dict(key)['device_id']}:{self.timestamp_gaps.quantile(0.99, **dict(key))}"
+                        for key in sorted(self.timestamp_gaps.values))
+        alignment_yield = self.alignment_yield()
+        latency = self.write_latency.quantile(0.99)
+
+        parts = [
+            f"[{now - self.start_time:7.1f} s] {rates or 'no notification'}",
+            f"decode failures {self.decode_failures.total()} garbage {self.garbage_frames.total()}",
+            f"gap p99 ms {gaps or '-'}",
+            f"yield {alignment_yield * 100:.1f}%" if alignment_yield is not None else "yield -",
+            f"write p99 {latency * 1000:.0f} ms" if latency is not None else "write -",
+        ]
+        return ' | '.join(parts)
+
+    def prometheus_text(self):
+        """
+        Returns:
+        string: the metrics in the Prometheus text exposition format
+        """
+        lines = []
+
+        def labels_text(key, extra=()):
+            pairs = list(key) + list(extra)
+            return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}' if pairs else ''
+
+        for counter in (self.notifications, self.reconnections, self.decode_failures, self.garbage_frames,
+                        self.frames, self.aligned_frames):
+            name = PROMETHEUS_PREFIX + counter.name
+            lines.append(f"# HELP {name} {counter.help}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(counter.values.items()):
+                lines.append(f"{name}{labels_text(key)} {value}")
+
+        for histogram in (self.timestamp_gaps, self.write_latency):
+            name = PROMETHEUS_PREFIX + histogram.name
+            lines.append(f"# HELP {name} {histogram.help}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, series in sorted(histogram.values.items()):
+                cumulative = 0
+                for bound, count in zip(list(histogram.buckets) + ['+Inf'], series['counts']):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{labels_text(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{labels_text(key)} {series['sum']}")
+                lines.append(f"{name}_count{labels_text(key)} {series['count']}")
+
+        return '\n'.join(lines) + '\n'
+
+    def snapshot_text(self, path):
+        """
+        Returns:
+        string: the snapshot as Prometheus text for a '.prom' file and as json otherwise
+        """
+        if path.endswith('.prom'):
+            return self.prometheus_text()
+        return json.dumps(self.snapshot(), indent=4)
+
+    def write_snapshot(self, path, content=None):
+        """
+        Write the snapshot (or content, from snapshot_text()) to path.
+        The file is replaced atomically so that it can be read while the session runs.
+        """
+        if content is None:
+            content = self.snapshot_text(path)
+
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w') as outfile:
+            outfile.write(content)
+        os.replace(temporary_path, path)
+
+    async def report(self, stop_event, interval_s=5.0, snapshot_path=None):
+        """
+        Print a summary line (and write the snapshot file) every interval_s until stop_event is set.
+        The snapshot is taken on the event loop, while the counters do not change, and written in the default executor
+        so that the file I/O does not add to the loop lag.
+        """
+        loop = asyncio.get_running_loop()
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(stop_event.wait(), interval_s)
+            except asyncio.TimeoutError:
+                pass
+            print(self.summary_line())
+            if snapshot_path is not None:
+                await loop.run_in_executor(None, self.write_snapshot, snapshot_path, self.snapshot_text(snapshot_path))
@@ -1,50 +1,102 @@
+import argparse
 import re
+import time
 
-new_file_lines: list = []
+# Regex to test against: the 20 bytes of a notification, e.g. 31-2C-30-30-...
+PAYLOAD_REGEX = re.compile(
+    r"\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-"
+    r"\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}"
+)
 
+# Number of decoded lines written at once
+CHUNK_LINES = 65536
 
-def parse_app():
-    with open("./Log.txt", 'r') as f:
-        log_file_lines = f.readlines()
 
-    # Regex to test against
-    regex = (
-        r"\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-"
-        r"\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}-\w{2}"
-    )
+def decode_payload(payload):
+    """
+    This function decodes a payload '31-2C-...' to a string of the same characters as chr(int(byte, 16)).
+    """
+    try:
+        # One char per byte value, as chr() for 0..255
+        return bytes.fromhex(payload.replace('-', '')).decode('latin-1')
+    except ValueError:
+        # \w{2} also matches non hex characters, keep the behaviour of int(byte, 16) for these
+        return ''.join(chr(int(char, 16)) for char in payload.split('-'))
 
-    lines_decoded = []
 
-    # Extract the string from each line and store
-    for line in log_file_lines:
-        # Check for Application log lines
-        if (line[0]) == "A":
-            matches = re.search(regex, line)
-            if matches:
-                payload = matches.group()
-                payload_chars = payload.split('-')
-                line_decoded = ''
+def decode_line(line):
+    """
+    This function returns the first 15 characters of the notification decoded from a log line, None if the line
+    is not an application log line with a payload.
+    """
+    # Check for Application log lines
+    if not line.startswith("A"):
+        return None
 
-                for char in payload_chars:
-                    # print(letter)
-                    line_decoded = line_decoded + chr(int(char, 16))
+    # A payload has a '-' as third character: skip the search up to 2 characters before the first one
+    first_dash = line.find('-')
+    if first_dash < 0:
+        return None
 
-                lines_decoded.append(line_decoded[:15])
+    matches = PAYLOAD_REGEX.search(line, max(first_dash - 2, 0))
+    if matches:
+        return decode_payload(matches.group())[:15]
+    return None
 
-    # print(lines_decoded)
 
-    with open("./LOG.csv", "w") as destination_file:
+def parse_app(log_txt="./Log.txt", out_csv="./LOG.csv"):
+    """
+    This function converts the notifications of a phone log (nRF Connect) to a csv, in constant memory.
+
+    Parameters:
+    log_txt: string containing the path to the nRF Connect log
+    out_csv: string containing the path of the csv
+
+    Returns:
+    dict: number of log lines read, notifications written, lines per second
+    """
+    start = time.perf_counter()
+    read_lines = 0
+    written = 0
+
+    with open(log_txt, 'r') as log_file, open(out_csv, "w") as destination_file:
         # write csv header
-        destination_file.writelines("id,timestamp,pressure_values\n")
+        destination_file.write("id,timestamp,pressure_values\n")
 
-        # Write 1 line, skip 2 (garbage values in )
-        for line in lines_decoded:
-            # print(line[:15])
-            destination_file.write(line[:15] + "\n")
+        chunk = []
+        for line in log_file:
+            read_lines += 1
+            decoded = decode_line(line)
+            if decoded is None:
+                continue
 
-        destination_file.close()
+            chunk.append(decoded)
+            if len(chunk) >= CHUNK_LINES:
+                destination_file.write("\n".join(chunk) + "\n")
+                written += len(chunk)
+                chunk = []
+
+        if chunk:
+            destination_file.write("\n".join(chunk) + "\n")
+            written += len(chunk)
+
+    duration = time.perf_counter() - start
+    stats = {
+        'read_lines': read_lines,
+        'written_lines': written,
+        'duration_s': duration,
+        'lines_per_s': read_lines / duration if duration > 0 else float('nan'),
+    }
+    print(f"{read_lines} log lines read, {written} notifications written "
+          f"in {duration:.2f} s ({stats['lines_per_s']:.0f} lines/s)")
+    return stats
 
 
 if __name__ == "__main__":
-    parse_app()
-    print(f"Phone LOG converted and saved to: ./LOG.csv")
+    parser = argparse.ArgumentParser(description="Convert a phone log (nRF Connect) to csv")
+    parser.add_argument("log_txt", nargs="?", default="./Log.txt")
+    parser.add_argument("--output", default="./LOG.csv")
+    args = parser.parse_args()
+
+    parse_app(args.log_txt, args.output)
+    print(f"Phone LOG converted and saved to: {args.output}")
@@ -1,8 +1,14 @@
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import csv
+from numpy.lib.stride_tricks import sliding_window_view
 from datetime import datetime
 
+from alignment import read_aligned_csv
+from calibration import apply_calibration, load_offsets
+from elevation import pressure_to_elevation_cm
+from labeling import label_rows
+from rolling_features import RollingFeatureEngine
+
 
 def save_df_to_csv(saved_df, tag):
     # Save csv of the data
@@ -11,80 +17,14 @@ def save_df_to_csv(saved_df, tag):
     print(f"Values of LOG saved to ./training_data/LOG_{now}_{tag}.csv")
 
 
-def filter_successive_ids(input_csv):
-    """
-    This function takes a csv of pressure values as input and filters the successive values that have the same id.
-
-    Parameters:
-    input_csv: string containing the path to a csv containing duplicate values of id 
-
-    Returns:
-    df (pd.DataFrame): DataFrame containing the filtered values with columns 'id, timestamp, pressure_values'
-    """
-    with open(input_csv, mode='r') as infile, open('./LOG_CROPPED.csv', mode='w', newline='') as outfile:
-        reader = csv.DictReader(infile)
-        fieldnames = reader.fieldnames
-        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-        writer.writeheader()
-        
-        buffer = []
-        
-        for row in reader:
-            buffer.append(row)
-            # Only keep the last three rows in the buffer
-            if len(buffer) > 3:
-                buffer.pop(0)
-            
-            # Check if the buffer contains the sequence [1, 2, 3]
-            if len(buffer) == 3:
-                    if [r['id'] for r in buffer] == ['1', '2', '3']:
-                        for b_row in buffer:
-                            writer.writerow(b_row)
-                        buffer = []
-    
-    return pd.read_csv('./LOG_CROPPED.csv')
-
-
-def pressure_to_elevation_m(pressure_Pa):
-    """
-    This function takes a pressure_values and converts it to an elevation value using the atmospheric formula.
-
-    Parameters:
-    pressure_Pa: integer of a pressure value.
-
-    Returns:
-    h_cm: integer of an elevation value in cm
-    """
-    pressure_hPa = pressure_Pa / 100
-    # Constants
-    P0 = 1013.25  # sea level standard atmospheric pressure in hPa
-    L = 0.0065    # temperature lapse rate in K/m
-    T0 = 288.15   # sea level standard temperature in K
-    g = 9.80665   # acceleration due to gravity in m/s^2
-    M = 0.0289644 # molar mass of Earth's air in kg/mol
-    R = 8.31432   # universal gas constant in N·m/(mol·K)
-
-    # Calculate the exponent
-    exponent = (R * L) / (g * M)
-    
-    # Calculate the height in meters
-    h_m = (T0 / L) * (1 - (pressure_hPa / P0) ** exponent)
-    
-    # Convert the height to centimeters
-    h_cm = h_m * 100
-    
-    return int(h_cm)
-    # return int(h_m)
-
-
 def preprocess_df_pressure(in_csv):
-    out_data = filter_successive_ids(in_csv)
+    out_data = read_aligned_csv(in_csv)
        
     # Preprocessing the data before plotting
     out_data.astype(int)
     
-    # subtract from the reading of device 3. Measurement correction done after calibration.
-    out_data.loc[out_data['id'] == 3, 'pressure_values'] -= 25
+    # Measurement correction per device, from the calibration registry
+    out_data = apply_calibration(out_data, load_offsets(in_csv))
     
     # Subtract from pressure value at sea level
     out_data['pressure_values'] = 101325 - out_data['pressure_values']
@@ -93,14 +33,14 @@ def preprocess_df_pressure(in_csv):
 
 
 def preprocess_df_elevation(in_csv):
-    out_data = filter_successive_ids(in_csv)
+    out_data = read_aligned_csv(in_csv)
        
     # Preprocessing the data before plotting
     out_data.astype(int)
     
-    # subtract from the reading of device 3. Measurement correction done after calibration.
-    out_data.loc[out_data['id'] == 3, 'pressure_values'] -= 25
-    out_data['elevation_value'] = out_data['pressure_values'].apply(pressure_to_elevation_m)
+    # Measurement correction per device, from the calibration registry
+    out_data = apply_calibration(out_data, load_offsets(in_csv))
+    out_data['elevation_value'] = pressure_to_elevation_cm(out_data['pressure_values'])
     out_data = out_data.drop(columns=['pressure_values'])
    
     return out_data
@@ -116,6 +56,8 @@ def plot_pressure_data(plot_df):
     Returns:
     None
     """
+    import matplotlib.pyplot as plt
+
     # Plot data for each id
     unique_ids = plot_df['id'].unique()
     
@@ -141,6 +83,8 @@ def plot_elevation_data(plot_df):
     Returns:
     None
     """
+    import matplotlib.pyplot as plt
+
     # Plot data for each id
     unique_ids = plot_df['id'].unique()
     
@@ -168,21 +112,32 @@ def calculate_deltas_elevation(data_frame):
     Returns:
     df (pd.DataFrame): DataFrame containing columns 'index, delta3_1 , delta3_2, delta2_1'
     """
-    results = []
-    for i in range(len(data_frame) - 2):
-        subset = data_frame.iloc[i:i + 3]
-        if subset['id'].nunique() == 3:
-            # Calculate the differences between their elevation values
-            elevation_value = subset.set_index('id')['elevation_value']
-            delta3_1 = elevation_value[3] - elevation_value[1]
-            delta3_2 = elevation_value[3] - elevation_value[2]
-            delta2_1 = elevation_value[2] - elevation_value[1]
-
-            # Append the result
-            results.append([i, delta3_1, delta3_2, delta2_1])
-    
-    # Convert the results to a DataFrame
-    deltas_df = pd.DataFrame(results, columns=['index', 'delta3_1', 'delta3_2', 'delta2_1'])
+    ids = data_frame['id'].to_numpy()
+    elevation = data_frame['elevation_value'].to_numpy()
+    if len(data_frame) < 3:
+        return pd.DataFrame(columns=['index', 'delta3_1', 'delta3_2', 'delta2_1'])
+
+    # Window i holds the rows i, i+1, i+2 (same as iloc[i:i + 3])
+    id_windows = sliding_window_view(ids, 3)
+    elevation_windows = sliding_window_view(elevation, 3)
+
+    # A window is valid when each of the ids 1, 2, 3 appears exactly once in it
+    id_masks = {device_id: id_windows == device_id for device_id in (1, 2, 3)}
+    valid = np.logical_and.reduce([mask.sum(axis=1) == 1 for mask in id_masks.values()])
+    index = np.flatnonzero(valid)
+
+    # Elevation value of each device in the valid windows
+    elevation_value = {
+        device_id: np.take_along_axis(elevation_windows[index], mask[index].argmax(axis=1)[:, None], axis=1)[:, 0]
+        for device_id, mask in id_masks.items()
+    }
+
+    deltas_df = pd.DataFrame({
+        'index': index,
+        'delta3_1': elevation_value[3] - elevation_value[1],
+        'delta3_2': elevation_value[3] - elevation_value[2],
+        'delta2_1': elevation_value[2] - elevation_value[1],
+    })
 
     return deltas_df
 
@@ -197,6 +152,8 @@ def plot_deltas(deltas_df):
     Returns:
     None
     """
+    import matplotlib.pyplot as plt
+
     # Set 'index' column as the index for plotting
     deltas_df.set_index('index', inplace=True)
 
@@ -215,43 +172,50 @@ def plot_deltas(deltas_df):
     plt.show()
 
 
-def label_based_on_timestamp(elevation_delta_df, time_ranges):
+def label_based_on_timestamp(elevation_delta_df, time_ranges, column='index'):
     """
     Function to label the DataFrame based on timestamp ranges
 
     Parameters:
     df (pd.DataFrame): DataFrame containing columns 'index, delta3_1, delta3_2, delta2_1'
+    time_ranges: list of (start, end, label), bounds included
+    column: column the ranges refer to ('index' as in preprocessing.ipynb)
 
     Returns:
     df (pd.DataFrame): DataFrame containing columns 'index, delta3_1, delta3_2, delta2_1, label'
     """
-    # Initialize the label column with default value
-    elevation_delta_df['label'] = 'undefined'
+    # One searchsorted over the sorted ranges, the last range wins where ranges overlap
+    elevation_delta_df, report = label_rows(elevation_delta_df, time_ranges, column)
 
-    # Iterate over the ranges and apply labels
-    for start, end, label in time_ranges:
-        elevation_delta_df.loc[(elevation_delta_df['avg_timestamp'] >= start) & (elevation_delta_df['avg_timestamp'] <= end), 'label'] = label
+    if report['overlaps']:
+        print(f"Overlapping label ranges, the last one wins: {report['overlaps']}")
+    if time_ranges and report['uncovered_rows']:
+        print(f"{report['uncovered_rows']} rows outside of the label ranges, labeled 'undefined'")
 
     return elevation_delta_df
 
 
-def calculate_mean_variance(df):
-    # Calculate rolling mean and standard deviation
-    window_size = 10
-    df['delta3_1_mean'] = df['delta3_1'].rolling(window=window_size).mean()
-    df['delta3_2_mean'] = df['delta3_2'].rolling(window=window_size).mean()
-    df['delta2_1_mean'] = df['delta2_1'].rolling(window=window_size).mean()
-    df['delta3_1_std'] = df['delta3_1'].rolling(window=window_size).std()
-    df['delta3_2_std'] = df['delta3_2'].rolling(window=window_size).std()
-    df['delta2_1_std'] = df['delta2_1'].rolling(window=window_size).std()
+def calculate_mean_variance(df, window_size=10, features=('mean', 'std')):
+    """
+    This function adds the rolling mean and standard deviation of the deltas to the DataFrame.
+
+    Parameters:
+    df (pd.DataFrame): DataFrame containing columns 'delta3_1, delta3_2, delta2_1'
+    window_size: number of rows of the rolling window
+
+    Returns:
+    df (pd.DataFrame): DataFrame with the added columns 'delta3_1_mean, ..., delta2_1_std'
+    """
+    engine = RollingFeatureEngine(['delta3_1', 'delta3_2', 'delta2_1'], window_size, features)
 
-    return df
+    return engine.transform(df)
 
 
-# Pre-process data
-df_elevation = preprocess_df_elevation('training_data/Measurements_01/LOG_2024-07-25_14-09_laystandsitstand.csv')
-# Calculate deltas
-deltas_elevation = calculate_deltas_elevation(df_elevation)
+if __name__ == "__main__":
+    # Pre-process data
+    df_elevation = preprocess_df_elevation('training_data/Measurements_01/LOG_2024-07-25_14-09_laystandsitstand.csv')
+    # Calculate deltas
+    deltas_elevation = calculate_deltas_elevation(df_elevation)
 
-plot_deltas(deltas_elevation)
+    plot_deltas(deltas_elevation)
 
@@ -0,0 +1,166 @@
+import math
+
+
+class RollingMeanStd:
+    """
+    Rolling mean and standard deviation over the last `window_size` values, updated in O(1) per sample.
+
+    The values are kept in a ring buffer; when the window is full the oldest value is replaced and the
+    running mean / sum of squared differences are updated Welford-style. The standard deviation uses
+    ddof=1, as pandas .rolling().std().
+    """
+
+    def __init__(self, window_size):
+        self.window_size = window_size
+        self._values = [0.0] * window_size
+        self._position = 0
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, value):
+        """
+        Parameters:
+        value: new sample
+
+        Returns:
+        tuple (mean, std) of the window, (None, None) until the window is full
+        """
+        value = float(value)
+
+        if self._count < self.window_size:
+            # Welford insertion
+            self._count += 1
+            delta = value - self._mean
+            self._mean += delta / self._count
+            self._m2 += delta * (value - self._mean)
+        else:
+            # Replace the oldest value of the window
+            old_value = self._values[self._position]
+            old_mean = self._mean
+            self._mean += (value - old_value) / self.window_size
+            self._m2 += (value - old_value) * (value - self._mean + old_value - old_mean)
+
+        self._values[self._position] = value
+        self._position = (self._position + 1) % self.window_size
+
+        if self._count < self.window_size:
+            return None, None
+
+        return self._mean, self.std
+
+    @property
+    def mean(self):
+        return self._mean
+
+    @property
+    def std(self):
+        if self._count < 2:
+            return math.nan
+        # Rounding can leave a tiny negative sum of squares on a constant window
+        return math.sqrt(max(self._m2, 0.0) / (self._count - 1))
+
+    @property
+    def ready(self):
+        return self._count >= self.window_size
+
+    @property
+    def var(self):
+        if self._count < 2:
+            return math.nan
+        return max(self._m2, 0.0) / (self._count - 1)
+
+
+class RollingFeatureEngine:
+    """
+    Rolling window features (mean, std, var) of a set of columns, for the offline training set build and for a
+    live stream.
+
+    Stream mode: update() takes one row and returns its features in O(1).
+    Batch mode: transform() adds the feature columns to a DataFrame, with the values of pandas .rolling().
+
+    The feature columns are named '<column>_<feature>' and ordered by feature then column,
+    e.g. delta3_1_mean, delta3_2_mean, delta2_1_mean, delta3_1_std, ...
+
+    Parameters:
+    columns: list of the input column names
+    window_size: number of rows of the rolling window
+    features: tuple of feature names among 'mean', 'std', 'var'
+    """
+
+    FEATURES = ('mean', 'std', 'var')
+    CHUNK_ROWS = 1 << 18
+
+    def __init__(self, columns, window_size=10, features=('mean', 'std')):
+        unknown = [feature for feature in features if feature not in self.FEATURES]
+        if unknown:
+            raise ValueError(f"Unknown rolling features {unknown}, expected some of {self.FEATURES}")
+        if window_size < 2:
+            raise ValueError("window_size must be at least 2 for a standard deviation")
+
+        self.columns = list(columns)
+        self.window_size = window_size
+        self.features = tuple(features)
+        self._rolling = [RollingMeanStd(window_size) for _ in self.columns]
+
+    @property
+    def feature_names(self):
+        return [f'{column}_{feature}' for feature in self.features for column in self.columns]
+
+    def reset(self):
+        self._rolling = [RollingMeanStd(self.window_size) for _ in self.columns]
+
+    def update(self, values):
+        """
+        Parameters:
+        values: sequence of the new values, in the order of `columns`
+
+        Returns:
+        list of the feature values in the order of `feature_names`, None until the window is full
+        """
+        for rolling, value in zip(self._rolling, values):
+            rolling.update(value)
+
+        if not self._rolling[0].ready:
+            return None
+
+        return [getattr(rolling, feature) for feature in self.features for rolling in self._rolling]
+
+    def transform(self, df):
+        """
+        Batch mode, equivalent to df[column].rolling(window=window_size).<feature>() for every column/feature.
+
+        Parameters:
+        df (pd.DataFrame): DataFrame containing the input columns
+
+        Returns:
+        df (pd.DataFrame): the same DataFrame with the feature columns added (NaN until the window is full)
+        """
+        import numpy as np
+        from numpy.lib.stride_tricks import sliding_window_view
+
+        computed = {}
+        for column in self.columns:
+            values = df[column].to_numpy(dtype=np.float64)
+            computed[column] = {feature: np.full(len(values), np.nan) for feature in self.features}
+
+            if len(values) >= self.window_size:
+                windows = sliding_window_view(values, self.window_size)
+                # Chunks bound the temporary (windows x window_size) arrays of var()
+                for start in range(0, len(windows), self.CHUNK_ROWS):
+                    chunk = windows[start:start + self.CHUNK_ROWS]
+                    rows = slice(start + self.window_size - 1, start + self.window_size - 1 + len(chunk))
+                    if 'mean' in self.features:
+                        computed[column]['mean'][rows] = chunk.mean(axis=1)
+                    if 'std' in self.features or 'var' in self.features:
+                        var = chunk.var(axis=1, ddof=1)
+                        if 'var' in self.features:
+                            computed[column]['var'][rows] = var
+                        if 'std' in self.features:
+                            computed[column]['std'][rows] = np.sqrt(var)
+
+        for feature in self.features:
+            for column in self.columns:
+                df[f'{column}_{feature}'] = computed[column][feature]
+
+        return df
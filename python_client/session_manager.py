@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import time
+
+
+class BleakBackend:
+    """
+    BLE backend of the session manager using bleak. Any object with the same scan() / create_client()
+    methods can be used instead, e.g. the simulated backend to run without hardware.
+    """
+
+    async def scan(self, names, timeout):
+        """
+        One scan for all the devices.
+
+        Parameters:
+        names: list of the advertised names to look for
+        timeout: maximum duration of the scan in seconds
+
+        Returns:
+        dict {name: device} of the devices found
+        """
+        from bleak import BleakScanner
+
+        found = {}
+        all_found = asyncio.Event()
+
+        def detection_callback(device, advertisement_data):
+            name = advertisement_data.local_name or device.name
+            if name in names and name not in found:
+                found[name] = device
+                if len(found) == len(names):
+                    all_found.set()
+
+        async with BleakScanner(detection_callback):
+            try:
+                await asyncio.wait_for(all_found.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return found
+
+    def create_client(self, device, disconnected_callback):
+        """
+        Returns:
+        client with connect(), disconnect(), start_notify(), stop_notify()
+        """
+        from bleak import BleakClient
+
+        return BleakClient(device, disconnected_callback=disconnected_callback)
+
+
+class DeviceStatus:
+    """
+    Connection history of one device during a session. Times are relative to the session start, in seconds.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.connected_at = None
+        self.first_sample_at = None
+        self.last_sample_at = None
+        self.notifications = 0
+        self.connections = 0
+        self.gaps = []
+        self._gap_start = None
+
+    def open_gap(self, now):
+        if self._gap_start is None:
+            self._gap_start = now
+
+    def close_gap(self, now):
+        if self._gap_start is not None:
+            self.gaps.append((self._gap_start, now))
+            self._gap_start = None
+
+    def summary(self):
+        return {
+            'name': self.name,
+            'connected_at_s': self.connected_at,
+            'first_sample_at_s': self.first_sample_at,
+            'notifications': self.notifications,
+            'reconnections': max(self.connections - 1, 0),
+            'gaps': [{'start_s': start, 'end_s': end, 'duration_s': end - start} for start, end in self.gaps],
+            'gap_total_s': sum(end - start for start, end in self.gaps),
+        }
+
+
+class SessionManager:
+    """
+    Connects to N devices and keeps them streaming for the duration of a session.
+
+    - One shared scan discovers all the devices, instead of one find_device_by_name() per device.
+    - The connections are set up in parallel, `max_concurrent_connects` at a time (1 serializes the connection
+      step only, which some adapters need, while scanning is already done).
+    - After a drop, the device is reconnected with exponential backoff and the gap without data is recorded.
+
+    Parameters:
+    device_names: list of the advertised names, e.g. ["DEV001", "DEV002", "DEV003"]
+    notify_uuid: UUID of the characteristic that supports notifications
+    handler: notification callback (characteristic, data)
+    backend: BleakBackend() by default
+    metrics: SessionMetrics counting the notifications and reconnections per device, if given
+    """
+
+    def __init__(self, device_names, notify_uuid, handler, backend=None, scan_timeout=10.0,
+                 max_concurrent_connects=1, backoff_initial=0.5, backoff_max=10.0, metrics=None):
+        self.device_names = list(device_names)
+        self.notify_uuid = notify_uuid
+        self.handler = handler
+        self.backend = backend or BleakBackend()
+        self.scan_timeout = scan_timeout
+        self.max_concurrent_connects = max_concurrent_connects
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.metrics = metrics
+
+        self.status = {name: DeviceStatus(name) for name in self.device_names}
+        self._session_start = None
+
+    def _now(self):
+        return time.monotonic() - self._session_start
+
+    async def run(self, log_duration):
+        """
+        Scan, connect and log for log_duration seconds, then disconnect all the devices.
+        """
+        self._session_start = time.monotonic()
+        deadline = self._session_start + log_duration
+        connect_semaphore = asyncio.Semaphore(self.max_concurrent_connects)
+
+        print(f"scanning for {', '.join(self.device_names)}")
+        found = await self.backend.scan(self.device_names, min(self.scan_timeout, log_duration))
+        print(f"stopped scanning, found {', '.join(found) or 'no device'}")
+
+        await asyncio.gather(
+            *(
+                self._device_session(name, found.get(name), deadline, connect_semaphore)
+                for name in self.device_names
+            )
+        )
+
+    async def _device_session(self, name, device, deadline, connect_semaphore):
+        status = self.status[name]
+        attempt = 0
+
+        while time.monotonic() < deadline:
+            try:
+                if device is None:
+                    device = (await self.backend.scan([name], min(self.scan_timeout, deadline - time.monotonic()))).get(name)
+
+                if device is None:
+                    logging.error("%s not found", name)
+                else:
+                    await self._stream(name, device, deadline, connect_semaphore)
+                    if time.monotonic() >= deadline:
+                        return
+                    attempt = 0
+                    status.open_gap(self._now())
+                    logging.warning("%s dropped at %.1f s, reconnecting", name, self._now())
+
+            except Exception:
+                logging.exception("error with %s", name)
+
+            # Exponential backoff before the next attempt, bounded by the end of the session
+            backoff = min(self.backoff_max, self.backoff_initial * 2 ** attempt)
+            attempt += 1
+            await asyncio.sleep(max(0.0, min(backoff, deadline - time.monotonic())))
+
+        status.close_gap(self._now())
+
+    async def _stream(self, name, device, deadline, connect_semaphore):
+        # Connect and forward the notifications until the device drops or the session ends
+        status = self.status[name]
+        disconnected = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        client = self.backend.create_client(device, lambda _client: loop.call_soon_threadsafe(disconnected.set))
+
+        async with connect_semaphore:
+            print(f"connecting to {name}")
+            await client.connect()
+
+        # The link is always released, also when start_notify() fails, so that a retry does not compete with it
+        notifying = False
+        try:
+            await client.start_notify(self.notify_uuid, self._device_handler(status))
+            notifying = True
+            status.connections += 1
+            if status.connections > 1 and self.metrics is not None:
+                self.metrics.reconnection(name)
+            if status.connected_at is None:
+                status.connected_at = self._now()
+            status.close_gap(self._now())
+            print(f"connected to {name}")
+
+            try:
+                await asyncio.wait_for(disconnected.wait(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            dropped = disconnected.is_set()
+            if notifying and not dropped:
+                try:
+                    await client.stop_notify(self.notify_uuid)
+                except Exception:
+                    logging.exception("error stopping the notifications of %s", name)
+            try:
+                await client.disconnect()
+            except Exception:
+                logging.exception("error disconnecting %s", name)
+            if notifying and not dropped:
+                # End of the session
+                print(f"disconnected from {name}")
+
+    def _device_handler(self, status):
+        metrics = self.metrics
+
+        async def handler(characteristic, data):
+            if metrics is not None:
+                metrics.notification(status.name)
+            now = self._now()
+            if status.first_sample_at is None:
+                status.first_sample_at = now
+            status.last_sample_at = now
+            status.notifications += 1
+            await self.handler(characteristic, data)
+
+        return handler
+
+    def summary(self):
+        """
+        Returns:
+        list of dict: per device time to connect / first sample, reconnections and gaps of the session
+        """
+        return [status.summary() for status in self.status.values()]
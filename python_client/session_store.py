@@ -0,0 +1,326 @@
+import glob
+import json
+import os
+import re
+import struct
+
+import numpy as np
+
+'''
+    Compact binary format for the logging sessions (.pds), to avoid re-parsing csv files.
+
+    File layout:
+        MAGIC (8 bytes) | header length (uint32 little endian) | JSON header | padding | columns
+
+    The JSON header holds the tag, start time, device calibration, number of rows and the offset of each
+    column. The columns are fixed width little endian arrays, each one aligned on ALIGNMENT bytes, so that
+    the reader can return NumPy views of the memory-mapped file without copying.
+
+    Raw sessions have the COLUMNS, labeled deltas the LABELED_COLUMNS with the label names in the header and their
+    codes in the 'label' column. convert_csv_archive() writes the .pds next to the csv files; the readers of the
+    archive (read_session_frame(), read_aligned_csv(), the training set builder and loader) use it when it is at
+    least as recent as the csv, and parse the csv otherwise.
+'''
+
+MAGIC = b'PDSESS\x00\x01'
+ALIGNMENT = 64
+EXTENSION = '.pds'
+
+COLUMNS = [
+    ('id', '<u1'),
+    ('timestamp', '<u4'),
+    ('pressure_values', '<u4'),
+]
+
+DELTA_COLUMNS = ['delta3_1', 'delta3_2', 'delta2_1']
+# The delta columns are stored as '<i4' when the csv has integer deltas, as '<f8' otherwise
+LABELED_COLUMNS = [('index', '<u4')] + [(name, '<i4') for name in DELTA_COLUMNS] + [('label', '<u1')]
+
+# First line of the csv files that can be converted
+RAW_HEADER = ','.join(name for name, _ in COLUMNS)
+LABELED_HEADER = ','.join(name for name, _ in LABELED_COLUMNS)
+
+# Rows of the csv that are not a valid frame are kept with this id so that the [1, 2, 3] alignment is unchanged
+INVALID_ID = 0
+
+FILENAME_PATTERN = re.compile(r'LOG_(\d{4}-\d{2}-\d{2})_(\d{2})-(\d{2})(?:-(\d{2}))?_?(.*)$')
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _column_array(name, values, dtype):
+    # Values out of the range of the column type would wrap around silently when cast (300 -> 44 in u1)
+    values = np.asarray(values)
+    if np.dtype(dtype).kind == 'f':
+        return np.ascontiguousarray(values, dtype=dtype)
+    limits = np.iinfo(dtype)
+    if len(values) and (values.min() < limits.min or values.max() > limits.max):
+        raise ValueError(f"Column '{name}' has values in [{values.min()}, {values.max()}], out of the range "
+                         f"[{limits.min}, {limits.max}] of {dtype}")
+    return np.ascontiguousarray(values, dtype=dtype)
+
+
+def write_session(path, data, tag='', start_time=None, calibration=None, columns=COLUMNS, labels=None):
+    """
+    This function writes a session to the binary format.
+
+    Parameters:
+    path: string containing the path of the .pds file
+    data: pd.DataFrame or dict of arrays with columns 'id, timestamp, pressure_values'
+    tag: logging tag of the session
+    start_time: ISO string of the start of the session
+    calibration: dict {id: offset in Pa} applied to the session, if any
+    columns: list of (name, dtype) of the columns to write
+    labels: list of the label names, the 'label' column holds their positions
+
+    Returns:
+    int: number of rows written, ValueError if a column has values out of the range of its type
+    """
+    arrays = [_column_array(name, data[name], dtype) for name, dtype in columns]
+    rows = len(arrays[0])
+
+    header = {
+        'tag': tag,
+        'start_time': start_time,
+        'calibration': {str(k): v for k, v in (calibration or {}).items()},
+        'rows': rows,
+        'columns': [],
+    }
+    if labels is not None:
+        header['labels'] = list(labels)
+
+    # The column offsets depend on the header length, which depends on the offsets:
+    # grow the room reserved for the header until it fits before the first column
+    reserved = ALIGNMENT
+    while True:
+        offset = _align(len(MAGIC) + 4 + reserved)
+        header['columns'] = []
+        for (name, dtype), array in zip(columns, arrays):
+            header['columns'].append({'name': name, 'dtype': dtype, 'offset': offset})
+            offset = _align(offset + array.nbytes)
+
+        header_bytes = json.dumps(header).encode('utf-8')
+        if len(header_bytes) <= reserved:
+            header_bytes = header_bytes.ljust(reserved)
+            break
+        reserved = _align(len(header_bytes))
+
+    with open(path, 'wb') as outfile:
+        outfile.write(MAGIC)
+        outfile.write(struct.pack('<I', len(header_bytes)))
+        outfile.write(header_bytes)
+        for column, array in zip(header['columns'], arrays):
+            outfile.write(b'\x00' * (column['offset'] - outfile.tell()))
+            outfile.write(array.tobytes())
+
+    return rows
+
+
+class Session:
+    """
+    Session read from a .pds file. The columns are read-only NumPy views of the memory-mapped file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+
+        if bytes(self._map[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a session file")
+
+        header_length = struct.unpack('<I', bytes(self._map[len(MAGIC):len(MAGIC) + 4]))[0]
+        start = len(MAGIC) + 4
+        self.header = json.loads(bytes(self._map[start:start + header_length]).decode('utf-8'))
+
+        self.tag = self.header['tag']
+        self.start_time = self.header['start_time']
+        self.calibration = {int(k): v for k, v in self.header['calibration'].items()}
+        self.rows = self.header['rows']
+        self.labels = self.header.get('labels')
+
+        self.columns = {}
+        for column in self.header['columns']:
+            dtype = np.dtype(column['dtype'])
+            end = column['offset'] + self.rows * dtype.itemsize
+            self.columns[column['name']] = self._map[column['offset']:end].view(dtype)
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def id(self):
+        return self.columns['id']
+
+    @property
+    def timestamp(self):
+        return self.columns['timestamp']
+
+    @property
+    def pressure_values(self):
+        return self.columns['pressure_values']
+
+    def to_dataframe(self, columns=None, start=0, stop=None):
+        """
+        Parameters:
+        columns: names of the columns, all the columns of the file if None
+        start, stop: range of the rows
+
+        Returns:
+        df (pd.DataFrame): DataFrame of the rows, with the types of pd.read_csv (int64, float64, label names)
+        """
+        import pandas as pd
+
+        data = {}
+        for name in columns or list(self.columns):
+            values = self.columns[name][start:stop]
+            if name == 'label' and self.labels is not None:
+                data[name] = pd.array(np.asarray(self.labels, dtype=object)[values], dtype='str')
+            elif values.dtype.kind == 'f':
+                data[name] = values.astype(np.float64)
+            else:
+                data[name] = values.astype(np.int64)
+        # Row numbers of the file as index, as the chunks of pd.read_csv
+        start = min(start, self.rows)
+        return pd.DataFrame(data, index=pd.RangeIndex(start, start + len(next(iter(data.values()), []))))
+
+
+def read_session(path):
+    """
+    This function opens a .pds session without reading or copying its columns.
+
+    Returns:
+    Session
+    """
+    return Session(path)
+
+
+def stored_session_path(csv_path):
+    return os.path.splitext(csv_path)[0] + EXTENSION
+
+
+def open_stored_session(csv_path):
+    """
+    This function opens the .pds file written next to a csv by convert_csv_archive().
+
+    Returns:
+    Session, None if there is no .pds file or if it is older than the csv
+    """
+    pds_path = stored_session_path(csv_path)
+    try:
+        if os.path.getmtime(pds_path) < os.path.getmtime(csv_path):
+            return None
+    except OSError:
+        return None
+    return read_session(pds_path)
+
+
+def read_session_frame(csv_path, columns=None):
+    """
+    This function reads a session csv, from its .pds file when there is an up to date one.
+    Garbage rows of a raw session have the id INVALID_ID in the .pds file and are text in the csv: both break the
+    [1, 2, 3] sequences the same way.
+
+    Returns:
+    df (pd.DataFrame): DataFrame of the columns (all if None)
+    """
+    session = open_stored_session(csv_path)
+    if session is not None:
+        return session.to_dataframe(columns)
+
+    import pandas as pd
+
+    return pd.read_csv(csv_path, usecols=columns)
+
+
+def load_archive(input_folder):
+    """
+    This function opens all the .pds sessions of a folder (recursively).
+
+    Returns:
+    dict {relative path: Session}
+    """
+    paths = sorted(glob.glob(os.path.join(input_folder, '**', '*' + EXTENSION), recursive=True))
+    return {os.path.relpath(path, input_folder): read_session(path) for path in paths}
+
+
+def session_metadata(csv_path):
+    """
+    This function reads the start time and tag from a file name 'LOG_<date>_<time>_<tag>.csv'.
+
+    Returns:
+    tuple (start_time, tag), (None, '') if the name does not match
+    """
+    match = FILENAME_PATTERN.match(os.path.splitext(os.path.basename(csv_path))[0])
+    if match is None:
+        return None, ''
+
+    date, hours, minutes, seconds, tag = match.groups()
+    return f"{date}T{hours}:{minutes}:{seconds or '00'}", tag
+
+
+def _csv_header(csv_path):
+    with open(csv_path, 'r') as infile:
+        return infile.readline().strip()
+
+
+def csv_to_session(csv_path, pds_path, calibration=None):
+    """
+    This function converts a csv with columns 'id, timestamp, pressure_values' to a .pds session.
+    Garbage rows are stored with id INVALID_ID so that they still break the [1, 2, 3] sequences.
+
+    Returns:
+    int: number of rows written
+    """
+    import pandas as pd
+
+    start_time, tag = session_metadata(csv_path)
+    if _csv_header(csv_path) == LABELED_HEADER:
+        return _labeled_csv_to_session(pd.read_csv(csv_path), pds_path, tag, start_time)
+
+    df = pd.read_csv(csv_path, dtype=str)
+    values = df[[name for name, _ in COLUMNS]].apply(pd.to_numeric, errors='coerce')
+    invalid = values.isna().any(axis=1)
+    values.loc[invalid, :] = 0
+    values.loc[invalid, 'id'] = INVALID_ID
+
+    return write_session(pds_path, values.astype(np.int64), tag, start_time, calibration)
+
+
+def _labeled_csv_to_session(df, pds_path, tag, start_time):
+    labels = sorted(df['label'].unique().tolist())
+    columns = [(name, dtype if name not in DELTA_COLUMNS or df[name].dtype.kind in 'iu' else '<f8')
+               for name, dtype in LABELED_COLUMNS]
+    data = dict(df, label=np.searchsorted(labels, df['label'].to_numpy()))
+    return write_session(pds_path, data, tag, start_time, columns=columns, labels=labels)
+
+
+def convert_csv_archive(input_folder, output_folder=None):
+    """
+    This function converts every raw session and labeled deltas csv of a folder (recursively) to .pds files, next
+    to the csv files or in output_folder with the same folder structure. Other csv files are skipped.
+
+    Returns:
+    list of the .pds files written
+    """
+    written = []
+    for csv_path in sorted(glob.glob(os.path.join(input_folder, '**', '*.csv'), recursive=True)):
+        if _csv_header(csv_path) not in (RAW_HEADER, LABELED_HEADER):
+            continue
+
+        pds_path = stored_session_path(csv_path) if output_folder is None else \
+            os.path.join(output_folder, os.path.splitext(os.path.relpath(csv_path, input_folder))[0] + EXTENSION)
+        os.makedirs(os.path.dirname(pds_path), exist_ok=True)
+        rows = csv_to_session(csv_path, pds_path)
+        written.append(pds_path)
+        print(f"{csv_path} -> {pds_path} ({rows} rows)")
+
+    return written
+
+
+if __name__ == "__main__":
+    convert_csv_archive('./Measurements')
@@ -0,0 +1,286 @@
+import argparse
+import asyncio
+import functools
+import inspect
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+'''
+    In-process fake of the BMP581 sensor peripherals, to run the client and load-test the ingest path
+    without hardware. The notifications have the firmware format (new_packet() / sensor_notify() in main.c).
+'''
+
+# cf. main.h: the firmware always notifies SIZE_PAYLOAD bytes
+SIZE_PAYLOAD = 20
+
+
+def format_frame(device_id, timestamp_ms, pressure_Pa):
+    """
+    This function builds a notification payload as the firmware does: sprintf("%1d,%08lu,%06lu\\n") in a
+    zero initialized buffer of SIZE_PAYLOAD bytes.
+
+    Returns:
+    bytearray of SIZE_PAYLOAD bytes
+    """
+    frame = b"%1d,%08lu,%06lu\n" % (device_id, timestamp_ms, pressure_Pa)
+    return bytearray(frame[:SIZE_PAYLOAD].ljust(SIZE_PAYLOAD, b"\x00"))
+
+
+def cts_time_ms():
+    # The firmware timestamp is the time of day in ms, set from the host with the Current Time Service
+    now = datetime.now()
+    return ((now.hour * 60 + now.minute) * 60 + now.second) * 1000 + now.microsecond // 1000
+
+
+class SimulatedPeripheral:
+    """
+    One simulated sensor.
+
+    Parameters:
+    name: advertised name, e.g. "DEV001"
+    device_id: id written in the frames (DEVICE_ID of the firmware)
+    rate_hz: notifications per second (1000 / SAMPLING_INTERVAL_MS = 50 on the real sensors)
+    jitter_s: maximum random delay added to each notification
+    loss: probability that a notification is lost
+    corrupt: probability that a notification carries non-ASCII garbage
+    drop_rate: probability per second that the connection drops
+    binary: send packed binary frames (firmware built with BINARY_FRAMES) instead of ASCII frames
+    batch: binary frames per notification
+    """
+
+    def __init__(self, name, device_id, rate_hz=50.0, jitter_s=0.0, loss=0.0, corrupt=0.0, drop_rate=0.0,
+                 base_pressure_Pa=101200, seed=None, binary=False, batch=1):
+        self.name = name
+        self.device_id = device_id
+        self.rate_hz = rate_hz
+        self.jitter_s = jitter_s
+        self.loss = loss
+        self.corrupt = corrupt
+        self.drop_rate = drop_rate
+        self.base_pressure_Pa = base_pressure_Pa
+        self.binary = binary
+        self.batch = batch
+        self._random = random.Random(seed)
+        self._pending = []
+
+        self.sent = 0
+        self.lost = 0
+        self.corrupted = 0
+        self.drops = 0
+
+    def next_payload(self, timestamp_ms):
+        """
+        Returns:
+        bytearray of the next notification, None if it is lost (or, in binary mode, until a batch is complete)
+        """
+        if self._random.random() < self.loss:
+            self.lost += 1
+            return None
+
+        self.sent += 1
+        if self._random.random() < self.corrupt:
+            self.corrupted += 1
+            return bytearray(self._random.randrange(128, 256) for _ in range(SIZE_PAYLOAD))
+
+        pressure = self.base_pressure_Pa + self._random.randint(-8, 8)
+        if not self.binary:
+            return format_frame(self.device_id, timestamp_ms, pressure)
+
+        from binary_frames import encode_binary
+
+        self._pending.append((self.device_id, timestamp_ms, pressure))
+        if len(self._pending) < self.batch:
+            return None
+        payload, self._pending = bytearray(encode_binary(self._pending)), []
+        return payload
+
+    def jitter(self):
+        return self._random.uniform(0, self.jitter_s) if self.jitter_s else 0.0
+
+    def dropped(self, elapsed_s):
+        return self.drop_rate > 0 and self._random.random() < self.drop_rate * elapsed_s
+
+
+class SimulatedCharacteristic:
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+
+class SimulatedClient:
+    """
+    Same interface as the BleakClient used by the session manager.
+    The notifications are emitted by a task on the event loop, `speedup` times faster than real time.
+    """
+
+    # Period of the emitting task; all the notifications due since the last tick are sent at once
+    TICK_S = 0.005
+
+    def __init__(self, peripheral, disconnected_callback=None, speedup=1.0):
+        self.peripheral = peripheral
+        self.disconnected_callback = disconnected_callback
+        self.speedup = speedup
+        self.is_connected = False
+        self._task = None
+
+    async def connect(self):
+        await asyncio.sleep(0.01)
+        self.is_connected = True
+
+    async def disconnect(self):
+        await self._stop()
+        self.is_connected = False
+
+    async def start_notify(self, uuid, callback):
+        self._task = asyncio.create_task(self._notify_loop(SimulatedCharacteristic(uuid), callback))
+
+    async def stop_notify(self, uuid):
+        await self._stop()
+
+    async def _stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _notify_loop(self, characteristic, callback):
+        peripheral = self.peripheral
+        is_coroutine = inspect.iscoroutinefunction(callback)
+        period_s = 1.0 / (peripheral.rate_hz * self.speedup)
+        timestamp_ms = cts_time_ms()
+        next_due = time.monotonic()
+        last_tick = next_due
+
+        while True:
+            now = time.monotonic()
+            if peripheral.dropped(now - last_tick):
+                peripheral.drops += 1
+                self.is_connected = False
+                if self.disconnected_callback is not None:
+                    self.disconnected_callback(self)
+                return
+            last_tick = now
+
+            while next_due <= now:
+                payload = peripheral.next_payload(timestamp_ms)
+                if payload is not None:
+                    if is_coroutine:
+                        await callback(characteristic, payload)
+                    else:
+                        callback(characteristic, payload)
+                # Firmware time advances at the nominal rate whatever the speedup
+                timestamp_ms += round(1000 / peripheral.rate_hz)
+                next_due += period_s + peripheral.jitter() / self.speedup
+
+            await asyncio.sleep(self.TICK_S)
+
+
+class SimulatedBackend:
+    """
+    Backend for the session manager that serves simulated peripherals instead of bleak.
+    """
+
+    def __init__(self, peripherals, speedup=1.0, scan_delay_s=0.05):
+        self.peripherals = {peripheral.name: peripheral for peripheral in peripherals}
+        self.speedup = speedup
+        self.scan_delay_s = scan_delay_s
+
+    async def scan(self, names, timeout):
+        await asyncio.sleep(min(self.scan_delay_s, timeout))
+        return {name: self.peripherals[name] for name in names if name in self.peripherals}
+
+    def create_client(self, device, disconnected_callback):
+        return SimulatedClient(device, disconnected_callback, self.speedup)
+
+
+def make_peripherals(device_count=3, **kwargs):
+    """
+    Returns:
+    list of SimulatedPeripheral named DEV001, DEV002, ... with the ids 1, 2, 3, 1, 2, 3, ...
+    """
+    return [SimulatedPeripheral(f"DEV{n + 1:03d}", n % 3 + 1, seed=n, **kwargs) for n in range(device_count)]
+
+
+async def run_load_test(device_count=3, rate_hz=50.0, speedup=10.0, duration_s=10.0, jitter_s=0.0, loss=0.0,
+                        corrupt=0.0, drop_rate=0.0, raw_csv=None, binary=False, batch=1):
+    """
+    Runs the client ingest path (notification_handler -> BufferedWriter -> process_raw_log) against
+    simulated sensors and reports the throughput.
+
+    Returns:
+    dict of the results
+    """
+    from bmp581_client import notification_handler
+    from calibration import load_offsets
+    from buffered_writer import BufferedWriter
+    from ingest_pipeline import TimestampAligner, process_raw_log
+    from metrics import SessionMetrics
+    from session_manager import SessionManager
+
+    if raw_csv is None:
+        raw_csv = os.path.join(tempfile.mkdtemp(), "RAW_LOG.csv")
+
+    peripherals = make_peripherals(device_count, rate_hz=rate_hz, jitter_s=jitter_s, loss=loss, corrupt=corrupt,
+                                   drop_rate=drop_rate, binary=binary, batch=batch)
+    backend = SimulatedBackend(peripherals, speedup)
+
+    metrics = SessionMetrics(TimestampAligner())
+    start = time.perf_counter()
+    async with BufferedWriter(raw_csv, metrics=metrics) as writer:
+        handler = functools.partial(notification_handler, writer=writer, metrics=metrics)
+        session = SessionManager([p.name for p in peripherals], "sim", handler, backend, backoff_initial=0.05,
+                                 metrics=metrics)
+        await session.run(duration_s)
+    elapsed = time.perf_counter() - start
+
+    aligned_frames = sum(1 for _ in process_raw_log(raw_csv, load_offsets(), TimestampAligner()))
+    sent = sum(p.sent for p in peripherals)
+    received = sum(device['notifications'] for device in session.summary())
+
+    return {
+        'devices': device_count,
+        'target_rate_hz': rate_hz * speedup * device_count,
+        'duration_s': elapsed,
+        'sent': sent,
+        'lost_on_air': sum(p.lost for p in peripherals),
+        'corrupted': sum(p.corrupted for p in peripherals),
+        'drops': sum(p.drops for p in peripherals),
+        'received': received,
+        'received_per_s': received / elapsed,
+        'received_frames': metrics.frames.total(),
+        'writer': writer.stats(),
+        'aligned_frames': aligned_frames,
+        'metrics': metrics,
+        'raw_csv': raw_csv,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the client ingest path with simulated sensors")
+    parser.add_argument("--devices", type=int, default=3)
+    parser.add_argument("--rate", type=float, default=50.0, help="notifications per second and device")
+    parser.add_argument("--speedup", type=float, nargs="+", default=[1, 10, 100],
+                        help="one run per factor over the real sample rate")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--jitter", type=float, default=0.0, help="max random delay per notification in s")
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--corrupt", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="connection drops per second and device")
+    parser.add_argument("--binary", action="store_true", help="packed binary frames instead of ASCII frames")
+    parser.add_argument("--batch", type=int, default=1, help="binary frames per notification")
+    args = parser.parse_args()
+
+    for factor in args.speedup:
+        result = asyncio.run(run_load_test(args.devices, args.rate, factor, args.duration, args.jitter, args.loss,
+                                           args.corrupt, args.drop_rate, binary=args.binary, batch=args.batch))
+        print(f"x{factor:g}: target {result['target_rate_hz']:.0f}/s, received {result['received_per_s']:.0f}/s, "
+              f"sent {result['sent']}, received {result['received']} ({result['received_frames']} frames), "
+              f"corrupted {result['corrupted']}, "
+              f"written {result['writer']['written_frames']}, dropped {result['writer']['dropped_frames']}, "
+              f"peak queue {result['writer']['peak_queue_depth']}, aligned frames {result['aligned_frames']}")
+        print(f"x{factor:g}: {result['metrics'].summary_line()}")
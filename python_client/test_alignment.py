@@ -0,0 +1,74 @@
+import csv
+import os
+
+import pandas as pd
+import pytest
+
+from alignment import filter_successive_ids, triplet_starts
+
+'''
+    Regression tests of the [1, 2, 3] alignment against the buffer logic it replaced.
+'''
+
+MEASUREMENTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Measurements')
+# Sessions with and without the header repeated in the middle of the log
+SESSIONS = ['LOG_2024-07-25_14-09_laystandsitstand.csv', 'LOG_2024-07-25_13-58_ssl.csv',
+            os.path.join('old_measurements', 'LOG_2024-07-12_17-25_STAND.csv'),
+            os.path.join('old_measurements', 'LOG_2024-07-16_16-30_lay3.csv')]
+GARBAGE = ['id,timestamp,pressure_values', '2,0001', '\x7f\x03,,', '3,00123456,1013xx', 'abc,def,ghi']
+
+
+def buffer_reset_filter(input_csv, output_csv):
+    # Original filter_successive_ids() of preprocessing.py
+    with open(input_csv, mode='r') as infile, open(output_csv, mode='w', newline='') as outfile:
+        reader = csv.DictReader(infile)
+        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
+        writer.writeheader()
+
+        buffer = []
+        for row in reader:
+            buffer.append(row)
+            if len(buffer) > 3:
+                buffer.pop(0)
+            if len(buffer) == 3 and [r['id'] for r in buffer] == ['1', '2', '3']:
+                for b_row in buffer:
+                    writer.writerow(b_row)
+                buffer = []
+
+    return pd.read_csv(output_csv)
+
+
+def with_garbage(input_csv, output_csv):
+    # Garbage lines every 97 rows, inside and between the triplets
+    with open(input_csv, 'r') as infile:
+        lines = infile.read().splitlines()
+    for count, position in enumerate(range(len(lines) - 1, 1, -97)):
+        lines.insert(position, GARBAGE[count % len(GARBAGE)])
+    with open(output_csv, 'w') as outfile:
+        outfile.write('\n'.join(lines) + '\n')
+    return output_csv
+
+
+@pytest.mark.parametrize('session', SESSIONS)
+@pytest.mark.parametrize('garbage', [False, True])
+def test_same_rows_as_buffer_reset(session, garbage, tmp_path):
+    input_csv = os.path.join(MEASUREMENTS, session)
+    if garbage:
+        input_csv = with_garbage(input_csv, tmp_path / 'garbage.csv')
+
+    expected = buffer_reset_filter(input_csv, tmp_path / 'cropped.csv')
+    aligned = filter_successive_ids(pd.read_csv(input_csv))
+
+    assert len(aligned) == len(expected)
+    pd.testing.assert_frame_equal(aligned.astype(str), expected.astype(str))
+
+
+@pytest.mark.parametrize('id_sequence', [(1, 1, 1), (1, 2, 1), (1, 1), (2, 3, 2, 3)])
+def test_self_overlapping_sequence_is_rejected(id_sequence):
+    with pytest.raises(ValueError):
+        triplet_starts([1, 2, 1, 2, 1, 1, 1], id_sequence)
+
+
+def test_sequence_without_overlap():
+    assert triplet_starts([1, 1, 2, 3, 1, 2, 3, 3], (1, 2, 3)).tolist() == [1, 4]
+    assert triplet_starts([2, 1, 2, 1, 2], (1, 2)).tolist() == [1, 3]
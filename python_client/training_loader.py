@@ -0,0 +1,291 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from live_classifier import DELTA_COLUMNS
+from rolling_features import RollingFeatureEngine
+from session_store import open_stored_session
+
+try:
+    import torch
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:
+    # The numpy batches can still be used without torch (e.g. sklearn partial_fit)
+    torch = None
+    IterableDataset = object
+
+    def get_worker_info():
+        return None
+
+'''
+    Out-of-core training data for the classifiers: the labeled sessions are streamed in chunks instead of loading
+    the whole combined csv.
+
+    - The rolling mean/std are computed per session, carrying the last window_size - 1 rows of a chunk over to the
+      next one, so the features are the same as with .rolling() over the whole session (rows without a full window
+      are dropped, as dropna() in the notebooks).
+    - Rows are shuffled in a buffer of bounded size.
+    - With several DataLoader workers, each worker reads its own share of the sessions.
+
+        classes, mean, scale = scan_sessions(paths).values()
+        dataset = SessionDataset(paths, classes, mean=mean, scale=scale, batch_size=64)
+        loader = make_loader(dataset, num_workers=4)
+'''
+
+LABEL_COLUMN = 'label'
+
+
+def session_paths(input_folder, pattern='LOG_*.csv'):
+    return sorted(glob.glob(os.path.join(input_folder, pattern)))
+
+
+def read_chunks(csv_path, columns, chunk_rows):
+    """
+    This function reads a session csv in chunks of chunk_rows rows, from the memory-mapped .pds file when there is
+    an up to date one (cf. session_store.convert_csv_archive).
+
+    Returns:
+    generator of pd.DataFrame
+    """
+    session = open_stored_session(csv_path)
+    if session is None:
+        yield from pd.read_csv(csv_path, usecols=columns, chunksize=chunk_rows)
+        return
+
+    for start in range(0, len(session), chunk_rows):
+        yield session.to_dataframe(columns, start, start + chunk_rows)
+
+
+def iter_session_features(csv_path, window_size=20, chunk_rows=65536, features=('mean', 'std')):
+    """
+    This function reads a session of labeled deltas in chunks and yields the feature rows of each chunk.
+
+    Parameters:
+    csv_path: string containing the path to a csv with columns 'delta3_1, delta3_2, delta2_1, label'
+    window_size: rolling window of the features, no rolling features if None
+    chunk_rows: rows read at once
+
+    Returns:
+    generator of (features (np.ndarray float64), labels (np.ndarray of str))
+    """
+    engine = RollingFeatureEngine(DELTA_COLUMNS, window_size, features) if window_size else None
+    feature_columns = DELTA_COLUMNS + (engine.feature_names if engine else [])
+    carry = None
+
+    for chunk in read_chunks(csv_path, DELTA_COLUMNS + [LABEL_COLUMN], chunk_rows):
+        if engine is not None:
+            # The last rows of the previous chunk complete the first windows of this one
+            carried = 0 if carry is None else len(carry)
+            data = chunk if carry is None else pd.concat([carry, chunk], ignore_index=True)
+            carry = data.iloc[len(data) - (window_size - 1):] if len(data) >= window_size - 1 else data
+            data = engine.transform(data.copy()).iloc[carried:]
+        else:
+            data = chunk
+
+        data = data.dropna(subset=feature_columns)
+        if len(data):
+            yield data[feature_columns].to_numpy(dtype=np.float64), data[LABEL_COLUMN].to_numpy()
+
+
+def scan_sessions(paths, window_size=20, chunk_rows=65536):
+    """
+    This function computes in one streaming pass what the notebooks fit on the whole data: the classes of the
+    label encoder and the mean / scale of the StandardScaler.
+
+    Returns:
+    dict: label_classes (sorted), mean, scale (np.ndarray per feature column), rows
+    """
+    paths = list(paths)
+    if not paths:
+        raise ValueError("No session to scan")
+
+    labels = set()
+    count = 0
+    total = None
+    total_squares = None
+
+    for csv_path in paths:
+        for features, chunk_labels in iter_session_features(csv_path, window_size, chunk_rows):
+            labels.update(chunk_labels.tolist())
+            count += len(features)
+            total = features.sum(axis=0) if total is None else total + features.sum(axis=0)
+            squares = (features ** 2).sum(axis=0)
+            total_squares = squares if total_squares is None else total_squares + squares
+
+    if not count:
+        raise ValueError(f"No feature row in the {len(paths)} sessions (shorter than the window of {window_size} rows?)")
+
+    mean = total / count
+    # Population std as StandardScaler, with 1 for constant columns
+    scale = np.sqrt(np.maximum(total_squares / count - mean ** 2, 0.0))
+    scale[scale == 0] = 1.0
+
+    return {'label_classes': np.array(sorted(labels)), 'mean': mean, 'scale': scale, 'rows': count}
+
+
+class ShuffleBuffer:
+    """
+    Bounded shuffle: chunks of rows go into a buffer of `size` rows; once it is full, each new row replaces a random
+    row of the buffer, which is released. The memory is bounded by the buffer size whatever the data size.
+    """
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self._features = None
+        self._labels = None
+
+    def push(self, features, labels):
+        """
+        Returns:
+        tuple (features, labels) of the released rows, possibly empty
+        """
+        if self._features is None:
+            self._features, self._labels = features[:0], labels[:0]
+
+        room = self.size - len(self._features)
+        if room > 0:
+            taken = min(room, len(features))
+            self._features = np.concatenate([self._features, features[:taken]])
+            self._labels = np.concatenate([self._labels, labels[:taken]])
+            features, labels = features[taken:], labels[taken:]
+
+        if not len(features):
+            return self._features[:0], self._labels[:0]
+
+        # Each remaining new row takes the place of a random buffered row (distinct positions, in the chunk order)
+        if len(features) > self.size:
+            order = self.rng.permutation(len(features))
+            released = (features[order[self.size:]], labels[order[self.size:]])
+            features, labels = features[order[:self.size]], labels[order[:self.size]]
+        else:
+            released = (features[:0], labels[:0])
+
+        positions = self.rng.choice(self.size, len(features), replace=False)
+        released = (np.concatenate([released[0], self._features[positions]]),
+                    np.concatenate([released[1], self._labels[positions]]))
+        self._features[positions] = features
+        self._labels[positions] = labels
+        return released
+
+    def drain(self):
+        if self._features is None:
+            return None, None
+        order = self.rng.permutation(len(self._features))
+        features, labels = self._features[order], self._labels[order]
+        self._features = None
+        return features, labels
+
+
+class SessionDataset(IterableDataset):
+    """
+    Iterable dataset of feature batches streamed from the labeled sessions.
+
+    Parameters:
+    paths: list of the session csv files
+    label_classes: sorted labels (label_encoder.classes_), e.g. from scan_sessions()
+    window_size: rolling window of the mean/std features, None for the raw deltas only
+    mean, scale: StandardScaler parameters applied to the features, if given
+    batch_size: rows per batch
+    shuffle_buffer: rows of the shuffle buffer, 0 to keep the order of the sessions
+    chunk_rows: rows read at once from a session
+    seed: seed of the shuffling, changed per epoch with set_epoch(), to call before each epoch
+
+    Yields (features, labels) batches: float32 / int64 tensors with torch, numpy arrays otherwise.
+    Use it with DataLoader(dataset, batch_size=None), see make_loader().
+    """
+
+    def __init__(self, paths, label_classes, window_size=20, mean=None, scale=None, batch_size=64,
+                 shuffle_buffer=100000, chunk_rows=65536, seed=0):
+        super().__init__()
+        self.paths = list(paths)
+        self.label_classes = np.asarray(label_classes)
+        self.window_size = window_size
+        self.mean = np.asarray(mean) if mean is not None else None
+        self.scale = np.asarray(scale) if scale is not None else None
+        self.batch_size = batch_size
+        self.shuffle_buffer = shuffle_buffer
+        self.chunk_rows = chunk_rows
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _worker_paths(self):
+        # Each DataLoader worker reads its own share of the sessions
+        worker = get_worker_info()
+        if worker is None:
+            return self.paths, 0
+        return self.paths[worker.id::worker.num_workers], worker.id
+
+    def _encode(self, labels):
+        encoded = np.searchsorted(self.label_classes, labels)
+        encoded = np.minimum(encoded, len(self.label_classes) - 1)
+        unknown = self.label_classes[encoded] != labels
+        if unknown.any():
+            raise ValueError(f"Labels not in label_classes: {sorted(set(labels[unknown].tolist()))}")
+        return encoded.astype(np.int64)
+
+    def _batches(self, features, labels, pending):
+        # Cut the released rows in batches, the rest waits for the next rows
+        if pending[0] is not None:
+            features = np.concatenate([pending[0], features])
+            labels = np.concatenate([pending[1], labels])
+        full = len(features) // self.batch_size * self.batch_size
+        for start in range(0, full, self.batch_size):
+            yield self._to_output(features[start:start + self.batch_size], labels[start:start + self.batch_size])
+        pending[0], pending[1] = features[full:], labels[full:]
+
+    def _to_output(self, features, labels):
+        if self.mean is not None:
+            features = (features - self.mean) / self.scale
+        features = features.astype(np.float32)
+        if torch is not None:
+            return torch.from_numpy(features), torch.from_numpy(labels)
+        return features, labels
+
+    def __iter__(self):
+        paths, worker_id = self._worker_paths()
+        rng = np.random.default_rng([self.seed, self.epoch, worker_id])
+        if self.shuffle_buffer:
+            # The sessions are read in a random order as well
+            paths = [paths[n] for n in rng.permutation(len(paths))]
+        buffer = ShuffleBuffer(self.shuffle_buffer, rng) if self.shuffle_buffer else None
+        pending = [None, None]
+
+        for csv_path in paths:
+            for features, labels in iter_session_features(csv_path, self.window_size, self.chunk_rows):
+                labels = self._encode(labels)
+                if buffer is not None:
+                    features, labels = buffer.push(features, labels)
+                yield from self._batches(features, labels, pending)
+
+        if buffer is not None:
+            features, labels = buffer.drain()
+            if features is not None:
+                yield from self._batches(features, labels, pending)
+
+        if pending[0] is not None and len(pending[0]):
+            yield self._to_output(pending[0], pending[1])
+
+
+def make_loader(dataset, num_workers=None, **kwargs):
+    """
+    This function wraps a SessionDataset in a DataLoader: the dataset yields whole batches, the workers read
+    different sessions.
+
+    Parameters:
+    num_workers: number of worker processes, os.cpu_count() if None
+
+    Returns:
+    torch.utils.data.DataLoader
+    """
+    from torch.utils.data import DataLoader
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 0
+    # No persistent workers: the workers get a fresh copy of the dataset each epoch, with the epoch of set_epoch()
+    return DataLoader(dataset, batch_size=None, num_workers=num_workers, **kwargs)
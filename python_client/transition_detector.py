@@ -0,0 +1,440 @@
+import argparse
+import glob
+import os
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+'''
+    Detection of the posture transitions (stand -> sit, sit -> stand, stand -> lay, ...) as events in the stream of
+    deltas of calculate_deltas_elevation(), instead of a label per row.
+
+    The detector alternates between two states:
+    - settling: waits for a window of `settle_size` rows in which the std of every delta is below `settle_std`.
+      The mean/std of that window become the reference of the posture.
+    - monitoring: two-sided CUSUM of the standardized deltas against the reference. When one of the sums exceeds
+      `threshold` a change is detected; its onset is the row where that sum last left zero. The detector then
+      settles on the new posture, and the transition event is emitted with the levels before and after it.
+
+    A transition often settles for a moment half way (e.g. sitting on the edge of the chair first). The event is
+    only emitted once the new posture has held `min_dwell` rows without another change; a change within these rows
+    continues the same transition.
+
+    Changes smaller than `min_shift` cm on every delta (a move without a change of posture) give no event. With
+    posture centroids (posture_centroids()), the postures before and after are named with the closest centroid, and
+    a change that ends in the same posture gives no event either.
+
+    Stream mode: TransitionDetector.update() takes one row of deltas, O(1) per row. The change is known
+    (in_transition) as soon as it is detected, its event is emitted settle_size + min_dwell rows after its end.
+    Batch mode: detect_transitions() runs the same detector over a whole session with array operations:
+    the rolling std once, and the CUSUM of a monitoring period with cumulative sums. The window stats of both modes
+    come from running sums of the values and their squares, exact for integer deltas, so that both modes settle on
+    the same rows.
+
+        python transition_detector.py Measurements/data_labeled/LOG_*.csv --training "Measurements/data_labeled/LOG_*.csv"
+
+    The centroids of a scored session are computed from the other training sessions (leave one session out). A
+    training csv that already contains the scored sessions, as Classifiers/combined_training_data_01.csv, gives
+    in-sample results.
+'''
+
+DELTA_COLUMNS = ['delta3_1', 'delta3_2', 'delta2_1']
+POSTURES = ('stand', 'sit', 'lay')
+
+# Rows of the CUSUM computed at once in batch mode
+BLOCK_ROWS = 4096
+
+TransitionEvent = namedtuple('TransitionEvent', ['onset', 'detected', 'end', 'before', 'after', 'label'])
+
+
+def posture_centroids(df, columns=DELTA_COLUMNS, postures=POSTURES):
+    """
+    This function computes the mean deltas of each posture of a labeled DataFrame.
+
+    Parameters:
+    df (pd.DataFrame): DataFrame containing the delta columns and a column 'label'
+    postures: labels of the postures, the rows of the transitions (e.g. 'stand_sit') are left out
+
+    Returns:
+    dict {posture: np.ndarray of the mean of each delta column}
+    """
+    means = df[df['label'].isin(postures)].groupby('label')[list(columns)].mean()
+    return {posture: means.loc[posture].to_numpy(dtype=np.float64) for posture in means.index}
+
+
+def window_stats(sums, squares, size):
+    # Mean and std (ddof=1) of windows of `size` values from the sums of the values and of their squares
+    mean = sums / size
+    var = np.maximum(squares - sums * mean, 0.0) / (size - 1)
+    return mean, np.sqrt(var)
+
+
+def closest_posture(values, centroids):
+    if not centroids:
+        return None
+    return min(centroids, key=lambda posture: np.linalg.norm(values - centroids[posture]))
+
+
+class TransitionDetector:
+    """
+    CUSUM change-point detector of the posture transitions, stream and batch mode.
+
+    Parameters:
+    centroids: dict {posture: mean deltas}, see posture_centroids(), None to emit events without label
+    settle_size: rows of the window in which a posture is stable
+    settle_std: std (cm) of every delta below which the window is stable
+    min_std: lower bound of the reference std (cm), the deltas are integers
+    drift: allowance of the CUSUM, in reference std
+    threshold: decision threshold of the CUSUM, in reference std
+    min_shift: smallest change (cm) of a delta between two postures reported as a transition
+    min_dwell: rows the new posture holds before the event is emitted
+    """
+
+    def __init__(self, centroids=None, settle_size=20, settle_std=8.0, min_std=4.0, drift=1.0, threshold=10.0,
+                 min_shift=20.0, min_dwell=50, n_columns=len(DELTA_COLUMNS)):
+        if settle_size < 2:
+            raise ValueError("settle_size must be at least 2 for a standard deviation")
+        if min_dwell < 1:
+            raise ValueError("min_dwell must be at least 1")
+
+        self.centroids = centroids
+        self.settle_size = settle_size
+        self.settle_std = settle_std
+        self.min_std = min_std
+        self.drift = drift
+        self.threshold = threshold
+        self.min_shift = min_shift
+        self.min_dwell = min_dwell
+        self.n_columns = n_columns
+        self.reset()
+
+    def reset(self):
+        self.mean = None
+        self.std = None
+        self.monitoring = False
+        self._before = None
+        self._onset = None
+        self._detected = None
+        self._end = None
+        self._dwell = 0
+        self._start_settling()
+
+    @property
+    def in_transition(self):
+        """
+        True from the detection of a change until its event is emitted (or the change is dropped).
+        """
+        return self._before is not None
+
+    def _start_settling(self):
+        self.monitoring = False
+        self._window = deque()
+        self._timestamps = deque()
+        self._window_sums = np.zeros(self.n_columns)
+        self._window_squares = np.zeros(self.n_columns)
+
+    def _start_monitoring(self, mean, std):
+        self.monitoring = True
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.std = np.maximum(np.asarray(std, dtype=np.float64), self.min_std)
+        # Upper then lower sums of each column, and the timestamp where each sum last left zero
+        self._sums = np.zeros(2 * self.n_columns)
+        self._onsets = [None] * (2 * self.n_columns)
+
+    def _event(self):
+        # Event of the pending transition, None if it is not a change of posture
+        before, self._before = self._before, None
+        after = self.mean
+        if np.max(np.abs(after - before)) < self.min_shift:
+            return None
+
+        label = None
+        if self.centroids:
+            postures = closest_posture(before, self.centroids), closest_posture(after, self.centroids)
+            if postures[0] == postures[1]:
+                return None
+            label = '_'.join(postures)
+        return TransitionEvent(self._onset, self._detected, self._end, before, after, label)
+
+    def update(self, timestamp, values):
+        """
+        Stream mode.
+
+        Parameters:
+        timestamp: timestamp (or index) of the row
+        values: sequence of the deltas of the row, in the order of DELTA_COLUMNS
+
+        Returns:
+        TransitionEvent(onset, detected, end, before, after, label) when a transition is over, None otherwise
+        """
+        if not self.monitoring:
+            values = np.asarray(values, dtype=np.float64)
+            self._timestamps.append(timestamp)
+            self._window.append(values)
+            self._window_sums += values
+            self._window_squares += values * values
+            if len(self._window) > self.settle_size:
+                self._timestamps.popleft()
+                oldest = self._window.popleft()
+                self._window_sums -= oldest
+                self._window_squares -= oldest * oldest
+            if len(self._window) < self.settle_size:
+                return None
+
+            mean, std = window_stats(self._window_sums, self._window_squares, self.settle_size)
+            if not (std < self.settle_std).all():
+                return None
+
+            self._start_monitoring(mean, std)
+            self._end = self._timestamps[0]
+            self._dwell = 0
+            return None
+
+        z = (np.asarray(values, dtype=np.float64) - self.mean) / self.std
+        sums = self._sums
+        previous = sums.copy()
+        sums[:self.n_columns] = np.maximum(0.0, sums[:self.n_columns] + z - self.drift)
+        sums[self.n_columns:] = np.maximum(0.0, sums[self.n_columns:] - z - self.drift)
+        for position in np.flatnonzero((previous == 0) & (sums > 0)):
+            self._onsets[position] = timestamp
+
+        alarms = np.flatnonzero(sums > self.threshold)
+        if len(alarms):
+            self._change_detected(min(self._onsets[position] for position in alarms), timestamp)
+            return None
+
+        self._dwell += 1
+        if self._before is not None and self._dwell == self.min_dwell:
+            return self._event()
+        return None
+
+    def _change_detected(self, onset, detected):
+        # A change before the end of the dwell continues the pending transition
+        if self._before is None:
+            self._before = self.mean
+            self._onset = onset
+            self._detected = detected
+        self._start_settling()
+
+    def run(self, timestamps, values):
+        """
+        Stream mode over a whole session, row by row.
+
+        Returns:
+        list of TransitionEvent
+        """
+        events = []
+        for timestamp, row in zip(np.asarray(timestamps).tolist(), np.asarray(values, dtype=np.float64)):
+            event = self.update(timestamp, row)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def detect(self, timestamps, values):
+        """
+        Batch mode, same events as run() for integer deltas (up to the rounding of the CUSUM sums otherwise).
+        The detector is reset first.
+
+        Parameters:
+        timestamps: array-like of the timestamps (or index) of the rows
+        values: 2D array-like of the deltas, one column per delta
+
+        Returns:
+        list of TransitionEvent
+        """
+        self.reset()
+        timestamps = np.asarray(timestamps)
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) < self.settle_size:
+            return []
+
+        # Window i holds the rows i .. i + settle_size - 1
+        sums = np.cumsum(np.vstack([np.zeros(self.n_columns), values]), axis=0)
+        squares = np.cumsum(np.vstack([np.zeros(self.n_columns), values * values]), axis=0)
+        window_mean, window_std = window_stats(sums[self.settle_size:] - sums[:-self.settle_size],
+                                               squares[self.settle_size:] - squares[:-self.settle_size],
+                                               self.settle_size)
+        # Rows that end a stable window, as row positions
+        stable_ends = np.flatnonzero((window_std < self.settle_std).all(axis=1)) + self.settle_size - 1
+
+        events = []
+        position = 0
+        while True:
+            # Settling: first stable window that starts at or after `position`
+            found = np.searchsorted(stable_ends, position + self.settle_size - 1)
+            if found == len(stable_ends):
+                break
+            end = stable_ends[found]
+            window = end - self.settle_size + 1
+            self._start_monitoring(window_mean[window], window_std[window])
+            self._end = timestamps[window].item()
+
+            # Monitoring: first row where a CUSUM exceeds the threshold
+            alarm = self._monitor(values, end + 1)
+            last_row = len(values) - 1 if alarm is None else alarm[0] - 1
+            if self._before is not None and last_row - end >= self.min_dwell:
+                event = self._event()
+                if event is not None:
+                    events.append(event)
+            if alarm is None:
+                break
+            alarm_row, onset_row = alarm
+            self._change_detected(timestamps[onset_row].item(), timestamps[alarm_row].item())
+            position = alarm_row + 1
+
+        self._start_settling()
+        return events
+
+    def _monitor(self, values, start):
+        # Lindley recursion s_t = max(0, s_t-1 + x_t) as c_t - min(0, min c_<=t) over the cumulative sums c,
+        # carried over blocks. Most postures are left after a few hundred rows: the blocks start small and double
+        # up to BLOCK_ROWS rows.
+        sums = np.zeros(2 * self.n_columns)
+        onsets = np.full(2 * self.n_columns, start)
+        block_start = start
+        block_rows = 64
+        while block_start < len(values):
+            z = (values[block_start:block_start + block_rows] - self.mean) / self.std
+            steps = np.concatenate([z - self.drift, -z - self.drift], axis=1)
+            cumulative = sums + np.cumsum(steps, axis=0)
+            block_sums = cumulative - np.minimum(np.minimum.accumulate(cumulative, axis=0), 0.0)
+
+            over = (block_sums > self.threshold).any(axis=1)
+            if over.any():
+                row = int(np.argmax(over))
+                block_sums = block_sums[:row + 1]
+                onsets = self._last_onsets(block_sums, block_start, onsets)
+                alarms = np.flatnonzero(block_sums[row] > self.threshold)
+                return block_start + row, int(onsets[alarms].min())
+
+            sums = block_sums[-1]
+            onsets = self._last_onsets(block_sums, block_start, onsets)
+            block_start += len(block_sums)
+            block_rows = min(2 * block_rows, BLOCK_ROWS)
+        return None
+
+    @staticmethod
+    def _last_onsets(block_sums, block_start, onsets):
+        # Onset of each sum at the end of the block: the row after the last row where it was zero
+        zero = block_sums[::-1] == 0
+        last_zero = len(block_sums) - 1 - np.argmax(zero, axis=0)
+        return np.where(zero.any(axis=0), block_start + last_zero + 1, onsets)
+
+
+def detect_transitions(df, centroids=None, columns=DELTA_COLUMNS, time_column='index', **parameters):
+    """
+    This function detects the posture transitions of a session in batch mode.
+
+    Parameters:
+    df (pd.DataFrame): DataFrame containing the delta columns and `time_column`
+    centroids: dict {posture: mean deltas}, see posture_centroids()
+    parameters: parameters of TransitionDetector
+
+    Returns:
+    list of TransitionEvent
+    """
+    detector = TransitionDetector(centroids, n_columns=len(columns), **parameters)
+    return detector.detect(df[time_column].to_numpy(), df[list(columns)].to_numpy())
+
+
+def labeled_transitions(df, time_column='index'):
+    """
+    This function returns the transitions annotated in a labeled DataFrame, rows labeled '<before>_<after>'.
+
+    Returns:
+    list of (start, end, label) of each annotated transition
+    """
+    labels = df['label'].to_numpy()
+    timestamps = df[time_column].to_numpy()
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    ends = np.r_[starts[1:], len(labels)] - 1
+    return [(timestamps[start].item(), timestamps[end].item(), labels[start])
+            for start, end in zip(starts, ends) if '_' in labels[start]]
+
+
+def match_events(events, transitions, tolerance=50):
+    """
+    This function matches the detected events with the annotated transitions. An event matches a transition if they
+    overlap, with `tolerance` rows of margin on each side of the transition. Each transition matches one event at most.
+
+    Returns:
+    dict: hits, misses, false_alarms, correct_labels, onset_errors (onset - start of the matched transitions)
+    """
+    matched = set()
+    hits = correct_labels = 0
+    onset_errors = []
+    for start, end, label in transitions:
+        candidates = [i for i, event in enumerate(events)
+                      if i not in matched and event.onset <= end + tolerance and event.end >= start - tolerance]
+        if not candidates:
+            continue
+        i = min(candidates, key=lambda i: abs(events[i].onset - start))
+        matched.add(i)
+        hits += 1
+        correct_labels += events[i].label == label
+        onset_errors.append(events[i].onset - start)
+
+    return {
+        'hits': hits,
+        'misses': len(transitions) - hits,
+        'false_alarms': len(events) - len(matched),
+        'correct_labels': correct_labels,
+        'onset_errors': onset_errors,
+    }
+
+
+if __name__ == "__main__":
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Detect the posture transitions of delta sessions")
+    parser.add_argument("sessions", nargs="+", help="csv files with the columns index, delta3_1, delta3_2, delta2_1")
+    parser.add_argument("--training", nargs="+",
+                        help="labeled sessions of the posture centroids, a scored session is left out of its own")
+    parser.add_argument("--stream", action="store_true", help="stream mode, row by row, instead of batch mode")
+    parser.add_argument("--tolerance", type=int, default=50, help="rows between an event and a labeled transition")
+    args = parser.parse_args()
+
+    training = {os.path.abspath(path): pd.read_csv(path)
+                for pattern in args.training or [] for path in sorted(glob.glob(pattern))}
+    totals = {'hits': 0, 'misses': 0, 'false_alarms': 0, 'correct_labels': 0, 'onset_errors': []}
+    rows = 0
+    elapsed = 0.0
+
+    for session in sorted(path for pattern in args.sessions for path in glob.glob(pattern)):
+        df = pd.read_csv(session)
+        if not set(DELTA_COLUMNS).issubset(df.columns):
+            continue
+
+        held_out = [df_training for path, df_training in training.items() if path != os.path.abspath(session)]
+        centroids = posture_centroids(pd.concat(held_out)) if held_out else None
+
+        start = time.perf_counter()
+        if args.stream:
+            events = TransitionDetector(centroids).run(df['index'].to_numpy(), df[DELTA_COLUMNS].to_numpy())
+        else:
+            events = detect_transitions(df, centroids)
+        elapsed += time.perf_counter() - start
+        rows += len(df)
+
+        print(f"{session}: {len(events)} transitions")
+        for event in events:
+            print(f"    {event.onset:>7} -> {event.end:<7} (detected at {event.detected}) {event.label}")
+
+        if 'label' in df.columns:
+            result = match_events(events, labeled_transitions(df), args.tolerance)
+            print(f"    {result['hits']} of {result['hits'] + result['misses']} labeled transitions detected, "
+                  f"{result['false_alarms']} false alarms, {result['correct_labels']} correct labels")
+            for key in totals:
+                totals[key] += result[key]
+
+    if rows and elapsed > 0:
+        print(f"{rows} rows in {elapsed:.3f} s ({rows / elapsed:.0f} rows/s, "
+              f"{'stream' if args.stream else 'batch'} mode)")
+    else:
+        print("No session with the delta columns")
+    if totals['hits'] + totals['misses']:
+        errors = np.abs(totals['onset_errors'])
+        print(f"Total: {totals['hits']} of {totals['hits'] + totals['misses']} labeled transitions detected, "
+              f"{totals['false_alarms']} false alarms, {totals['correct_labels']} correct labels, "
+              f"onset error median {np.median(errors) if len(errors) else float('nan'):.0f} rows")